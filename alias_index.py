@@ -0,0 +1,307 @@
+# Read-only alias -> (url, flags, expiry) hash index shared by every worker process through the
+# page cache. It is two files: a base hash table, rewritten only on a full publish or a
+# compaction, and a delta log of the changes published since, which readers overlay on the
+# base. Publishing a handful of changes appends one batch to the delta instead of rewriting
+# the whole table; once the delta outgrows a fraction of the base it is folded into a new base.
+#
+# Base layout: HEADER (magic, generation, slot count, entry count), then an open-addressing
+# table of SLOTs (crc32 of the alias, record offset; offset 0 is an empty slot), then the
+# records: RECORD (expiry or NaN, flags, alias length, url length), alias bytes, url bytes.
+#
+# Delta layout (path + ".delta"): DELTA_HEADER (magic, generation of the base it applies to),
+# then batches of BATCH (generation, record count) followed by that many records. A record
+# with flags REMOVED deletes the alias. Readers only apply complete batches.
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b"ALIASIX1"
+HEADER = struct.Struct("<8sQQQ")
+SLOT = struct.Struct("<IQ")
+RECORD = struct.Struct("<dBHI")
+DELTA_MAGIC = b"ALIASDL1"
+DELTA_HEADER = struct.Struct("<8sQ")
+BATCH = struct.Struct("<QI")
+
+# Set in flags for links that moved to the cold tier, above the Link.flags bits
+EXPIRED_BIT = 0x80
+# Flags of a delta record that removes its alias
+REMOVED = 0xFF
+
+# The delta is folded into a new base once it is larger than this, and than base size / 8
+COMPACT_MIN_BYTES = 64 * 1024
+
+
+def delta_path(path):
+    return path + ".delta"
+
+def encode_record(alias, entry):
+    key = alias.encode()
+    if entry is None:
+        return RECORD.pack(math.nan, REMOVED, len(key), 0) + key
+    url, flags, expiry = entry
+    target = url.encode()
+    return RECORD.pack(math.nan if expiry is None else expiry, flags, len(key), len(target)) + key + target
+
+def decode_record(raw, pos):
+    # (alias, entry or None when removed, position after the record)
+    expiry, flags, alias_len, url_len = RECORD.unpack_from(raw, pos)
+    pos += RECORD.size
+    alias = bytes(raw[pos:pos + alias_len]).decode()
+    url = bytes(raw[pos + alias_len:pos + alias_len + url_len]).decode()
+    pos += alias_len + url_len
+    if flags == REMOVED:
+        return alias, None, pos
+    return alias, (url, flags, None if math.isnan(expiry) else expiry), pos
+
+def read_batches(raw, pos, changes):
+    # Applies the complete batches from pos on to changes. Returns (last generation or None,
+    # position after the last complete batch); a batch still being appended is left for later.
+    generation = None
+    end = len(raw)
+    while pos + BATCH.size <= end:
+        batch_generation, count = BATCH.unpack_from(raw, pos)
+        cursor = pos + BATCH.size
+        batch = []
+        for _ in range(count):
+            if cursor + RECORD.size > end:
+                return generation, pos
+            _, _, alias_len, url_len = RECORD.unpack_from(raw, cursor)
+            if cursor + RECORD.size + alias_len + url_len > end:
+                return generation, pos
+            alias, entry, cursor = decode_record(raw, cursor)
+            batch.append((alias, entry))
+        changes.update(batch)
+        generation = batch_generation
+        pos = cursor
+    return generation, pos
+
+def read_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def read_delta(path, base_generation):
+    # (last generation or None, changes), or None when there is no delta for base_generation
+    raw = read_file(delta_path(path))
+    if raw is None or len(raw) < DELTA_HEADER.size:
+        return None
+    magic, generation = DELTA_HEADER.unpack_from(raw, 0)
+    if magic != DELTA_MAGIC or generation != base_generation:
+        return None
+    changes = {}
+    return read_batches(raw, DELTA_HEADER.size, changes)[0], changes
+
+def read_entries(path):
+    # Every (alias, (url, flags, expiry)) currently published, plus the generation
+    raw = read_file(path)
+    if raw is None:
+        return 0, {}
+    magic, generation, slots, count = HEADER.unpack_from(raw, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an alias index")
+    entries = {}
+    pos = HEADER.size + slots * SLOT.size
+    for _ in range(count):
+        alias, entry, pos = decode_record(raw, pos)
+        entries[alias] = entry
+    delta_generation, changes = read_delta(path, generation) or (None, {})
+    for alias, entry in changes.items():
+        if entry is None:
+            entries.pop(alias, None)
+        else:
+            entries[alias] = entry
+    return delta_generation or generation, entries
+
+def replace_file(path, chunks):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+def write(path, entries, generation):
+    # A new base, then an empty delta for it. A reader that sees the new base with the old
+    # delta ignores the delta (its base generation no longer matches); the base already has it.
+    slots = 1 << max(3, (2 * len(entries)).bit_length())
+    mask = slots - 1
+    table = bytearray(slots * SLOT.size)
+    body = bytearray()
+    data_start = HEADER.size + len(table)
+    for alias, entry in entries.items():
+        key = alias.encode()
+        offset = data_start + len(body)
+        body += encode_record(alias, entry)
+        h = zlib.crc32(key)
+        i = h & mask
+        while SLOT.unpack_from(table, i * SLOT.size)[1]:
+            i = (i + 1) & mask
+        SLOT.pack_into(table, i * SLOT.size, h, offset)
+    replace_file(path, [HEADER.pack(MAGIC, generation, slots, len(entries)), table, body])
+    replace_file(delta_path(path), [DELTA_HEADER.pack(DELTA_MAGIC, generation)])
+
+def current_generation(path):
+    # (latest generation, whether the delta can be appended to)
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return 0, False
+    base_generation = HEADER.unpack(header)[1]
+    delta = read_delta(path, base_generation)
+    if delta is None:
+        return base_generation, False
+    return delta[0] or base_generation, True
+
+def publish(path, changes, base=None):
+    # Applies changes (alias -> entry, or None to remove it) on top of base, or on top of the
+    # currently published generation. The lock file serializes publishers across processes.
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        generation, appendable = current_generation(path)
+        generation += 1
+        if base is not None or not appendable:
+            entries = dict(base) if base is not None else read_entries(path)[1]
+            for alias, entry in changes.items():
+                if entry is None:
+                    entries.pop(alias, None)
+                else:
+                    entries[alias] = entry
+            write(path, entries, generation)
+            return generation
+
+        batch = b"".join(encode_record(alias, entry) for alias, entry in changes.items())
+        with open(delta_path(path), "ab") as f:
+            f.write(BATCH.pack(generation, len(changes)) + batch)
+            delta_size = f.tell()
+        if delta_size > max(COMPACT_MIN_BYTES, os.path.getsize(path) // 8):
+            write(path, read_entries(path)[1], generation)
+    return generation
+
+
+class SharedAliasIndex:
+    # Reader side. get() stats the files at most every check_interval seconds: a new base is
+    # remapped, and only the delta bytes appended since the last check are read. A swapped-out
+    # mapping is left to be garbage collected, since another thread may still be reading it.
+    # on_change(aliases) is called with the aliases a reload changed, or None when a new base
+    # may have changed any of them.
+
+    def __init__(self, path, check_interval=1.0, on_change=None):
+        self.path = path
+        self.check_interval = check_interval
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.table = None
+        self.identity = None
+        self.base_generation = None
+        self.overlay = {}
+        self.delta_identity = None
+        self.delta_offset = 0
+        self.checked_at = 0
+        self.generation = 0
+
+    @property
+    def loaded(self):
+        return self.table is not None
+
+    def reload(self):
+        with self.lock:
+            self.checked_at = time.monotonic()
+            changed = self.reload_base()
+            return self.reload_delta() or changed
+
+    def reload_base(self):
+        try:
+            with open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                identity = (stat.st_ino, stat.st_mtime_ns)
+                if identity == self.identity:
+                    return False
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+        magic, generation, slots, _ = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            return False
+        self.table = (buffer, slots - 1)
+        self.identity = identity
+        self.base_generation = self.generation = generation
+        # The old overlay was relative to the old base
+        self.overlay = {}
+        self.delta_identity = None
+        if self.on_change is not None:
+            self.on_change(None)
+        return True
+
+    def reload_delta(self):
+        if self.table is None:
+            return False
+        try:
+            with open(delta_path(self.path), "rb") as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != self.delta_identity:
+                    header = f.read(DELTA_HEADER.size)
+                    if len(header) < DELTA_HEADER.size:
+                        return False
+                    magic, generation = DELTA_HEADER.unpack(header)
+                    if magic != DELTA_MAGIC or generation != self.base_generation:
+                        # Written for a base this reader has not mapped yet
+                        return False
+                    self.delta_identity = stat.st_ino
+                    self.delta_offset = DELTA_HEADER.size
+                    self.overlay = {}
+                if stat.st_size <= self.delta_offset:
+                    return False
+                f.seek(self.delta_offset)
+                raw = f.read()
+        except FileNotFoundError:
+            return False
+        changes = {}
+        generation, consumed = read_batches(raw, 0, changes)
+        self.delta_offset += consumed
+        if generation is None:
+            return False
+        # One update() call, so concurrent get() calls never see a half-applied batch
+        self.overlay.update(changes)
+        self.generation = generation
+        if self.on_change is not None:
+            self.on_change(changes)
+        return True
+
+    def refresh(self):
+        # Reloads if check_interval has passed since the last check
+        if time.monotonic() - self.checked_at >= self.check_interval:
+            self.reload()
+
+    def get(self, alias):
+        self.refresh()
+        table = self.table
+        if table is None:
+            return None
+        overlay = self.overlay
+        if alias in overlay:
+            return overlay[alias]
+        buffer, mask = table
+        key = alias.encode()
+        h = zlib.crc32(key)
+        i = h & mask
+        while True:
+            slot_hash, offset = SLOT.unpack_from(buffer, HEADER.size + i * SLOT.size)
+            if offset == 0:
+                return None
+            if slot_hash == h:
+                expiry, flags, alias_len, url_len = RECORD.unpack_from(buffer, offset)
+                start = offset + RECORD.size
+                if buffer[start:start + alias_len] == key:
+                    url = buffer[start + alias_len:start + alias_len + url_len].decode()
+                    return url, flags, None if math.isnan(expiry) else expiry
+            i = (i + 1) & mask
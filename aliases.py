@@ -0,0 +1,128 @@
+# Collision-free alias allocation: a shared counter handed out in leased blocks, encoded as
+# base62 and optionally shuffled so consecutive aliases do not look sequential.
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import string
+import threading
+
+BASE62 = string.ascii_letters + string.digits
+
+
+def encode_base62(n, width=0):
+    chars = []
+    while n:
+        n, rem = divmod(n, 62)
+        chars.append(BASE62[rem])
+    return ''.join(reversed(chars)).rjust(width, BASE62[0])
+
+
+class FeistelPermutation:
+    # Keyed bijection on range(size): a balanced Feistel network over the next even bit
+    # width, cycle-walking any output that falls outside the range back into it
+
+    ROUNDS = 4
+
+    def __init__(self, size, key):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        digest = hashlib.sha256(str(key).encode()).digest()
+        self.round_keys = [int.from_bytes(digest[i * 4:i * 4 + 4], "big") for i in range(self.ROUNDS)]
+
+    def round(self, value, key):
+        value = ((value ^ key) * 0x45d9f3b) & 0xffffffff
+        value ^= value >> 16
+        return value & self.half_mask
+
+    def encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.round_keys:
+            left, right = right, left ^ self.round(right, key)
+        return (left << self.half_bits) | right
+
+    def __call__(self, n):
+        value = self.encrypt(n)
+        while value >= self.size:
+            value = self.encrypt(value)
+        return value
+
+
+class FileLeaseStore:
+    # Counters in a small JSON file; flock serializes leases across processes on one host
+    # (or across replicas sharing the volume)
+
+    def __init__(self, path):
+        self.path = path
+
+    def lease(self, namespace, size):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            counters = json.loads(f.read() or "{}")
+            start = counters.get(namespace, 0)
+            counters[namespace] = start + size
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(counters))
+            f.flush()
+            os.fsync(f.fileno())
+        return start
+
+
+class SqliteLeaseStore:
+    # Counters in the SQLite database, leased inside an IMMEDIATE transaction
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        with sqlite3.connect(db_file) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS alias_leases (namespace TEXT PRIMARY KEY, next INTEGER NOT NULL)")
+
+    def lease(self, namespace, size):
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT next FROM alias_leases WHERE namespace = ?", (namespace,)).fetchone()
+            start = row[0] if row else 0
+            conn.execute("INSERT OR REPLACE INTO alias_leases (namespace, next) VALUES (?, ?)", (namespace, start + size))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return start
+
+
+class AliasAllocator:
+    # Hands out aliases from a leased block of counter values; a new block is leased from the
+    # shared store only when the current one runs out, so there is no existence-check loop.
+    # Values past the width's capacity simply encode to longer aliases.
+
+    def __init__(self, lease_store, namespace="links", width=6, block_size=1000, shuffle_key=None):
+        self.lease_store = lease_store
+        self.namespace = namespace
+        self.width = width
+        self.block_size = block_size
+        self.capacity = 62 ** width
+        self.permute = FeistelPermutation(self.capacity, shuffle_key) if shuffle_key else None
+        self.lock = threading.Lock()
+        self.next_value = 0
+        self.block_end = 0
+
+    def next_id(self):
+        with self.lock:
+            if self.next_value >= self.block_end:
+                self.next_value = self.lease_store.lease(self.namespace, self.block_size)
+                self.block_end = self.next_value + self.block_size
+            value = self.next_value
+            self.next_value += 1
+        return value
+
+    def next_alias(self):
+        value = self.next_id()
+        if value < self.capacity:
+            if self.permute is not None:
+                value = self.permute(value)
+            return encode_base62(value, self.width)
+        return encode_base62(value)
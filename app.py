@@ -1,11 +1,34 @@
-import json
 import os
 import string
 import random
+import atexit
+import contextvars
 import hashlib
+import hmac
+import json
+import logging
+import signal
+import threading
+import time
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, jsonify, request, redirect, render_template_string, session
+from urllib.parse import urlencode
+from flask import Flask, g, jsonify, request, redirect, session, stream_with_context
+from alias_index import EXPIRED_BIT, SharedAliasIndex, publish as publish_alias_generation
+from aliases import AliasAllocator, FileLeaseStore, SqliteLeaseStore
+from archive import ClickArchive, RawClickRetention, as_buffer
+from assets import CACHE_CONTROL, AssetRegistry, pick_encoding
+from clicks import ClickWriter
+import exports
+import metrics as prometheus
+import rollups
+from models import FLAG_PASSWORD, FLAG_UTM, Link, parse_created
+from indexes import ACTIVE, EXPIRED, EXPIRING_SOON, ExpiryIndex, LinkSearchIndex, UserLinkIndex, UserStats, expiry_stage
+import pagination
+from profiler import SamplingProfiler
+from redirect_cache import RedirectCache
+from snapshot import LazyAnalytics
+from storage import Conflict, JsonStorage, JournalStorage, SnapshotStorage, SqliteStorage, apply_click, new_analytics
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-123')
@@ -13,39 +36,664 @@ app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-123')
 # --- CONFIGURATION ---
 DATA_FILE = "urls.json"
 USER_FILE = "users.json"
+# 'json' rewrites DATA_FILE on every change, 'journal' appends changes to JOURNAL_FILE,
+# 'snapshot' is journal mode compacted into the binary SNAPSHOT_FILE,
+# 'sqlite' writes individual rows to SQLITE_FILE
+STORAGE_MODE = os.environ.get('STORAGE_MODE', 'json')
+JOURNAL_FILE = os.environ.get('JOURNAL_FILE', 'urls.journal')
+SNAPSHOT_FILE = os.environ.get('SNAPSHOT_FILE', 'urls.snap')
+JOURNAL_COMPACT_BYTES = int(os.environ.get('JOURNAL_COMPACT_BYTES', 4 * 1024 * 1024))
+JOURNAL_COMPACT_INTERVAL = float(os.environ.get('JOURNAL_COMPACT_INTERVAL', 30))
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'urls.db')
+# Click recording runs off the redirect path; see clicks.py for the overflow policies
+CLICK_QUEUE_SIZE = int(os.environ.get('CLICK_QUEUE_SIZE', 10000))
+CLICK_BATCH_SIZE = int(os.environ.get('CLICK_BATCH_SIZE', 500))
+CLICK_FLUSH_INTERVAL = float(os.environ.get('CLICK_FLUSH_INTERVAL', 0.5))
+CLICK_QUEUE_POLICY = os.environ.get('CLICK_QUEUE_POLICY', 'drop')
+# Recent raw clicks kept in memory; older ones go to the archive (empty dir disables archiving)
+RAW_CLICKS_PER_ALIAS = int(os.environ.get('RAW_CLICKS_PER_ALIAS', 1000))
+RAW_CLICK_BUDGET = int(os.environ.get('RAW_CLICK_BUDGET', 1000000))
+CLICK_ARCHIVE_DIR = os.environ.get('CLICK_ARCHIVE_DIR', 'click-archive')
+# 'random' picks aliases and retries on collision; 'counter' allocates them from leased counter blocks
+ALIAS_MODE = os.environ.get('ALIAS_MODE', 'random')
+ALIAS_BLOCK_SIZE = int(os.environ.get('ALIAS_BLOCK_SIZE', 1000))
+ALIAS_SHUFFLE_KEY = os.environ.get('ALIAS_SHUFFLE_KEY', '')
+ALIAS_LEASE_FILE = os.environ.get('ALIAS_LEASE_FILE', 'alias-leases.json')
+# Resolved redirects for links without a password or UTM tracking (size 0 disables the cache)
+REDIRECT_CACHE_SIZE = int(os.environ.get('REDIRECT_CACHE_SIZE', 10000))
+REDIRECT_CACHE_TTL = float(os.environ.get('REDIRECT_CACHE_TTL', 300))
+# Largest batch accepted by /api/shorten/bulk, in links and in request bytes
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 10000))
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_BYTES', BULK_MAX_ITEMS * 4096))
+# Rows per lock hold and storage write in /api/import
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+# Shared memory-mapped alias index that go() resolves through, for multi-worker deployments
+# ('' disables it). Changes are published at most every ALIAS_INDEX_INTERVAL seconds, and
+# readers look for a new generation just as often.
+ALIAS_INDEX_FILE = os.environ.get('ALIAS_INDEX_FILE', '')
+ALIAS_INDEX_INTERVAL = float(os.environ.get('ALIAS_INDEX_INTERVAL', 1))
+# How often expired links are moved out of the hot link map (0 disables the reaper thread)
+REAPER_INTERVAL = float(os.environ.get('REAPER_INTERVAL', 60))
+# /health/ready fails once more clicks than this are queued, or once clicks have been
+# waiting on a successful write for longer than READY_MAX_WRITE_AGE seconds
+READY_MAX_CLICK_BACKLOG = int(os.environ.get('READY_MAX_CLICK_BACKLOG', CLICK_QUEUE_SIZE // 2))
+READY_MAX_WRITE_AGE = float(os.environ.get('READY_MAX_WRITE_AGE', 30))
+# Requests slower than this are logged with a per-phase timing breakdown (0 disables), as
+# NDJSON to SLOW_REQUEST_LOG or through the slow_requests logger when that is ''
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_LOG = os.environ.get('SLOW_REQUEST_LOG', '')
+# Sampling profiler: PROFILE_ON_START profiles the first N seconds after startup, and
+# POST /admin/profile (enabled by setting ADMIN_TOKEN) profiles a window on demand
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 300))
+PROFILE_ON_START = float(os.environ.get('PROFILE_ON_START', 0))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Guards url_data mutations together with the storage writes that record them
+data_lock = threading.RLock()
+
+# --- METRICS ---
+# Scraped from /metrics; the gauges are read from app state at scrape time
+metrics = prometheus.Registry()
+# Anything else is counted as "other", so clients cannot create label values at will
+METRIC_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+request_count = metrics.counter("shortener_http_requests_total", "HTTP requests by route, method and status",
+                                ("route", "method", "status"))
+request_latency = metrics.histogram("shortener_http_request_duration_seconds",
+                                    "Time from routing to the response being returned, by route", ("route",))
+storage_write_latency = metrics.histogram("shortener_storage_write_seconds",
+                                          "Storage writes by operation (save, put_link, clicks, compact, ...)", ("op",))
+metrics.gauge("shortener_startup_seconds", "Startup time by phase (load is load_data plus users)",
+              lambda: {(phase,): seconds for phase, seconds in startup_timings.items()}, ("phase",))
+metrics.gauge("shortener_storage_bytes_written_total", "Bytes written to the data, journal and snapshot files",
+              lambda: storage.bytes_written.value if storage.bytes_written is not None else None, kind="counter")
+metrics.gauge("shortener_storage_file_bytes", "Size of each storage file",
+              lambda: storage_file_sizes(), ("file",))
+metrics.gauge("shortener_links", "Links by tier", lambda: {
+    ("live",): len(url_data["links"]),
+    ("expired",): len(url_data.get("expired", {}))
+}, ("tier",))
+metrics.gauge("shortener_link_clicks", "Clicks recorded on current links",
+              lambda: link_clicks_total())
+metrics.gauge("shortener_users", "Registered users", lambda: len(users))
+metrics.gauge("shortener_click_queue_pending", "Clicks waiting for the click writer", lambda: click_writer.pending())
+metrics.gauge("shortener_click_writer_events_total", "Clicks handled by the click writer, by outcome", lambda: {
+    ("written",): click_writer.written,
+    ("dropped",): click_writer.dropped,
+    ("skipped",): click_writer.skipped,
+    ("failed",): click_writer.failed
+}, ("outcome",), kind="counter")
+metrics.gauge("shortener_redirect_cache_lookups_total", "Redirect cache lookups by result", lambda: {
+    ("hit",): redirect_cache.hits,
+    ("miss",): redirect_cache.misses
+}, ("result",), kind="counter")
+
+# --- PROFILING ---
+profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000)
+slow_request_log = logging.getLogger("slow_requests")
+# [current phase, when it began, seconds per finished phase] for the request on this thread.
+# A context variable rather than flask.g, which costs a proxy lookup on every enter_phase.
+phase_state = contextvars.ContextVar("phase_state", default=None)
+if SLOW_REQUEST_LOG:
+    slow_request_handler = logging.FileHandler(SLOW_REQUEST_LOG)
+    slow_request_handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_request_log.addHandler(slow_request_handler)
+    slow_request_log.propagate = False
+
+def enter_phase(name):
+    # Charges the time since the current phase began to it and starts timing `name`.
+    # Requests begin in "dispatch" (routing, session, auth); the last phase ends with the view.
+    if SLOW_REQUEST_MS > 0:
+        state = phase_state.get()
+        if state is not None:
+            now = time.perf_counter()
+            phases = state[2]
+            phases[state[0]] = phases.get(state[0], 0) + now - state[1]
+            state[0], state[1] = name, now
+
+def log_slow_request(response, duration):
+    enter_phase(None)
+    state = phase_state.get()
+    slow_request_log.warning(json.dumps({
+        "timestamp": datetime.now().isoformat(),
+        "route": request.endpoint or "unmatched",
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 3),
+        "phases_ms": {name: round(t * 1000, 3) for name, t in state[2].items()} if state else {},
+        "request_bytes": request.content_length or 0,
+        # None for streamed responses, which are timed to the first byte
+        "response_bytes": response.content_length
+    }))
+
+def profile_path():
+    return os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed")
+
+def start_profile(seconds):
+    # Returns the output file, or None if a profile is already being taken
+    path = profile_path()
+    if not profiler.start(min(seconds, PROFILE_MAX_SECONDS), path):
+        return None
+    app.logger.info("Profiling for %.1fs into %s", min(seconds, PROFILE_MAX_SECONDS), path)
+    return path
+
+def storage_file_sizes():
+    sizes = {}
+    for path in storage.files():
+        try:
+            sizes[(os.path.basename(path),)] = os.path.getsize(path)
+        except OSError:
+            continue
+    return sizes
+
+def link_clicks_total():
+    # Under the lock: a concurrent shorten can add a user to by_user mid-iteration
+    with data_lock:
+        return sum(counters["total_clicks"] for counters in user_stats.by_user.values())
 
 # --- PERSISTENCE LOGIC ---
+def open_storage():
+    if STORAGE_MODE == 'sqlite':
+        return SqliteStorage(SQLITE_FILE)
+    if STORAGE_MODE == 'journal':
+        return JournalStorage(DATA_FILE, USER_FILE, JOURNAL_FILE, JOURNAL_COMPACT_BYTES)
+    if STORAGE_MODE == 'snapshot':
+        return SnapshotStorage(DATA_FILE, USER_FILE, JOURNAL_FILE, SNAPSHOT_FILE, JOURNAL_COMPACT_BYTES)
+    return JsonStorage(DATA_FILE, USER_FILE)
+
+def trim_loaded_clicks(data):
+    # Returns the (alias, click) pairs trimmed from the loaded buffers
+    # Lazily loaded analytics are already in this shape; only touch what is decoded
+    analytics_map = data["analytics"]
+    loaded = analytics_map.loaded_items() if isinstance(analytics_map, LazyAnalytics) else analytics_map.items()
+    evicted = []
+    for alias, analytics in loaded:
+        rollups.backfill(analytics)
+        analytics["clicks"] = as_buffer(analytics.get("clicks", []))
+        evicted.extend((alias, click) for click in raw_retention.trim(alias, analytics["clicks"]))
+    return evicted
+
 def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
-    return {"links": {}, "analytics": {}}
+    data = storage.load_base()
+    # The base file's clicks were never archived (they were still buffered when it was
+    # written, or it is a legacy file with every click), so the excess is archived now
+    evicted = trim_loaded_clicks(data)
+    storage.replay(data)
+    # Not archived: replayed clicks pushed out here were archived when evicted at runtime
+    trim_loaded_clicks(data)
+    if evicted:
+        archive_clicks(evicted)
+        # Rewrite the base file so the next start does not archive the same clicks again
+        timed_write("compact", storage.compact, data)
+    return data
+
+def archive_clicks(events):
+    if events and click_archive is not None:
+        try:
+            click_archive.write(events)
+        except OSError as e:
+            app.logger.error("Failed to archive %d clicks: %s", len(events), e)
+
+def forget_archived_clicks(alias):
+    # Hides the deleted link's archived clicks from whoever creates the alias next
+    if click_archive is not None:
+        try:
+            click_archive.forget(alias, datetime.now().isoformat())
+        except OSError as e:
+            app.logger.error("Failed to record the deletion of %s in the click archive: %s", alias, e)
+
+def timed_write(op, write, *args):
+    # Every storage write goes through here so its latency is recorded under op
+    started = time.perf_counter()
+    try:
+        return write(*args)
+    finally:
+        storage_write_latency.labels(op).observe(time.perf_counter() - started)
 
 def save_data():
-    with open(DATA_FILE, "w") as f:
-        json.dump(url_data, f, indent=4)
+    # Under the lock so the snapshot never sees a half-applied change
+    with data_lock:
+        timed_write("save", storage.save_snapshot, url_data)
 
 def load_users():
-    if os.path.exists(USER_FILE):
-        with open(USER_FILE, "r") as f:
-            return json.load(f)
-    return {}
+    return storage.load_users()
 
 def save_users():
-    with open(USER_FILE, "w") as f:
-        json.dump(users, f, indent=4)
+    timed_write("save_users", storage.save_users, users)
+
+def compact_storage():
+    with data_lock:
+        timed_write("compact", storage.compact, url_data)
+
+def compactor_loop():
+    while True:
+        time.sleep(JOURNAL_COMPACT_INTERVAL)
+        try:
+            if storage.needs_compaction():
+                compact_storage()
+        except Exception:
+            app.logger.exception("Storage compaction failed")
+
+def start_compactor():
+    thread = threading.Thread(target=compactor_loop, name="storage-compactor", daemon=True)
+    thread.start()
+    return thread
+
+def write_clicks(batch):
+    # One storage commit per batch of (alias, epoch, ip, user_agent, referrer) tuples.
+    # Returns how many clicks were recorded.
+    evicted = []
+    with data_lock:
+        events = []
+        remote = []
+        for alias, ts, ip, user_agent, referrer in batch:
+            click = {
+                "timestamp": datetime.fromtimestamp(ts).isoformat(),
+                "ip": ip,
+                "user_agent": user_agent,
+                "referrer": referrer
+            }
+            if alias not in url_data["links"]:
+                # Created by another worker: a shared store holds its row even though url_data does not
+                if storage.shared and shared_index is not None and shared_index.get(alias) is not None:
+                    remote.append((alias, click))
+                continue
+            apply_click(url_data, alias, click, ts)
+            user_stats.click(alias)
+            events.append((alias, click))
+            if alias in url_data["analytics"]:
+                for old in raw_retention.trim(alias, url_data["analytics"][alias]["clicks"]):
+                    evicted.append((alias, old))
+        if events or remote:
+            timed_write("clicks", storage.add_clicks, url_data, events + remote)
+    # Archive I/O happens outside the lock
+    archive_clicks(evicted)
+    return len(events) + len(remote)
+
+def flush_on_sigterm(signum, frame):
+    click_writer.stop()
+    previous = previous_sigterm_handler
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        raise SystemExit(0)
+
+def install_sigterm_flush():
+    global previous_sigterm_handler
+    # signal handlers can only be installed from the main thread
+    if threading.current_thread() is threading.main_thread():
+        previous = signal.signal(signal.SIGTERM, flush_on_sigterm)
+        # Installed again in a forked child: keep chaining to the original handler
+        if previous is not flush_on_sigterm:
+            previous_sigterm_handler = previous
+
+def rebuild_indexes():
+    with data_lock:
+        url_data.setdefault("expired", {})
+        all_links = dict(url_data["expired"], **url_data["links"])
+        user_link_index.rebuild(all_links)
+        search_index.rebuild(all_links)
+        user_stats.rebuild(all_links, time.time())
+        expiry_index.rebuild(url_data["links"])
+        redirect_cache.clear()
+
+def invalidate_redirects(aliases):
+    # Called by the shared alias index with what other processes changed; None is everything
+    if aliases is None:
+        redirect_cache.clear()
+    else:
+        for alias in aliases:
+            redirect_cache.invalidate(alias)
+
+def find_link(alias):
+    # Live links first, then the cold tier of expired ones
+    link = url_data["links"].get(alias)
+    if link is None:
+        link = url_data["expired"].get(alias)
+    return link
+
+def links_for_user(user_id):
+    with data_lock:
+        return {alias: find_link(alias) for alias in user_link_index.aliases(user_id)}
+
+def reap_expired(now=None):
+    with data_lock:
+        aliases = expiry_index.pop_expired(now if now is not None else time.time())
+        for alias in aliases:
+            url_data["expired"][alias] = url_data["links"].pop(alias)
+            redirect_cache.invalidate(alias)
+            mark_alias_changed(alias)
+        if aliases:
+            timed_write("expire_links", storage.expire_links, url_data, aliases)
+    return aliases
+
+def reaper_loop():
+    while True:
+        time.sleep(REAPER_INTERVAL)
+        try:
+            reap_expired()
+        except Exception:
+            app.logger.exception("Expiry reaper failed")
+
+def start_reaper():
+    thread = threading.Thread(target=reaper_loop, name="expiry-reaper", daemon=True)
+    thread.start()
+    return thread
+
+def alias_entry(alias):
+    link = url_data["links"].get(alias)
+    if link is not None:
+        return link.url, link.flags, link.expiry
+    link = url_data["expired"].get(alias)
+    if link is not None:
+        return link.url, link.flags | EXPIRED_BIT, link.expiry
+    return None
+
+def mark_alias_changed(alias):
+    # Caller holds data_lock. Until the change is published, go() reads this alias from url_data.
+    global alias_change_seq
+    if shared_index is not None:
+        alias_change_seq += 1
+        unpublished_aliases[alias] = alias_change_seq
 
+def alias_taken(alias):
+    # Caller holds data_lock. Other workers' links are only in the shared index.
+    if find_link(alias) is not None:
+        return True
+    return shared_index is not None and alias not in unpublished_aliases and shared_index.get(alias) is not None
+
+def find_user(username):
+    # Users registered in other worker processes are only in shared storage
+    user = users.get(username)
+    if user is None:
+        user = storage.get_user(username)
+        if user is not None:
+            users.setdefault(username, user)
+    return user
+
+def resolve_alias(alias):
+    # (url, flags, expiry) for go(), from the shared index when there is one. Once it is
+    # loaded the index is authoritative: this process's url_data may still hold a link another
+    # worker deleted, and lacks the links other workers created.
+    if shared_index is not None and alias not in unpublished_aliases:
+        entry = shared_index.get(alias)
+        if entry is not None or shared_index.loaded:
+            return entry
+    return alias_entry(alias)
+
+def publish_alias_index(full=False):
+    # Publishes this process's unpublished changes (or every link, when full) as a new
+    # generation of the shared index, merged into what other processes have published
+    with data_lock:
+        published = dict(unpublished_aliases)
+        changes = {alias: alias_entry(alias) for alias in published}
+        base = None
+        if full:
+            base = {alias: alias_entry(alias) for alias in list(url_data["expired"]) + list(url_data["links"])}
+    if not changes and base is None:
+        return
+    publish_alias_generation(ALIAS_INDEX_FILE, changes, base)
+    shared_index.reload()
+    with data_lock:
+        for alias, seq in published.items():
+            if unpublished_aliases.get(alias) == seq:
+                del unpublished_aliases[alias]
+
+def alias_index_loop():
+    while True:
+        time.sleep(ALIAS_INDEX_INTERVAL)
+        try:
+            publish_alias_index()
+        except Exception:
+            app.logger.exception("Publishing the alias index failed")
+
+def start_alias_index_publisher():
+    thread = threading.Thread(target=alias_index_loop, name="alias-index-publisher", daemon=True)
+    thread.start()
+    return thread
+
+def stats_for_user(user_id):
+    with data_lock:
+        return user_stats.get(user_id, time.time())
+
+LINK_STATUSES = {ACTIVE: "active", EXPIRING_SOON: "expiring", EXPIRED: "expired"}
+
+def link_status(alias, link, now):
+    if alias in url_data["expired"]:
+        return "expired"
+    return LINK_STATUSES[expiry_stage(link.expiry, now)]
+
+def parse_flag(name, value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+def user_link_page(user_id, args):
+    # One page of the user's links, filtered and sorted by the query args shared by the
+    # dashboard and /api/links. Raises ValueError for invalid args.
+    now = time.time()
+    items = links_for_user(user_id).items()
+    status = args.get('status')
+    if status:
+        if status not in LINK_STATUSES.values():
+            raise ValueError(f"Unknown status: {status}")
+        items = [(alias, link) for alias, link in items if link_status(alias, link, now) == status]
+    for name, flag in (('password', FLAG_PASSWORD), ('utm', FLAG_UTM)):
+        if args.get(name):
+            wanted = parse_flag(name, args[name])
+            items = [(alias, link) for alias, link in items if bool(link.flags & flag) == wanted]
+    try:
+        limit = int(args.get('limit', pagination.DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    return pagination.page(items, args.get('sort', 'created'), args.get('order', 'desc'), args.get('cursor'), limit)
+
+def link_summary(alias, link, now):
+    return {
+        "alias": alias,
+        "url": link.url,
+        "created": link.created,
+        "clicks": link.clicks,
+        "expiry_date": link.expiry_date,
+        "password_protected": bool(link.flags & FLAG_PASSWORD),
+        "utm_tracking": link.utm_tracking,
+        "status": link_status(alias, link, now)
+    }
+
+def page_url(args, cursor):
+    query = {name: value for name, value in args.items() if name != 'cursor'}
+    if cursor:
+        query['cursor'] = cursor
+    return '?' + urlencode(query) if query else '/'
+
+def open_alias_allocators():
+    if ALIAS_MODE != 'counter':
+        return None, None
+    # Replicas must share the lease store: the SQLite database or a common volume
+    lease_store = SqliteLeaseStore(SQLITE_FILE) if STORAGE_MODE == 'sqlite' else FileLeaseStore(ALIAS_LEASE_FILE)
+    links = AliasAllocator(lease_store, "links", 6, ALIAS_BLOCK_SIZE, ALIAS_SHUFFLE_KEY or None)
+    user_ids = AliasAllocator(lease_store, "users", 8, ALIAS_BLOCK_SIZE, ALIAS_SHUFFLE_KEY or None)
+    return links, user_ids
+
+raw_retention = RawClickRetention(RAW_CLICKS_PER_ALIAS, RAW_CLICK_BUDGET)
+click_archive = ClickArchive(CLICK_ARCHIVE_DIR) if CLICK_ARCHIVE_DIR else None
+# Startup timings in seconds, logged and reported by /health
+startup_timings = {}
+startup_complete = False
+startup_started = time.perf_counter()
+storage = open_storage()
 url_data = load_data()
 users = load_users()
+startup_timings["load"] = time.perf_counter() - startup_started
+user_link_index = UserLinkIndex()
+search_index = LinkSearchIndex()
+user_stats = UserStats()
+expiry_index = ExpiryIndex()
+redirect_cache = RedirectCache(REDIRECT_CACHE_SIZE, REDIRECT_CACHE_TTL)
+shared_index = (SharedAliasIndex(ALIAS_INDEX_FILE, ALIAS_INDEX_INTERVAL, invalidate_redirects)
+                if ALIAS_INDEX_FILE else None)
+unpublished_aliases = {}
+alias_change_seq = 0
+rebuild_indexes()
+reap_expired()
+if shared_index is not None:
+    publish_alias_index(full=True)
+alias_allocator, user_id_allocator = open_alias_allocators()
+startup_timings["indexes"] = time.perf_counter() - startup_started - startup_timings["load"]
+startup_timings["total"] = time.perf_counter() - startup_started
+startup_complete = True
+startup_finished_at = time.time()
+app.logger.info("Loaded %d links in %.3fs (%s storage, indexes %.3fs)", len(url_data["links"]),
+                startup_timings["total"], storage.name, startup_timings["indexes"])
+
+click_writer = ClickWriter(write_clicks,
+                           max_queue=CLICK_QUEUE_SIZE,
+                           batch_size=CLICK_BATCH_SIZE,
+                           flush_interval=CLICK_FLUSH_INTERVAL,
+                           policy=CLICK_QUEUE_POLICY)
+previous_sigterm_handler = None
+atexit.register(click_writer.stop)
+
+# --- APP FACTORY ---
+# Data is loaded at import, so gunicorn's preload_app loads it once in the master and the
+# workers share it copy-on-write. Background threads do not survive fork and a leased alias
+# block must not be shared between processes, so those are set up per process by
+# start_worker(): from create_app(), or from gunicorn's post_fork hook (see gunicorn.conf.py).
+# Serving app:app directly starts none of them: no click writer thread until the first
+# click, and no compactor, expiry reaper or alias index publisher at all.
+worker_pid = None
+
+def start_worker():
+    global worker_pid, alias_allocator, user_id_allocator
+    if worker_pid == os.getpid():
+        return
+    worker_pid = os.getpid()
+    alias_allocator, user_id_allocator = open_alias_allocators()
+    install_sigterm_flush()
+    click_writer.start()
+    if STORAGE_MODE in ('journal', 'snapshot'):
+        start_compactor()
+    if REAPER_INTERVAL > 0:
+        start_reaper()
+    if shared_index is not None:
+        start_alias_index_publisher()
+    if PROFILE_ON_START > 0:
+        start_profile(PROFILE_ON_START)
+
+def create_app(start=True):
+    # start=False leaves start_worker() to the caller, e.g. a post-fork hook
+    if start:
+        start_worker()
+    return app
 
 # --- HELPER FUNCTIONS ---
 def generate_random_alias(length=6):
     chars = string.ascii_letters + string.digits
     while True:
         new_alias = ''.join(random.choice(chars) for _ in range(length))
-        if new_alias not in url_data["links"]:
+        if new_alias not in url_data["links"] and new_alias not in url_data["expired"]:
             return new_alias
 
+def expiry_from_choice(expiry):
+    if not expiry or expiry in ('never', 'custom'):
+        return None
+    if expiry == '1day':
+        return (datetime.now() + timedelta(days=1)).isoformat()
+    if expiry == '7days':
+        return (datetime.now() + timedelta(days=7)).isoformat()
+    if expiry == '30days':
+        return (datetime.now() + timedelta(days=30)).isoformat()
+    try:
+        return datetime.fromisoformat(expiry).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+def parse_shorten(data, user_id):
+    # One /api/shorten body -> (requested alias or None, Link); raises ValueError if invalid
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    url = data.get('url')
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise ValueError("Invalid URL")
+    alias = data.get('alias') or None
+    if alias is not None and not isinstance(alias, str):
+        raise ValueError("Invalid alias")
+    return alias, Link(url,
+                       int(time.time()),
+                       user_id=user_id,
+                       expiry_date=expiry_from_choice(data.get('expiry')),
+                       password=data.get('password'),
+                       utm_tracking=data.get('utm_tracking', False))
+
+def add_link(alias, link):
+    # Caller holds data_lock and persists the link afterwards
+    url_data["links"][alias] = link
+    url_data["analytics"][alias] = new_analytics()
+    user_link_index.add(alias, link)
+    search_index.add(alias, link)
+    expiry_index.add(alias, link)
+    user_stats.add(alias, link, time.time())
+    mark_alias_changed(alias)
+
+def remove_link(alias, link):
+    # Caller holds data_lock and persists the removal afterwards
+    url_data["links"].pop(alias, None)
+    url_data["expired"].pop(alias, None)
+    if alias in url_data["analytics"]:
+        del url_data["analytics"][alias]
+    raw_retention.forget(alias)
+    user_link_index.remove(alias, link)
+    search_index.remove(alias, link)
+    expiry_index.remove(alias)
+    redirect_cache.invalidate(alias)
+    user_stats.remove(alias, link, time.time())
+
+def discard_link(alias, link):
+    # Undoes add_link for a link shared storage refused: the alias belongs to another
+    # process, so the removal is not published to the alias index either
+    remove_link(alias, link)
+    unpublished_aliases.pop(alias, None)
+
+def link_from_row(row, user_id):
+    # An exported link row (NDJSON values or CSV strings) -> Link; raises ValueError if invalid
+    url = row.get('url')
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise ValueError("Invalid URL")
+    created = parse_created(row.get('created'))
+    try:
+        clicks = int(row.get('clicks') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid clicks")
+    # Snapshots store the count as an unsigned 64-bit integer
+    if not 0 <= clicks < 2 ** 64:
+        raise ValueError("Invalid clicks")
+    return Link(url,
+                created if isinstance(created, int) else int(time.time()),
+                clicks,
+                user_id,
+                row.get('expiry_date') or None,
+                row.get('password') or None,
+                exports.parse_bool(row.get('utm_tracking')))
+
+def allocate_alias():
+    if alias_allocator is None:
+        return generate_random_alias()
+    # Only a custom alias can already hold a counter value, so this rarely loops
+    alias = alias_allocator.next_alias()
+    while alias in url_data["links"] or alias in url_data["expired"]:
+        alias = alias_allocator.next_alias()
+    return alias
+
+def generate_user_id():
+    if user_id_allocator is not None:
+        return user_id_allocator.next_alias()
+    chars = string.ascii_letters + string.digits
+    return ''.join(random.choice(chars) for _ in range(8))
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -63,15 +711,7 @@ LOGIN_TEMPLATE = """
 <html>
 <head>
     <title>Login - URL Shortener</title>
-    <style>
-        body { font-family: Arial, sans-serif; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); height: 100vh; display: flex; justify-content: center; align-items: center; }
-        .login-box { background: white; padding: 40px; border-radius: 10px; box-shadow: 0 10px 30px rgba(0,0,0,0.2); width: 300px; }
-        input { width: 100%; padding: 10px; margin: 10px 0; border: 1px solid #ddd; border-radius: 5px; }
-        button { width: 100%; padding: 10px; background: #4a90e2; color: white; border: none; border-radius: 5px; cursor: pointer; }
-        .tabs { display: flex; margin-bottom: 20px; }
-        .tab { flex: 1; text-align: center; padding: 10px; cursor: pointer; border-bottom: 2px solid transparent; }
-        .tab.active { border-bottom-color: #4a90e2; font-weight: bold; }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('login.css') }}">
 </head>
 <body>
     <div class="login-box">
@@ -100,20 +740,7 @@ LOGIN_TEMPLATE = """
         </div>
     </div>
     
-    <script>
-        function showLogin() {
-            document.getElementById('loginForm').style.display = 'block';
-            document.getElementById('registerForm').style.display = 'none';
-            document.querySelectorAll('.tab')[0].classList.add('active');
-            document.querySelectorAll('.tab')[1].classList.remove('active');
-        }
-        function showRegister() {
-            document.getElementById('loginForm').style.display = 'none';
-            document.getElementById('registerForm').style.display = 'block';
-            document.querySelectorAll('.tab')[0].classList.remove('active');
-            document.querySelectorAll('.tab')[1].classList.add('active');
-        }
-    </script>
+    <script src="{{ asset_url('login.js') }}"></script>
 </body>
 </html>
 """
@@ -125,265 +752,7 @@ HOME_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URL Shortener Pro v2.0</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, sans-serif;
-            background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-            min-height: 100vh;
-            padding: 20px;
-            color: #333;
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-        }
-        
-        .header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 30px;
-            padding: 20px;
-            background: white;
-            border-radius: 12px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        }
-        
-        .user-info {
-            display: flex;
-            align-items: center;
-            gap: 15px;
-        }
-        
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-        
-        .stat-card {
-            background: white;
-            padding: 20px;
-            border-radius: 12px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-            text-align: center;
-        }
-        
-        .stat-number {
-            font-size: 2.5em;
-            font-weight: bold;
-            color: #4a90e2;
-            margin: 10px 0;
-        }
-        
-        .stat-label {
-            color: #666;
-            font-size: 0.9em;
-        }
-        
-        .main-content {
-            display: grid;
-            grid-template-columns: 1fr 2fr;
-            gap: 30px;
-        }
-        
-        .create-card, .links-card {
-            background: white;
-            padding: 30px;
-            border-radius: 12px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-            margin-bottom: 20px;
-        }
-        
-        .form-group {
-            margin-bottom: 20px;
-        }
-        
-        label {
-            display: block;
-            margin-bottom: 8px;
-            font-weight: 600;
-            color: #444;
-        }
-        
-        input, select {
-            width: 100%;
-            padding: 12px;
-            border: 2px solid #e1e5e9;
-            border-radius: 8px;
-            font-size: 14px;
-            transition: border-color 0.3s;
-        }
-        
-        input:focus, select:focus {
-            outline: none;
-            border-color: #4a90e2;
-        }
-        
-        .btn {
-            background: #4a90e2;
-            color: white;
-            border: none;
-            padding: 12px 24px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 14px;
-            font-weight: 600;
-            transition: background 0.3s;
-        }
-        
-        .btn:hover {
-            background: #357abd;
-        }
-        
-        .btn-danger {
-            background: #e74c3c;
-        }
-        
-        .btn-danger:hover {
-            background: #c0392b;
-        }
-        
-        .btn-success {
-            background: #2ecc71;
-        }
-        
-        .btn-success:hover {
-            background: #27ae60;
-        }
-        
-        .link-item {
-            background: #f8f9fa;
-            border-radius: 8px;
-            padding: 20px;
-            margin-bottom: 15px;
-            border-left: 4px solid #4a90e2;
-        }
-        
-        .link-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 10px;
-        }
-        
-        .short-url {
-            font-weight: bold;
-            color: #4a90e2;
-            font-size: 1.1em;
-        }
-        
-        .original-url {
-            color: #666;
-            font-size: 0.9em;
-            margin-bottom: 10px;
-            word-break: break-all;
-        }
-        
-        .link-meta {
-            display: flex;
-            gap: 20px;
-            font-size: 0.85em;
-            color: #888;
-            margin-top: 10px;
-        }
-        
-        .link-actions {
-            display: flex;
-            gap: 10px;
-            margin-top: 15px;
-        }
-        
-        .qr-container {
-            display: flex;
-            align-items: center;
-            gap: 15px;
-            margin-top: 15px;
-            padding-top: 15px;
-            border-top: 1px solid #eee;
-        }
-        
-        .qr-code {
-            width: 100px;
-            height: 100px;
-            border: 1px solid #ddd;
-            border-radius: 8px;
-            padding: 5px;
-            background: white;
-        }
-        
-        .analytics-chart {
-            height: 200px;
-            background: #f8f9fa;
-            border-radius: 8px;
-            margin-top: 15px;
-            padding: 15px;
-        }
-        
-        .expiry-badge {
-            display: inline-block;
-            padding: 4px 8px;
-            border-radius: 12px;
-            font-size: 0.8em;
-            margin-left: 10px;
-        }
-        
-        .expiry-soon {
-            background: #ffeaa7;
-            color: #e17055;
-        }
-        
-        .expiry-expired {
-            background: #fab1a0;
-            color: #d63031;
-        }
-        
-        .feature-badge {
-            display: inline-block;
-            padding: 4px 8px;
-            background: #dfe6e9;
-            border-radius: 12px;
-            font-size: 0.8em;
-            margin-left: 5px;
-        }
-        
-        .dropdown {
-            position: relative;
-            display: inline-block;
-        }
-        
-        .dropdown-content {
-            display: none;
-            position: absolute;
-            background: white;
-            min-width: 160px;
-            box-shadow: 0 8px 16px rgba(0,0,0,0.1);
-            border-radius: 8px;
-            z-index: 1;
-        }
-        
-        .dropdown:hover .dropdown-content {
-            display: block;
-        }
-        
-        @media (max-width: 768px) {
-            .main-content {
-                grid-template-columns: 1fr;
-            }
-            
-            .stats-grid {
-                grid-template-columns: 1fr;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('home.css') }}">
     <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
 </head>
 <body>
@@ -476,13 +845,16 @@ HOME_TEMPLATE = """
             </div>
             
             <div class="links-card">
-                <h2 style="margin-bottom: 25px;">📋 Your Links ({{ links|length }})</h2>
+                <h2 style="margin-bottom: 25px;">📋 Your Links ({{ total_links }})</h2>
                 
                 <div style="margin-bottom: 20px;">
                     <input type="text" id="searchLinks" placeholder="🔍 Search links..." style="width: 100%;">
                 </div>
+                <div id="searchResults" style="display:none;"></div>
                 
-                {% for alias, data in links.items() %}
+                <div id="linkList">
+                
+                {% for alias, data in links %}
                 <div class="link-item" data-alias="{{ alias }}">
                     <div class="link-header">
                         <div>
@@ -533,137 +905,234 @@ HOME_TEMPLATE = """
                     </div>
                 </div>
                 {% endfor %}
+                
+                {% if next_page or first_page %}
+                <div class="pagination">
+                    {% if first_page %}<a href="{{ first_page }}" class="btn">⏮ First page</a>{% endif %}
+                    {% if next_page %}<a href="{{ next_page }}" class="btn">Next page ➡</a>{% endif %}
+                </div>
+                {% endif %}
+                </div>
             </div>
         </div>
     </div>
 
+    <script src="{{ asset_url('home.js') }}"></script>
+</body>
+</html>
+"""
+
+ANALYTICS_TEMPLATE = """
+    <h2>Analytics for {{ alias }}</h2>
+    <p>Total Clicks: {{ link.clicks }}</p>
+    <p>Created: {{ link.created }}</p>
+    <canvas id="clicksChart"></canvas>
+    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
     <script>
-        // Custom date toggle
-        document.getElementById('expiry').addEventListener('change', function() {
-            document.getElementById('customDateGroup').style.display = 
-                this.value === 'custom' ? 'block' : 'none';
-        });
-        
-        // Form submission
-        document.getElementById('shortenForm').addEventListener('submit', async (e) => {
-            e.preventDefault();
-            
-            const url = document.getElementById('url').value;
-            const alias = document.getElementById('alias').value;
-            const expiry = document.getElementById('expiry').value;
-            const customDate = document.getElementById('customDate').value;
-            const password = document.getElementById('password').value;
-            const utmTracking = document.getElementById('utm_tracking').checked;
-            
-            const payload = {
-                url,
-                alias: alias || undefined,
-                expiry: expiry === 'custom' ? customDate : expiry,
-                password: password || undefined,
-                utm_tracking: utmTracking
-            };
-            
-            try {
-                const response = await fetch('/api/shorten', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify(payload)
-                });
-                
-                if (response.ok) {
-                    const result = await response.json();
-                    document.getElementById('shortUrl').textContent = 
-                        window.location.origin + '/go/' + result.alias;
-                    document.getElementById('result').style.display = 'block';
-                    setTimeout(() => window.location.reload(), 2000);
-                } else {
-                    const error = await response.json();
-                    alert('Error: ' + error.error);
-                }
-            } catch (err) {
-                alert('Network error: ' + err.message);
+        const ctx = document.getElementById('clicksChart').getContext('2d');
+        new Chart(ctx, {
+            type: 'line',
+            data: {
+                labels: {{ labels|tojson }},
+                datasets: [{
+                    label: 'Clicks per {{ resolution }}',
+                    data: {{ counts|tojson }},
+                    borderColor: 'rgb(75, 192, 192)',
+                    tension: 0.1
+                }]
             }
         });
-        
-        // Search functionality
-        document.getElementById('searchLinks').addEventListener('input', function(e) {
-            const searchTerm = e.target.value.toLowerCase();
-            document.querySelectorAll('.link-item').forEach(item => {
-                const text = item.textContent.toLowerCase();
-                item.style.display = text.includes(searchTerm) ? 'block' : 'none';
-            });
-        });
-        
-        // Helper functions
-        function copyToClipboard() {
-            const text = document.getElementById('shortUrl').textContent;
-            navigator.clipboard.writeText(text);
-            alert('Copied to clipboard!');
-        }
-        
-        function copyLink(alias) {
-            navigator.clipboard.writeText(window.location.origin + '/go/' + alias);
-            alert('Link copied!');
-        }
-        
-        function toggleQR(alias) {
-            const qrDiv = document.getElementById('qr-' + alias);
-            qrDiv.style.display = qrDiv.style.display === 'none' ? 'flex' : 'none';
-        }
-        
-        function downloadQR(alias) {
-            const link = document.createElement('a');
-            link.href = `https://api.qrserver.com/v1/create-qr-code/?size=300x300&data=${window.location.origin}/go/${alias}`;
-            link.download = `qr-${alias}.png`;
-            link.click();
-        }
-        
-        function deleteLink(alias) {
-            if(confirm('Are you sure you want to delete this link?')) {
-                fetch(`/api/delete/${alias}`, { method: 'DELETE' })
-                    .then(() => window.location.reload());
-            }
-        }
-        
-        function showAnalytics(alias) {
-            window.open(`/analytics/${alias}`, '_blank');
-        }
     </script>
-</body>
-</html>
 """
 
+# --- TEMPLATE REGISTRY ---
+# Page CSS/JS lives in static/ and is linked by content-hashed URL (see /assets/<name>)
+assets = AssetRegistry(os.path.join(app.root_path, 'static'))
+app.jinja_env.globals['asset_url'] = assets.url
+
+# Compiled once at startup instead of on every render_template_string() call
+TEMPLATES = {
+    "home": app.jinja_env.from_string(HOME_TEMPLATE),
+    "analytics": app.jinja_env.from_string(ANALYTICS_TEMPLATE),
+}
+# The login page has no variables, so it is rendered once and served as bytes
+LOGIN_PAGE = app.jinja_env.from_string(LOGIN_TEMPLATE).render().encode()
+
+def render_compiled(name, **context):
+    # Same context (request, session, g, ...) that render_template_string() would provide
+    app.update_template_context(context)
+    return TEMPLATES[name].render(context)
+
+def stream_compiled(name, **context):
+    # Like render_compiled, but yields the page in chunks as it renders
+    app.update_template_context(context)
+    stream = TEMPLATES[name].stream(context)
+    stream.enable_buffering(64)
+    return stream
+
 # --- ROUTES ---
 @app.route('/')
 @login_required
 def home():
-    # Filter links by user
-    user_links = {}
-    for alias, data in url_data["links"].items():
-        if data.get("user_id") == session['user_id']:
-            user_links[alias] = data
-
-    # Calculate statistics
-    stats = {
-        "total_links": len(user_links),
-        "total_clicks": sum(link.get("clicks", 0) for link in user_links.values()),
-        "active_links": sum(1 for link in user_links.values() if not is_expired(link)),
-        "expiring_soon": sum(1 for link in user_links.values() if is_expiring_soon(link))
-    }
+    # One page of this user's links (see /api/links for the query args)
+    enter_phase("lookup")
+    try:
+        links, next_cursor = user_link_page(session['user_id'], request.args)
+    except ValueError as e:
+        return str(e), 400
 
-    return render_template_string(HOME_TEMPLATE,
-                                  links=user_links,
-                                  stats=stats,
-                                  username=session.get('username', 'Guest'))
+    # Statistics are maintained incrementally, see UserStats
+    stats = stats_for_user(session['user_id'])
+
+    enter_phase("render")
+    # Streamed, so the header and stats go out before the link list is rendered
+    page = stream_compiled("home",
+                           links=links,
+                           total_links=user_link_index.count(session['user_id']),
+                           next_page=page_url(request.args, next_cursor) if next_cursor else None,
+                           first_page=page_url(request.args, None) if request.args.get('cursor') else None,
+                           stats=stats,
+                           username=session.get('username', 'Guest'))
+    return app.response_class(stream_with_context(page), mimetype="text/html")
     
     
+@app.route('/api/links')
+@login_required
+def api_links():
+    # ?sort=created|clicks|alias|url&order=asc|desc&limit=&cursor=
+    # &status=active|expiring|expired&password=true|false&utm=true|false
+    enter_phase("lookup")
+    try:
+        links, next_cursor = user_link_page(session['user_id'], request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    enter_phase("render")
+    now = time.time()
+    return jsonify({
+        "links": [link_summary(alias, link, now) for alias, link in links],
+        "next_cursor": next_cursor
+    }), 200
+
+@app.route('/api/links/search')
+@login_required
+def api_links_search():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 20, type=int)
+    if not 1 <= limit <= 100:
+        return jsonify({"error": "limit must be between 1 and 100"}), 400
+    
+    user_id = session['user_id']
+    links = None
+    with data_lock:
+        if not search_index.loaded(user_id):
+            search_index.begin(user_id)
+            links = links_for_user(user_id)
+    if links is not None:
+        # Built outside data_lock, which would otherwise stall clicks and shortens for as long
+        # as a large index takes; install() applies the changes made meanwhile
+        built = search_index.build(links)
+        with data_lock:
+            search_index.install(user_id, built)
+
+    now = time.time()
+    results = []
+    with data_lock:
+        for alias, match in search_index.search(user_id, query, limit):
+            link = find_link(alias)
+            if link is not None:
+                results.append(dict(link_summary(alias, link, now), match=match))
+    return jsonify({"query": query, "results": results}), 200
+
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    return jsonify(stats_for_user(session['user_id'])), 200
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if SLOW_REQUEST_MS > 0:
+        phase_state.set(["dispatch", g.request_started, {}])
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses (the dashboard) are timed up to the first byte
+    started = g.get("request_started")
+    if started is not None:
+        route = request.endpoint or "unmatched"
+        duration = time.perf_counter() - started
+        request_latency.labels(route).observe(duration)
+        method = request.method if request.method in METRIC_METHODS else "other"
+        request_count.labels(route, method, str(response.status_code)).add()
+        if SLOW_REQUEST_MS > 0 and duration * 1000 >= SLOW_REQUEST_MS:
+            log_slow_request(response, duration)
+        phase_state.set(None)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return app.response_class(metrics.render(), mimetype=prometheus.CONTENT_TYPE)
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    # ?seconds= (default 30, capped at PROFILE_MAX_SECONDS); X-Admin-Token must match ADMIN_TOKEN
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({"error": "Forbidden"}), 403
+    seconds = request.args.get('seconds', 30, type=float)
+    if not seconds > 0:
+        return jsonify({"error": "seconds must be positive"}), 400
+    path = start_profile(seconds)
+    if path is None:
+        return jsonify({"error": "A profile is already running", "file": profiler.output}), 409
+    return jsonify({"file": path, "seconds": min(seconds, PROFILE_MAX_SECONDS)}), 202
+
+@app.route('/health/live')
+def health_live():
+    # Liveness only: the process is up and serving requests
+    return jsonify({"status": "ok"}), 200
+
+def readiness_checks(now):
+    pending = click_writer.pending()
+    last_write = click_writer.last_write or startup_finished_at
+    # How long the oldest unwritten click has waited, so a click queued on an idle instance
+    # is not measured from a write long ago; while the latest write attempt has failed, how
+    # long writes have been failing
+    oldest_pending = click_writer.oldest_pending()
+    write_age = now - oldest_pending if oldest_pending is not None else 0
+    if (click_writer.last_failure or 0) > last_write:
+        write_age = max(write_age, now - last_write)
+    return {
+        "loaded": startup_complete,
+        "accepting_clicks": not click_writer.stopping.is_set(),
+        "click_backlog": pending <= READY_MAX_CLICK_BACKLOG,
+        "write_age": write_age <= READY_MAX_WRITE_AGE
+    }, {
+        "pending_clicks": pending,
+        "failed_clicks": click_writer.failed,
+        "last_write_age_seconds": round(now - last_write, 3),
+        "oldest_pending_age_seconds": round(now - oldest_pending, 3) if oldest_pending is not None else 0
+    }
+
+@app.route('/health/ready')
+def health_ready():
+    checks, details = readiness_checks(time.time())
+    ready = all(checks.values())
+    return jsonify({
+        "status": "ready" if ready else "unavailable",
+        "checks": checks,
+        **details
+    }), 200 if ready else 503
+
 @app.route('/health')
 def health():
     return jsonify({
         "status": "ok",
         "app": "url-shortener",
         "version": "2.0",
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow().isoformat(),
+        "startup_seconds": round(startup_timings["total"], 3)
     }), 200
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -672,13 +1141,14 @@ def login():
         username = request.form['username']
         password = hash_password(request.form['password'])
         
-        if username in users and users[username]['password'] == password:
-            session['user_id'] = users[username]['id']
+        user = find_user(username)
+        if user is not None and user['password'] == password:
+            session['user_id'] = user['id']
             session['username'] = username
             return redirect('/')
         return "Invalid credentials", 401
     
-    return render_template_string(LOGIN_TEMPLATE)
+    return app.response_class(LOGIN_PAGE, mimetype="text/html")
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -686,17 +1156,23 @@ def register():
     email = request.form['email']
     password = hash_password(request.form['password'])
     
-    if username in users:
-        return "Username already exists", 400
-    
-    user_id = generate_random_alias(8)
-    users[username] = {
-        'id': user_id,
-        'email': email,
-        'password': password,
-        'created_at': datetime.now().isoformat()
-    }
-    save_users()
+    with data_lock:
+        if find_user(username) is not None:
+            return "Username already exists", 400
+        
+        user_id = generate_user_id()
+        users[username] = {
+            'id': user_id,
+            'email': email,
+            'password': password,
+            'created_at': datetime.now().isoformat()
+        }
+        try:
+            timed_write("put_user", storage.put_user, users, username)
+        except Conflict:
+            # Registered by another worker process since find_user() looked
+            del users[username]
+            return "Username already exists", 400
     
     session['user_id'] = user_id
     session['username'] = username
@@ -710,72 +1186,135 @@ def logout():
 @app.route('/api/shorten', methods=['POST'])
 @login_required
 def api_shorten():
-    data = request.get_json()
-    url = data.get('url')
-    alias = data.get('alias') or generate_random_alias()
-    expiry = data.get('expiry')
-    password = data.get('password')
-    
-    if not url.startswith(('http://', 'https://')):
-        return jsonify({"error": "Invalid URL"}), 400
-    
-    if alias in url_data["links"]:
-        return jsonify({"error": "Alias already exists"}), 409
-    
-    # Calculate expiry date
-    expiry_date = None
-    if expiry and expiry != 'never':
-        if expiry == '1day':
-            expiry_date = (datetime.now() + timedelta(days=1)).isoformat()
-        elif expiry == '7days':
-            expiry_date = (datetime.now() + timedelta(days=7)).isoformat()
-        elif expiry == '30days':
-            expiry_date = (datetime.now() + timedelta(days=30)).isoformat()
-        elif expiry and expiry != 'custom':
-            try:
-                expiry_date = datetime.fromisoformat(expiry).isoformat()
-            except:
-                pass
-    
-    link_data = {
-        "url": url,
-        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "clicks": 0,
-        "user_id": session['user_id'],
-        "expiry_date": expiry_date,
-        "password": password,
-        "utm_tracking": data.get('utm_tracking', False)
-    }
+    try:
+        alias, link_data = parse_shorten(request.get_json(), session['user_id'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    url_data["links"][alias] = link_data
-    url_data["analytics"][alias] = {
-        "clicks": [],
-        "referrers": {},
-        "countries": {},
-        "browsers": {}
-    }
-    save_data()
+    enter_phase("lookup")
+    with data_lock:
+        alias = alias or allocate_alias()
+        if alias_taken(alias):
+            return jsonify({"error": "Alias already exists"}), 409
+        add_link(alias, link_data)
+        enter_phase("persistence")
+        try:
+            timed_write("put_link", storage.put_link, url_data, alias)
+        except Conflict:
+            # Created by another worker process since it was last published to the alias index
+            discard_link(alias, link_data)
+            return jsonify({"error": "Alias already exists"}), 409
     
+    enter_phase("render")
     return jsonify({
         "alias": alias,
         "short_url": f"{request.host_url}go/{alias}",
-        "expires_at": expiry_date
+        "expires_at": link_data.expiry_date
     }), 201
 
+def read_bulk_items():
+    # The items of a bulk request, stopping one past BULK_MAX_ITEMS; raises ValueError on bad JSON
+    if request.mimetype != 'application/x-ndjson':
+        return request.get_json()
+    items = []
+    for line in request.stream:
+        if line.strip():
+            items.append(json.loads(line))
+            if len(items) > BULK_MAX_ITEMS:
+                break
+    return items
+
+def validate_bulk_items(items, user_id):
+    # (index, alias, Link) for each valid item, and a 400 result for each invalid one
+    parsed = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, *parse_shorten(item, user_id)))
+        except ValueError as e:
+            errors.append({"index": index, "status": 400, "error": str(e)})
+    return parsed, errors
+
+def add_bulk_links(parsed, results):
+    # Adds the validated links and persists them in one write; returns the added aliases
+    added = []
+    with data_lock:
+        for index, alias, link_data in parsed:
+            alias = alias or allocate_alias()
+            if alias_taken(alias):
+                results.append({"index": index, "status": 409, "alias": alias, "error": "Alias already exists"})
+                continue
+            add_link(alias, link_data)
+            added.append(alias)
+            results.append({"index": index, "status": 201, "alias": alias,
+                            "short_url": f"{request.host_url}go/{alias}", "expires_at": link_data.expiry_date})
+        rejected = set(timed_write("put_links", storage.put_links, url_data, added) if added else ())
+        # Taken by another worker process in the meantime
+        for alias in rejected:
+            discard_link(alias, url_data["links"][alias])
+    for i, result in enumerate(results):
+        if result["status"] == 201 and result["alias"] in rejected:
+            results[i] = {"index": result["index"], "status": 409, "alias": result["alias"],
+                          "error": "Alias already exists"}
+    return [alias for alias in added if alias not in rejected]
+
+@app.route('/api/shorten/bulk', methods=['POST'])
+@login_required
+def api_shorten_bulk():
+    # A JSON array of /api/shorten bodies, or one per line with Content-Type: application/x-ndjson.
+    # Everything is validated first, then all links are added and persisted in one write.
+    # An oversized body is rejected before it is read, let alone parsed
+    if (request.content_length or 0) > BULK_MAX_BYTES:
+        return jsonify({"error": f"At most {BULK_MAX_BYTES} bytes per request"}), 413
+    try:
+        items = read_bulk_items()
+    except ValueError:
+        return jsonify({"error": "Invalid JSON"}), 400
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a JSON array or NDJSON"}), 400
+    if len(items) > BULK_MAX_ITEMS:
+        return jsonify({"error": f"At most {BULK_MAX_ITEMS} links per request"}), 413
+    
+    parsed, results = validate_bulk_items(items, session['user_id'])
+    added = add_bulk_links(parsed, results)
+    results.sort(key=lambda result: result["index"])
+    
+    def generate():
+        for result in results:
+            yield json.dumps(result) + "\n"
+    return app.response_class(generate(), status=207 if len(added) < len(items) else 201,
+                              mimetype='application/x-ndjson')
+
 @app.route('/go/<alias>')
 def go(alias):
-    if alias not in url_data["links"]:
-        return "Link not found", 404
+    now = time.time()
+    enter_phase("lookup")
+    if shared_index is not None:
+        # Picks up deletes and changes from other workers, which drop their cached redirects
+        shared_index.refresh()
+    cached = redirect_cache.get(alias, now)
+    if cached is not None:
+        enter_phase("analytics")
+        click_writer.submit((alias, now, request.remote_addr, request.user_agent.string, request.referrer))
+        enter_phase("render")
+        return app.response_class(cached[1], 302, {"Location": cached[0]}, mimetype="text/html")
     
-    link = url_data["links"][alias]
+    # Taken before the lookup, so a delete that lands before the put below keeps it out of the cache
+    generation = redirect_cache.generation
+    entry = resolve_alias(alias)
+    if entry is None:
+        return "Link not found", 404
+    url, flags, expiry = entry
     
-    # Check if link is expired
-    if is_expired(link):
+    # Check if link is expired; the reaper moves it to the cold tier shortly after
+    if flags & EXPIRED_BIT or (expiry is not None and now > expiry):
         return "This link has expired", 410
     
-    # Check password protection
-    if link.get("password"):
-        if 'password' not in request.args or request.args['password'] != link['password']:
+    # Check password protection; passwords are not in the shared index, so a link created by
+    # another worker is read from shared storage
+    if flags & FLAG_PASSWORD:
+        link = url_data["links"].get(alias) or storage.get_link(alias)
+        if link is None or 'password' not in request.args or request.args['password'] != link.password:
             return '''
             <form method="GET">
                 <input type="password" name="password" placeholder="Enter password" required>
@@ -783,28 +1322,13 @@ def go(alias):
             </form>
             ''', 403
     
-    # Track analytics
-    url_data["links"][alias]['clicks'] += 1
-    
-    # Record analytics data
-    if alias in url_data["analytics"]:
-        analytics = url_data["analytics"][alias]
-        analytics["clicks"].append({
-            "timestamp": datetime.now().isoformat(),
-            "ip": request.remote_addr,
-            "user_agent": request.user_agent.string,
-            "referrer": request.referrer
-        })
-        
-        # Update referrers
-        ref = request.referrer or "direct"
-        analytics["referrers"][ref] = analytics["referrers"].get(ref, 0) + 1
-    
-    save_data()
+    # Track analytics; the click writer persists it in the background
+    enter_phase("analytics")
+    click_writer.submit((alias, now, request.remote_addr, request.user_agent.string, request.referrer))
     
+    enter_phase("render")
     # Add UTM parameters if enabled
-    url = link['url']
-    if link.get('utm_tracking'):
+    if flags & FLAG_UTM:
         utm_params = {
             'utm_source': 'url_shortener',
             'utm_medium': 'redirect',
@@ -813,71 +1337,208 @@ def go(alias):
         }
         url = add_url_params(url, utm_params)
     
-    return redirect(url)
+    response = redirect(url)
+    # Same target for every visitor: keep the finished response for the next hit
+    if not flags:
+        redirect_cache.put(alias, response.headers["Location"], response.get_data(), now, expiry, generation)
+    return response
 
 @app.route('/api/delete/<alias>', methods=['DELETE'])
 @login_required
 def api_delete(alias):
-    if alias in url_data["links"] and url_data["links"][alias].get("user_id") == session['user_id']:
-        del url_data["links"][alias]
-        if alias in url_data["analytics"]:
-            del url_data["analytics"][alias]
-        save_data()
-        return jsonify({"success": True}), 200
-    return jsonify({"error": "Not found or unauthorized"}), 404
+    enter_phase("lookup")
+    with data_lock:
+        link = find_link(alias)
+        if link is None or link.user_id != session['user_id']:
+            return jsonify({"error": "Not found or unauthorized"}), 404
+        remove_link(alias, link)
+        mark_alias_changed(alias)
+        enter_phase("persistence")
+        timed_write("delete_link", storage.delete_link, url_data, alias)
+    # Archive I/O happens outside the lock
+    forget_archived_clicks(alias)
+    return jsonify({"success": True}), 200
 
 @app.route('/analytics/<alias>')
 @login_required
 def analytics(alias):
-    if alias not in url_data["links"] or url_data["links"][alias].get("user_id") != session['user_id']:
+    enter_phase("lookup")
+    link = find_link(alias)
+    if link is None or link.user_id != session['user_id']:
         return "Unauthorized", 403
     
-    link = url_data["links"][alias]
-    analytics_data = url_data["analytics"].get(alias, {})
+    # Clicks over time from the rollup buckets, from creation (at most 90 days back) until now
+    end = time.time()
+    created = link.created_at if isinstance(link.created_at, int) else end
+    start = max(created, end - 90 * 86400)
+    with data_lock:
+        resolution, series = rollups.query(url_data["analytics"].get(alias, {}).get("rollups", {}), start, end)
+    label_format = "%Y-%m-%d" if resolution == "day" else "%m-%d %H:%M"
     
-    return f'''
-    <h2>Analytics for {alias}</h2>
-    <p>Total Clicks: {link['clicks']}</p>
-    <p>Created: {link['created']}</p>
-    <canvas id="clicksChart"></canvas>
-    <script>
-        const ctx = document.getElementById('clicksChart').getContext('2d');
-        new Chart(ctx, {{
-            type: 'line',
-            data: {{
-                labels: {json.dumps(list(range(1, len(analytics_data.get("clicks", [])) + 1)))},
-                datasets: [{{
-                    label: 'Clicks',
-                    data: {json.dumps([i+1 for i in range(len(analytics_data.get("clicks", [])))])},
-                    borderColor: 'rgb(75, 192, 192)',
-                    tension: 0.1
-                }}]
-            }}
-        }});
-    </script>
-    '''
+    enter_phase("render")
+    return render_compiled("analytics",
+                           alias=alias,
+                           link=link,
+                           resolution=resolution,
+                           labels=[datetime.fromtimestamp(t).strftime(label_format) for t, _ in series],
+                           counts=[count for _, count in series])
 
-# --- HELPER FUNCTIONS ---
-def is_expired(link):
-    expiry = link.get('expiry_date')
-    if not expiry:
-        return False
+@app.route('/api/analytics/<alias>/clicks')
+@login_required
+def api_click_series(alias):
+    link = find_link(alias)
+    if link is None or link.user_id != session['user_id']:
+        return jsonify({"error": "Not found or unauthorized"}), 404
+    
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - 86400, type=float)
     try:
-        expiry_date = datetime.fromisoformat(expiry)
-        return datetime.now() > expiry_date
-    except:
-        return False
+        with data_lock:
+            resolution, series = rollups.query(url_data["analytics"].get(alias, {}).get("rollups", {}),
+                                               start, end, request.args.get('resolution'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({
+        "alias": alias,
+        "resolution": resolution,
+        "buckets": [{"start": t, "clicks": count} for t, count in series]
+    }), 200
 
-def is_expiring_soon(link):
-    expiry = link.get('expiry_date')
-    if not expiry:
-        return False
-    try:
-        expiry_date = datetime.fromisoformat(expiry)
-        return datetime.now() < expiry_date < (datetime.now() + timedelta(days=7))
-    except:
-        return False
+def export_rows(user_id, kind, alias=None):
+    # Generator behind /api/export: takes data_lock per link or alias, never for the whole export
+    with data_lock:
+        aliases = [alias] if alias else user_link_index.aliases(user_id)
+    if kind == "links":
+        for a in aliases:
+            with data_lock:
+                link = find_link(a)
+            if link is not None:
+                yield exports.link_row(a, link)
+        return
+    
+    # Clicks trimmed from the in-memory buffers live in the archive, except with SQLite
+    if click_archive is not None and not storage.keeps_click_history:
+        wanted = set(aliases)
+        for event in click_archive.iter_events(alias):
+            if event.get("alias") in wanted:
+                yield exports.click_row(event["alias"], event)
+    for a in aliases:
+        with data_lock:
+            events = storage.iter_click_events(url_data, a)
+        for click in events:
+            yield exports.click_row(a, click)
+
+def import_links(batch, user_id, fail):
+    parsed = []
+    for line, row in batch:
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            alias = row.get('alias') or None
+            if alias is not None and not isinstance(alias, str):
+                raise ValueError("Invalid alias")
+            parsed.append((line, alias, link_from_row(row, user_id)))
+        except ValueError as e:
+            fail(line, str(e))
+    
+    added = []
+    with data_lock:
+        for line, alias, link in parsed:
+            alias = alias or allocate_alias()
+            if alias_taken(alias):
+                fail(line, "Alias already exists")
+                continue
+            add_link(alias, link)
+            added.append((line, alias))
+        aliases = [alias for _, alias in added]
+        rejected = set(timed_write("put_links", storage.put_links, url_data, aliases) if added else ())
+        for line, alias in added:
+            if alias in rejected:
+                # Taken by another worker process in the meantime
+                discard_link(alias, url_data["links"][alias])
+                fail(line, "Alias already exists")
+    return len(added) - len(rejected)
+
+def import_clicks(batch, user_id, fail):
+    clicks = []
+    for line, row in batch:
+        if isinstance(row, ValueError):
+            fail(line, str(row))
+            continue
+        alias = row.get('alias')
+        link = url_data["links"].get(alias) if isinstance(alias, str) else None
+        if link is None or link.user_id != user_id:
+            fail(line, "Unknown or expired alias")
+            continue
+        try:
+            ts = datetime.fromisoformat(row.get('timestamp')).timestamp()
+        except (TypeError, ValueError):
+            fail(line, "Invalid timestamp")
+            continue
+        clicks.append((alias, ts, row.get('ip') or None, row.get('user_agent') or None, row.get('referrer') or None))
+    # Same path as the click writer: counters, rollups, raw buffer and one storage write
+    write_clicks(clicks)
+    return len(clicks)
+
+@app.route('/api/export')
+@login_required
+def api_export():
+    # ?kind=links|clicks&format=ndjson|csv&alias= (all of the user's links when alias is omitted)
+    kind = request.args.get('kind', 'links')
+    fmt = request.args.get('format', 'ndjson')
+    alias = request.args.get('alias')
+    if kind not in exports.FIELDS or fmt not in exports.FORMATS:
+        return jsonify({"error": "kind must be links or clicks, format ndjson or csv"}), 400
+    if alias is not None:
+        link = find_link(alias)
+        if link is None or link.user_id != session['user_id']:
+            return jsonify({"error": "Not found or unauthorized"}), 404
+    
+    rows = export_rows(session['user_id'], kind, alias)
+    return app.response_class(exports.encode(rows, fmt, exports.FIELDS[kind]),
+                              mimetype=exports.FORMATS[fmt],
+                              headers={"Content-Disposition": f'attachment; filename="{alias or "all"}-{kind}.{fmt}"'})
 
+@app.route('/api/import', methods=['POST'])
+@login_required
+def api_import():
+    # The body is read and applied IMPORT_BATCH_SIZE rows at a time, in /api/export's row format.
+    # Imported links keep their click counts; imported click events add to them.
+    kind = request.args.get('kind', 'links')
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if kind not in exports.FIELDS or fmt not in exports.FORMATS:
+        return jsonify({"error": "kind must be links or clicks, format ndjson or csv"}), 400
+    
+    user_id = session['user_id']
+    load_batch = import_links if kind == "links" else import_clicks
+    result = {"imported": 0, "failed": 0, "errors": []}
+    
+    def fail(line, error):
+        # Only the first errors are reported, so a bad file cannot grow the response without bound
+        result["failed"] += 1
+        if len(result["errors"]) < 100:
+            result["errors"].append({"line": line, "error": error})
+    
+    for batch in exports.batched(exports.read_rows(request.stream, fmt), IMPORT_BATCH_SIZE):
+        result["imported"] += load_batch(batch, user_id, fail)
+    return jsonify(result), 200
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    item = assets.get(filename)
+    if item is None:
+        return "Not found", 404
+    
+    encoding = pick_encoding(request.accept_encodings, item)
+    headers = {"Cache-Control": CACHE_CONTROL, "ETag": f'"{item.etag(encoding)}"', "Vary": "Accept-Encoding"}
+    if item.etag(encoding) in request.if_none_match:
+        return app.response_class(status=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return app.response_class(item.variants[encoding], headers=headers, mimetype=item.mimetype)
+
+# --- HELPER FUNCTIONS ---
 def add_url_params(url, params):
     from urllib.parse import urlparse, urlencode, parse_qs
     parsed = urlparse(url)
@@ -886,4 +1547,5 @@ def add_url_params(url, params):
     return parsed._replace(query=urlencode(query, doseq=True)).geturl()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server; production runs gunicorn -c gunicorn.conf.py
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
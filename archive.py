@@ -0,0 +1,143 @@
+# Raw click retention: a bounded in-memory buffer per alias, with evicted clicks archived to
+# gzip-compressed NDJSON segments under <archive dir>/<YYYY-MM-DD>/clicks-NNNNN.ndjson.gz.
+# Deleting a link appends a tombstone to <archive dir>/deleted.ndjson; reads skip the alias's
+# clicks from before it, so a re-created alias does not inherit the old link's visitors.
+import gzip
+import json
+import os
+import threading
+from collections import deque
+
+
+class RawClickRetention:
+    # Each alias keeps at most per_alias recent clicks. When many aliases hold clicks, the
+    # global budget is shared out between them, down to min_per_alias each; past that the
+    # budget is a hard cap, and the alias being trimmed gives up its oldest clicks.
+    # Not thread-safe: the app calls it under data_lock.
+
+    def __init__(self, per_alias=1000, budget=1000000, min_per_alias=10):
+        self.per_alias = per_alias
+        self.budget = budget
+        self.min_per_alias = min_per_alias
+        # alias -> buffer length as of its last trim; only aliases that hold clicks
+        self.sizes = {}
+        self.held = 0
+
+    def capacity(self):
+        if not self.sizes:
+            return self.per_alias
+        return min(self.per_alias, max(self.min_per_alias, self.budget // len(self.sizes)))
+
+    def trim(self, alias, buffer):
+        # Called after clicks were added to alias's buffer; returns the evicted clicks
+        self.held += len(buffer) - self.sizes.get(alias, 0)
+        self.sizes[alias] = len(buffer)
+        evicted = []
+        capacity = self.capacity()
+        while buffer and (len(buffer) > capacity or self.held > self.budget):
+            evicted.append(buffer[0])
+            del buffer[0]
+            self.held -= 1
+        if buffer:
+            self.sizes[alias] = len(buffer)
+        else:
+            del self.sizes[alias]
+        return evicted
+
+    def forget(self, alias):
+        # The alias's buffer was dropped along with its link
+        self.held -= self.sizes.pop(alias, 0)
+
+
+def as_buffer(clicks):
+    return clicks if isinstance(clicks, deque) else deque(clicks)
+
+
+TOMBSTONES = "deleted.ndjson"
+
+
+class ClickArchive:
+    # Each write() appends one self-contained gzip member per day, so a segment is a valid
+    # multi-member gzip stream that can be read while it is still being appended to.
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.current = {}
+
+    def segment_path(self, day, size_hint):
+        path = self.current.get(day)
+        if path is None or os.path.getsize(path) + size_hint > self.segment_bytes:
+            day_dir = os.path.join(self.directory, day)
+            os.makedirs(day_dir, exist_ok=True)
+            existing = sorted(n for n in os.listdir(day_dir) if n.endswith(".ndjson.gz"))
+            number = int(existing[-1][7:12]) if existing else 1
+            path = os.path.join(day_dir, f"clicks-{number:05d}.ndjson.gz")
+            if os.path.exists(path) and os.path.getsize(path) + size_hint > self.segment_bytes:
+                path = os.path.join(day_dir, f"clicks-{number + 1:05d}.ndjson.gz")
+            self.current[day] = path
+        return path
+
+    def write(self, events):
+        # events: (alias, click dict) pairs, partitioned by the click's date
+        by_day = {}
+        for alias, click in events:
+            day = (click.get("timestamp") or "unknown")[:10]
+            by_day.setdefault(day, []).append(json.dumps(dict(click, alias=alias), separators=(',', ':')))
+        with self.lock:
+            for day, lines in by_day.items():
+                member = gzip.compress(("\n".join(lines) + "\n").encode())
+                path = self.segment_path(day, len(member))
+                fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, member)
+                finally:
+                    os.close(fd)
+
+    def forget(self, alias, deleted_at):
+        # deleted_at is an ISO timestamp in the clicks' format; earlier clicks on alias are hidden
+        line = json.dumps({"alias": alias, "deleted_at": deleted_at}, separators=(',', ':')) + "\n"
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(os.path.join(self.directory, TOMBSTONES), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+
+    def deletions(self):
+        # alias -> when it was last deleted
+        deleted = {}
+        try:
+            with open(os.path.join(self.directory, TOMBSTONES)) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    deleted[entry["alias"]] = max(entry["deleted_at"], deleted.get(entry["alias"], ""))
+        except FileNotFoundError:
+            pass
+        return deleted
+
+    def days(self, start_day=None, end_day=None):
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            d for d in sorted(os.listdir(self.directory))
+            if os.path.isdir(os.path.join(self.directory, d))
+            and (start_day is None or d >= start_day) and (end_day is None or d <= end_day)
+        ]
+
+    def iter_events(self, alias=None, start_day=None, end_day=None):
+        deleted = self.deletions()
+        for day in self.days(start_day, end_day):
+            day_dir = os.path.join(self.directory, day)
+            for name in sorted(os.listdir(day_dir)):
+                with gzip.open(os.path.join(day_dir, name), "rt") as f:
+                    for line in f:
+                        event = json.loads(line)
+                        if alias is not None and event.get("alias") != alias:
+                            continue
+                        # ISO timestamps compare correctly as strings
+                        if event.get("alias") in deleted and (event.get("timestamp") or "") <= deleted[event["alias"]]:
+                            continue
+                        yield event
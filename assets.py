@@ -0,0 +1,72 @@
+# Static assets served under content-hashed names (home.3f2a9c1b0d4e.css), so a browser
+# can cache them forever: a changed file gets a new name. Each file is read once at
+# startup and kept with its gzip (and brotli, when the module is installed) encodings.
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Preferred order when the client accepts more than one
+ENCODINGS = ("br", "gzip")
+
+
+class Asset:
+    __slots__ = ("name", "digest", "mimetype", "variants")
+
+    def __init__(self, name, data):
+        self.name = name
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.variants = {"identity": data, "gzip": gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(data)
+
+    @property
+    def hashed_name(self):
+        stem, ext = os.path.splitext(self.name)
+        return f"{stem}.{self.digest}{ext}"
+
+    def etag(self, encoding):
+        return self.digest if encoding == "identity" else f"{self.digest}-{encoding}"
+
+
+class AssetRegistry:
+
+    def __init__(self, directory, url_prefix="/assets/"):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.by_name = {}
+        self.by_hashed_name = {}
+        self.load()
+
+    def load(self):
+        by_name = {}
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        by_name[name] = Asset(name, f.read())
+        self.by_name = by_name
+        self.by_hashed_name = {asset.hashed_name: asset for asset in by_name.values()}
+
+    def url(self, name):
+        return self.url_prefix + self.by_name[name].hashed_name
+
+    def get(self, hashed_name):
+        return self.by_hashed_name.get(hashed_name)
+
+
+def pick_encoding(accept_encoding, asset):
+    # accept_encoding: werkzeug's parsed Accept-Encoding header
+    for encoding in ENCODINGS:
+        if encoding in asset.variants and accept_encoding[encoding] > 0:
+            return encoding
+    return "identity"
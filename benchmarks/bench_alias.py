@@ -0,0 +1,68 @@
+# Alias allocation cost as the keyspace fills up: random-with-retry vs leased counter.
+#
+#   python benchmarks/bench_alias.py [--length 3] [--samples 2000]
+#
+# A short alias length keeps the keyspace small enough to fill in memory; the retry
+# behaviour at a given fill ratio is the same for the real 6-character aliases.
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aliases import AliasAllocator, FileLeaseStore  # noqa: E402
+
+CHARS = string.ascii_letters + string.digits
+
+
+def random_alias(taken, length):
+    # Same loop as app.generate_random_alias, returning how many attempts it took
+    attempts = 0
+    while True:
+        attempts += 1
+        alias = ''.join(random.choice(CHARS) for _ in range(length))
+        if alias not in taken:
+            return alias, attempts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--length", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--fill", default="0,0.5,0.9,0.99")
+    args = parser.parse_args()
+
+    keyspace = 62 ** args.length
+    print(f"keyspace={keyspace} samples={args.samples}")
+    print(f"{'fill':>6} {'random us/op':>13} {'avg tries':>10} {'max tries':>10} {'counter us/op':>14}")
+    for fill in (float(f) for f in args.fill.split(",")):
+        target = int(keyspace * fill)
+        taken = set()
+        while len(taken) < target:
+            taken.add(''.join(random.choice(CHARS) for _ in range(args.length)))
+        samples = min(args.samples, keyspace - len(taken))
+
+        tries = []
+        start = time.perf_counter()
+        for _ in range(samples):
+            alias, attempts = random_alias(taken, args.length)
+            tries.append(attempts)
+        random_us = (time.perf_counter() - start) / samples * 1e6
+        # The counter never consults the taken set, so only lease and encode costs show up
+        with tempfile.TemporaryDirectory() as tmp:
+            allocator = AliasAllocator(FileLeaseStore(os.path.join(tmp, "leases.json")),
+                                       width=args.length, shuffle_key="bench")
+            start = time.perf_counter()
+            for _ in range(samples):
+                allocator.next_alias()
+            counter_us = (time.perf_counter() - start) / samples * 1e6
+
+        print(f"{fill:>6.2f} {random_us:>13.2f} {sum(tries) / len(tries):>10.2f} {max(tries):>10} {counter_us:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Importing N links: one /api/shorten request per link vs a single /api/shorten/bulk request.
+#
+#   python benchmarks/bench_bulk.py [--links 2000] [--storage json|journal|sqlite]
+#
+# Runs in-process through the Flask test client against throwaway data files. With the
+# json backend every single-item request rewrites the whole data file.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault('REAPER_INTERVAL', '0')
+os.environ.setdefault('CLICK_ARCHIVE_DIR', '')
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--links", type=int, default=2000)
+parser.add_argument("--storage", default="json", choices=["json", "journal", "sqlite"])
+args = parser.parse_args()
+os.environ['STORAGE_MODE'] = args.storage
+
+import app as app_module  # noqa: E402
+
+
+def reset():
+    with app_module.data_lock:
+        app_module.url_data.update({"links": {}, "analytics": {}, "expired": {}})
+        app_module.storage.save_snapshot(app_module.url_data)
+        app_module.rebuild_indexes()
+
+
+def main():
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 'bench'
+        sess['username'] = 'bench'
+    items = [{"url": f"https://example.com/campaign/{i}", "alias": f"c{i}"} for i in range(args.links)]
+
+    reset()
+    start = time.perf_counter()
+    for item in items:
+        client.post('/api/shorten', json=item)
+    single = time.perf_counter() - start
+
+    reset()
+    start = time.perf_counter()
+    resp = client.post('/api/shorten/bulk', json=items)
+    resp.get_data()
+    bulk = time.perf_counter() - start
+    assert resp.status_code == 201, resp.status_code
+    app_module.click_writer.stop()
+
+    print(f"{args.links:,} links, {args.storage} storage")
+    print(f"{'single-item loop':18} {single:>8.2f}s {args.links / single:>10,.0f} links/s")
+    print(f"{'bulk request':18} {bulk:>8.2f}s {args.links / bulk:>10,.0f} links/s")
+    print(f"speedup: {single / bulk:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# Redirect throughput for one hot link with and without the redirect cache.
+#
+#   python benchmarks/bench_redirect.py [--requests 20000]
+#
+# Runs in-process through the Flask test client against throwaway data files.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault('REAPER_INTERVAL', '0')
+os.environ.setdefault('CLICK_ARCHIVE_DIR', '')
+
+import app as app_module  # noqa: E402
+from models import Link  # noqa: E402
+
+
+def run(client, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get('/go/viral')
+    return requests / (time.perf_counter() - start)
+
+
+def run_view(requests):
+    # The view function alone, without the WSGI round-trip of the test client
+    with app_module.app.test_request_context('/go/viral'):
+        start = time.perf_counter()
+        for _ in range(requests):
+            app_module.go('viral')
+        return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    app_module.url_data["links"]["viral"] = Link("https://example.com/landing?ref=viral", int(time.time()))
+    app_module.url_data["analytics"]["viral"] = app_module.new_analytics()
+    app_module.rebuild_indexes()
+    client = app_module.app.test_client()
+
+    cache_size = app_module.redirect_cache.max_size
+    app_module.redirect_cache.max_size = 0
+    app_module.redirect_cache.clear()
+    uncached = run(client, args.requests)
+    uncached_view = run_view(args.requests)
+    app_module.redirect_cache.max_size = cache_size
+    cached = run(client, args.requests)
+    cached_view = run_view(args.requests)
+    app_module.click_writer.stop()
+
+    print(f"{'':10} {'uncached':>12} {'cached':>12} {'speedup':>8}")
+    print(f"{'client':10} {uncached:>12,.0f} {cached:>12,.0f} {cached / uncached:>7.2f}x")
+    print(f"{'view':10} {uncached_view:>12,.0f} {cached_view:>12,.0f} {cached_view / uncached_view:>7.2f}x")
+    print(f"cache: {app_module.redirect_cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Search latency for one user with many links: LinkSearchIndex against a linear scan of
+# every alias and URL (what the dashboard's DOM filter did).
+#
+#   python benchmarks/bench_search.py [--links 100000]
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aliases import encode_base62  # noqa: E402
+from indexes import LinkSearchIndex  # noqa: E402
+from models import Link  # noqa: E402
+
+HOSTS = ["github.com", "example.com", "rp.edu.sg", "news.ycombinator.com", "docs.python.org"]
+WORDS = ["release", "notes", "issue", "pull", "docs", "guide", "blog", "2024", "landing", "campaign"]
+QUERIES = ["a", "Xy", "abc", "github", "python.org/3", "campaign-77", "no-such-thing"]
+
+
+def make_links(count, rng):
+    links = {}
+    for i in range(count):
+        path = "/".join(rng.choice(WORDS) + f"-{rng.randrange(1000)}" for _ in range(3))
+        links[encode_base62(rng.randrange(62 ** 6), 6)] = Link(f"https://{rng.choice(HOSTS)}/{path}", i, user_id="u")
+    return links
+
+
+def scan(links, query, limit):
+    query = query.lower()
+    return [alias for alias, link in links.items() if query in alias.lower() or query in link.url.lower()][:limit]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    links = make_links(args.links, random.Random(1))
+    index = LinkSearchIndex()
+    start = time.perf_counter()
+    index.load("u", links)
+    print(f"indexed {len(links):,} links in {time.perf_counter() - start:.2f}s")
+
+    print(f"{'query':16} {'index p50 ms':>13} {'max ms':>8} {'scan p50 ms':>12}")
+    for query in QUERIES:
+        p50, worst = timed(lambda: index.search("u", query, 20), args.repeat)
+        scan_p50, _ = timed(lambda: scan(links, query, 20), max(1, args.repeat // 4))
+        print(f"{query:16} {p50:>13.2f} {worst:>8.2f} {scan_p50:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
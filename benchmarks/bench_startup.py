@@ -0,0 +1,75 @@
+# Cold start: time to import the app (load data + build indexes) from the JSON data file
+# vs the binary snapshot, for N links with some click history each.
+#
+#   python benchmarks/bench_startup.py [--links 100000] [--clicks 20]
+#
+# Each start runs in a fresh interpreter; the timings are the app's own startup_timings.
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import rollups  # noqa: E402
+from models import Link  # noqa: E402
+from storage import JsonStorage, SnapshotStorage, new_analytics  # noqa: E402
+
+
+def make_data(links, clicks, rng):
+    data = {"links": {}, "analytics": {}, "expired": {}}
+    now = int(time.time())
+    for i in range(links):
+        alias = f"a{i}"
+        url = f"https://example.com/{i}?ref={rng.randrange(10 ** 6)}"
+        data["links"][alias] = Link(url, now - i, clicks, f"user{i % 1000}")
+        analytics = new_analytics()
+        for c in range(clicks):
+            ts = now - rng.randrange(30 * 86400)
+            analytics["clicks"].append({"timestamp": datetime.fromtimestamp(ts).isoformat(),
+                                        "ip": "10.0.0.1", "user_agent": "bench", "referrer": None})
+            analytics["referrers"]["direct"] = analytics["referrers"].get("direct", 0) + 1
+            rollups.add_click(analytics["rollups"], ts)
+        data["analytics"][alias] = analytics
+    return data
+
+
+def start(workdir, mode):
+    env = dict(os.environ, STORAGE_MODE=mode, REAPER_INTERVAL='0', CLICK_ARCHIVE_DIR='',
+               RAW_CLICK_BUDGET=str(10 ** 9))
+    code = "import json, app; app.click_writer.stop(); print(json.dumps(app.startup_timings))"
+    wall = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=dict(env, PYTHONPATH=ROOT),
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1]), time.perf_counter() - wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=100000)
+    parser.add_argument("--clicks", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    data = make_data(args.links, args.clicks, random.Random(1))
+    JsonStorage(os.path.join(workdir, "urls.json"), os.path.join(workdir, "users.json")).save_snapshot(data)
+    SnapshotStorage(os.path.join(workdir, "urls.json"), os.path.join(workdir, "users.json"),
+                    os.path.join(workdir, "urls.journal"), os.path.join(workdir, "urls.snap")).compact(data)
+    sizes = {name: os.path.getsize(os.path.join(workdir, name)) for name in ("urls.json", "urls.snap")}
+
+    print(f"{args.links:,} links x {args.clicks} clicks")
+    print(f"{'mode':10} {'file MB':>8} {'load s':>8} {'indexes s':>10} {'total s':>8} {'process s':>10}")
+    for mode, name in (("json", "urls.json"), ("snapshot", "urls.snap")):
+        timings, wall = start(workdir, mode)
+        print(f"{mode:10} {sizes[name] / 1e6:>8.1f} {timings['load']:>8.2f} {timings['indexes']:>10.2f} "
+              f"{timings['total']:>8.2f} {wall:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
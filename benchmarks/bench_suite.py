@@ -0,0 +1,382 @@
+# Throughput and latency of the core routes over synthetic datasets, in-process through the
+# Flask test client and over HTTP against a local gunicorn. Results go to a JSON file so runs
+# on different commits can be compared.
+#
+#   python benchmarks/bench_suite.py [--links 10000,100000,1000000] [--clicks 5]
+#                                    [--requests 2000] [--target inprocess,gunicorn]
+#                                    [--storage journal] [--output results.json]
+#                                    [--trace-out trace.jsonl | --trace trace.jsonl]
+#                                    [--compare previous.json]
+#
+# Each dataset has N links (a0 .. aN-1) spread over up to 1000 users (user0 .. user999, all
+# with password "bench"), each link with --clicks raw clicks of history. The requests come
+# from a trace, one JSON object per line:
+#
+#   {"route": "go", "method": "GET", "path": "/go/a123"}
+#   {"route": "api_shorten", "method": "POST", "path": "/api/shorten", "json": {...}, "user": "user0"}
+#
+# "user" logs the request in first. Routes are measured one after another, in the order they
+# first appear in the trace. --trace-out saves the generated trace; --trace replays a saved one
+# (benchmarks/trace.jsonl is a small one for datasets of 10k links or more).
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START_DIR = os.getcwd()
+sys.path.insert(0, ROOT)
+# Scratch space for the datasets and logs, removed when the suite exits
+SCRATCH = tempfile.TemporaryDirectory(prefix="bench-")
+os.chdir(SCRATCH.name)
+os.environ.setdefault('REAPER_INTERVAL', '0')
+os.environ.setdefault('CLICK_ARCHIVE_DIR', '')
+os.environ.setdefault('SLOW_REQUEST_LOG', os.path.join(os.getcwd(), 'slow-requests.log'))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--links", default="10000,100000")
+parser.add_argument("--clicks", type=int, default=5, help="raw clicks of history per link")
+parser.add_argument("--requests", type=int, default=2000, help="measured requests per route")
+parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests per route")
+parser.add_argument("--target", default="inprocess,gunicorn")
+# Every /api/shorten rewrites the whole data file with the json backend
+parser.add_argument("--storage", default="journal", choices=["json", "journal", "snapshot", "sqlite"])
+# More than one worker needs --storage sqlite (see gunicorn.conf.py)
+parser.add_argument("--workers", type=int, default=1)
+parser.add_argument("--threads", type=int, default=8)
+parser.add_argument("--concurrency", type=int, default=8, help="client connections against gunicorn")
+parser.add_argument("--startup-timeout", type=float, default=300, help="seconds for gunicorn to become ready")
+parser.add_argument("--output", default=None, help="defaults to bench-<commit>.json in the current directory")
+parser.add_argument("--trace", default=None)
+parser.add_argument("--trace-out", default=None)
+parser.add_argument("--compare", default=None, help="earlier results file to diff against")
+parser.add_argument("--seed", type=int, default=1)
+args = parser.parse_args()
+os.environ['STORAGE_MODE'] = args.storage
+for path_arg in ("output", "trace", "trace_out", "compare"):
+    # Relative to where the suite was started, not the scratch directory
+    if getattr(args, path_arg):
+        setattr(args, path_arg, os.path.join(START_DIR, getattr(args, path_arg)))
+
+import app as app_module  # noqa: E402
+from bench_startup import make_data  # noqa: E402
+
+ROUTES = ("go", "analytics", "home", "api_shorten")
+BENCH_PASSWORD = "bench"
+
+
+# --- DATASETS ---
+def make_users(links):
+    return {
+        f"user{i}": {'id': f"user{i}", 'email': f"user{i}@example.com",
+                     'password': app_module.hash_password(BENCH_PASSWORD), 'created_at': '2024-01-01T00:00:00'}
+        for i in range(min(1000, links))
+    }
+
+def seed(workdir, links, clicks, rng):
+    # Writes the dataset through the configured storage backend, as the app would have
+    os.makedirs(workdir, exist_ok=True)
+    point_storage_at(workdir)
+    started = time.perf_counter()
+    storage = app_module.open_storage()
+    storage.save_snapshot(make_data(links, clicks, rng))
+    storage.save_users(make_users(links))
+    storage.close()
+    return time.perf_counter() - started
+
+def point_storage_at(workdir):
+    for name in ("DATA_FILE", "USER_FILE", "JOURNAL_FILE", "SNAPSHOT_FILE", "SQLITE_FILE", "ALIAS_LEASE_FILE"):
+        setattr(app_module, name, os.path.join(workdir, os.path.basename(getattr(app_module, name))))
+
+
+# --- TRACES ---
+def make_trace(links, requests, rng):
+    # user0 owns a0, a1000, a2000, ... (see make_data)
+    owned = list(range(0, links, min(1000, links)))
+    trace = []
+    for route in ROUTES:
+        for i in range(requests):
+            if route == "go":
+                trace.append({"route": route, "method": "GET", "path": f"/go/a{rng.randrange(links)}"})
+            elif route == "analytics":
+                trace.append({"route": route, "method": "GET", "path": f"/analytics/a{rng.choice(owned)}", "user": "user0"})
+            elif route == "home":
+                trace.append({"route": route, "method": "GET", "path": "/", "user": "user0"})
+            else:
+                trace.append({"route": route, "method": "POST", "path": "/api/shorten", "user": "user0",
+                              "json": {"url": f"https://example.com/bench/{rng.randrange(10 ** 9)}"}})
+    return trace
+
+def read_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def write_trace(path, trace):
+    with open(path, "w") as f:
+        for entry in trace:
+            f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+def by_route(trace):
+    routes = {}
+    for entry in trace:
+        routes.setdefault(entry["route"], []).append(entry)
+    return routes
+
+
+# --- RUNNERS ---
+def summarize(latencies, errors, wall):
+    latencies.sort()
+    n = len(latencies)
+
+    def percentile(q):
+        return round(latencies[min(n - 1, int(q * n))] * 1000, 3) if n else None
+
+    return {
+        "requests": n,
+        "errors": errors,
+        "rps": round(n / wall, 1) if wall else None,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(latencies[-1] * 1000, 3) if n else None
+    }
+
+def ok(status):
+    return 200 <= status < 400
+
+def run_inprocess(workdir, trace, warmup):
+    point_storage_at(workdir)
+    started = time.perf_counter()
+    with app_module.data_lock:
+        app_module.storage = app_module.open_storage()
+        app_module.url_data.clear()
+        app_module.url_data.update(app_module.load_data())
+        app_module.users.clear()
+        app_module.users.update(app_module.load_users())
+        app_module.redirect_cache.clear()
+        app_module.rebuild_indexes()
+    load_seconds = time.perf_counter() - started
+
+    client = app_module.app.test_client()
+    logged_in = None
+    results = {}
+    for route, entries in by_route(trace).items():
+        latencies, errors = [], 0
+        wall = 0
+        for i, entry in enumerate(entries[:warmup] + entries):
+            user = entry.get("user")
+            if user and user != logged_in:
+                with client.session_transaction() as sess:
+                    sess['user_id'] = app_module.users[user]['id']
+                    sess['username'] = user
+                logged_in = user
+            begin = time.perf_counter()
+            resp = client.open(entry["path"], method=entry["method"], json=entry.get("json"))
+            resp.close()
+            elapsed = time.perf_counter() - begin
+            if i >= warmup:
+                latencies.append(elapsed)
+                wall += elapsed
+                errors += not ok(resp.status_code)
+        results[route] = summarize(latencies, errors, wall)
+        # Clicks queued during this route are written before the next one is measured
+        app_module.click_writer.flush()
+    return results, load_seconds
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(workdir, port):
+    # The data files are in workdir under the app's default names
+    env = dict(os.environ, PYTHONPATH=ROOT, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_ACCESS_LOG="",
+               WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads))
+    if args.workers > 1:
+        env["ALIAS_INDEX_FILE"] = os.path.join(workdir, "aliases.idx")
+    command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py")]
+    log_path = os.path.join(workdir, "gunicorn.log")
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.startup_timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}: {log_tail(log_path)}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health/ready")
+            if conn.getresponse().status == 200:
+                return process, time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.1)
+    process.kill()
+    process.wait()
+    raise RuntimeError(f"gunicorn not ready after {args.startup_timeout:.0f}s: {log_tail(log_path)}")
+
+def log_tail(path, lines=5):
+    # The dataset directory, and the log with it, is removed once the dataset is done
+    with open(path) as f:
+        return " | ".join(f.read().splitlines()[-lines:])
+
+def login(port, user):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    body = urlencode({"username": user, "password": BENCH_PASSWORD})
+    conn.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie")
+    if resp.status != 302 or not cookie:
+        raise RuntimeError(f"Could not log in as {user}: {resp.status}")
+    return cookie.split(";", 1)[0]
+
+def run_http_route(port, entries, cookies, concurrency):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    chunks = [entries[i::concurrency] for i in range(concurrency)]
+
+    def worker(chunk):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine, failed = [], 0
+        for entry in chunk:
+            headers = {}
+            if entry.get("user"):
+                headers["Cookie"] = cookies[entry["user"]]
+            body = None
+            if entry.get("json") is not None:
+                body = json.dumps(entry["json"])
+                headers["Content-Type"] = "application/json"
+            begin = time.perf_counter()
+            try:
+                conn.request(entry["method"], entry["path"], body, headers)
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                status = 0
+            mine.append(time.perf_counter() - begin)
+            failed += not ok(status)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks if chunk]
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - begin
+
+def run_gunicorn(workdir, trace, warmup):
+    port = free_port()
+    process, load_seconds = start_gunicorn(workdir, port)
+    try:
+        cookies = {user: login(port, user) for user in {e["user"] for e in trace if e.get("user")}}
+        results = {}
+        for route, entries in by_route(trace).items():
+            run_http_route(port, entries[:warmup], cookies, args.concurrency)
+            latencies, errors, wall = run_http_route(port, entries, cookies, args.concurrency)
+            # Throughput here is concurrent, so it comes from the wall clock, not summed latencies
+            results[route] = summarize(latencies, errors, wall)
+        return results, load_seconds
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def run_target(target, links, workdir, trace):
+    # (routes, load seconds), or (None, None) if the target could not be run
+    if target == "inprocess":
+        return run_inprocess(workdir, trace, args.warmup)
+    if target != "gunicorn":
+        raise SystemExit(f"Unknown target: {target}")
+    try:
+        return run_gunicorn(workdir, trace, args.warmup)
+    except (OSError, RuntimeError) as e:
+        print(f"{links:>9,} {target:10} skipped: {e}")
+        return None, None
+
+
+# --- REPORTING ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results, path):
+    with open(path) as f:
+        previous = {(r["links"], r["target"], r["route"]): r for r in json.load(f)["results"]}
+    print(f"\nvs {path}")
+    print(f"{'links':>9} {'target':10} {'route':12} {'rps':>9} {'p99':>9}")
+    for r in results:
+        old = previous.get((r["links"], r["target"], r["route"]))
+        if old and old["rps"] and old["p99_ms"]:
+            print(f"{r['links']:>9,} {r['target']:10} {r['route']:12} "
+                  f"{(r['rps'] / old['rps'] - 1) * 100:>+8.1f}% {(r['p99_ms'] / old['p99_ms'] - 1) * 100:>+8.1f}%")
+
+
+def main():
+    commit = git_commit()
+    targets = args.target.split(",")
+    replayed = read_trace(args.trace) if args.trace else None
+    results = []
+    print(f"commit {commit}, {args.storage} storage, {args.clicks} clicks per link")
+    print(f"{'links':>9} {'target':10} {'route':12} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for links in (int(n) for n in args.links.split(",")):
+        rng = random.Random(args.seed)
+        # Removed before the next dataset is seeded, so only one is on disk at a time
+        with tempfile.TemporaryDirectory(prefix=f"dataset-{links}-", dir=SCRATCH.name) as workdir:
+            seed_seconds = seed(workdir, links, args.clicks, rng)
+            trace = replayed or make_trace(links, args.requests, rng)
+            if args.trace_out and not replayed:
+                # The smallest dataset's trace, which replays against any larger one
+                write_trace(args.trace_out, trace)
+                args.trace_out = None
+            for target in targets:
+                routes, load_seconds = run_target(target, links, workdir, trace)
+                if routes is None:
+                    continue
+                for route, summary in routes.items():
+                    results.append({"links": links, "target": target, "route": route,
+                                    "clicks_per_link": args.clicks, "seed_seconds": round(seed_seconds, 3),
+                                    "load_seconds": round(load_seconds, 3), **summary})
+                    print(f"{links:>9,} {target:10} {route:12} {summary['rps'] or 0:>9,.0f} "
+                          f"{summary['p50_ms'] or 0:>8.2f} {summary['p99_ms'] or 0:>8.2f} {summary['errors']:>7}")
+            # Queued clicks belong to this dataset's files
+            app_module.click_writer.flush()
+    app_module.click_writer.stop()
+
+    output = args.output or os.path.join(START_DIR, f"bench-{commit}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "results": results
+        }, f, indent=2)
+    print(f"\nwrote {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
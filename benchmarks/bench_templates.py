@@ -0,0 +1,53 @@
+# Dashboard and login render time: render_template_string() per request vs the
+# precompiled template registry.
+#
+#   python benchmarks/bench_templates.py [--links 50] [--renders 200]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault('REAPER_INTERVAL', '0')
+
+from flask import render_template_string  # noqa: E402
+
+import app as app_module  # noqa: E402
+from models import Link  # noqa: E402
+
+
+def per_render_ms(fn, renders):
+    start = time.perf_counter()
+    for _ in range(renders):
+        fn()
+    return (time.perf_counter() - start) / renders * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=50)
+    parser.add_argument("--renders", type=int, default=200)
+    args = parser.parse_args()
+
+    links = {f"a{i}": Link(f"https://example.com/{i}", int(time.time()), i, "bench") for i in range(args.links)}
+    stats = {"total_links": args.links, "total_clicks": 0, "active_links": args.links, "expiring_soon": 0}
+    context = {"links": links, "stats": stats, "username": "bench"}
+
+    with app_module.app.test_request_context('/'):
+        rows = [
+            ("home", lambda: render_template_string(app_module.HOME_TEMPLATE, **context),
+             lambda: app_module.render_compiled("home", **context)),
+            ("login", lambda: render_template_string(app_module.LOGIN_TEMPLATE),
+             lambda: app_module.app.response_class(app_module.LOGIN_PAGE, mimetype="text/html")),
+        ]
+        print(f"{'template':10} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name, before, after in rows:
+            before_ms = per_render_ms(before, args.renders)
+            after_ms = per_render_ms(after, args.renders)
+            print(f"{name:10} {before_ms:>10.3f} {after_ms:>10.3f} {before_ms / after_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
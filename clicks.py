@@ -0,0 +1,171 @@
+import logging
+import queue
+import threading
+import time
+
+from counters import ShardedCounter
+
+logger = logging.getLogger(__name__)
+
+# What submit() does when the queue is full:
+#   'drop'  - discard the new click and count it
+#   'block' - wait up to block_timeout for room, then drop
+#   'sync'  - write the click on the request thread
+OVERFLOW_POLICIES = ('drop', 'block', 'sync')
+
+
+class ClickWriter:
+    # Redirects enqueue compact click tuples; one background thread writes them in batches.
+    # Each is queued as (enqueue time, event), so readiness can tell how long the oldest
+    # unwritten click has been waiting.
+
+    def __init__(self, write_batch, max_queue=10000, batch_size=500, flush_interval=0.5,
+                 policy='drop', block_timeout=0.05):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown click queue policy: {policy}")
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.flushing = threading.Event()
+        # Bumped from request threads (drops, 'sync' writes) as well as the writer thread
+        self.written_count = ShardedCounter()
+        self.dropped_count = ShardedCounter()
+        self.failed_count = ShardedCounter()
+        # Clicks write_batch did not record, e.g. on links deleted while they were queued
+        self.skipped_count = ShardedCounter()
+        self.last_write = None
+        self.last_failure = None
+        # Enqueue time of the first click in the batch the writer thread is holding
+        self.held_since = None
+
+    @property
+    def written(self):
+        return self.written_count.value
+
+    @property
+    def dropped(self):
+        return self.dropped_count.value
+
+    @property
+    def failed(self):
+        return self.failed_count.value
+
+    @property
+    def skipped(self):
+        return self.skipped_count.value
+
+    def submit(self, event):
+        if self.thread is None:
+            self.start()
+        item = (time.time(), event)
+        try:
+            if self.policy == 'block':
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            if self.policy == 'sync':
+                self.write([event])
+                return True
+            self.dropped_count.add()
+            return False
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self.run, name="click-writer", daemon=True)
+                self.thread.start()
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def oldest_pending(self):
+        # Enqueue time of the oldest click not written yet, or None when there is none
+        held_since = self.held_since
+        if held_since is not None:
+            return held_since
+        with self.queue.mutex:
+            return self.queue.queue[0][0] if self.queue.queue else None
+
+    def take(self, timeout):
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        self.held_since = batch[0][0]
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self.flushing.is_set():
+                    # Short polls so a flush() does not wait out the whole batching window
+                    batch.append(self.queue.get(timeout=min(remaining, 0.05)))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                if remaining <= 0 or self.flushing.is_set():
+                    break
+        return batch
+
+    def write(self, batch):
+        try:
+            # write_batch may return how many of the clicks it recorded
+            recorded = self.write_batch(batch)
+            recorded = len(batch) if recorded is None else recorded
+            self.written_count.add(recorded)
+            self.skipped_count.add(len(batch) - recorded)
+            self.last_write = time.time()
+        except Exception:
+            self.failed_count.add(len(batch))
+            self.last_failure = time.time()
+            logger.exception("Failed to write %d clicks", len(batch))
+
+    def run(self):
+        while not self.stopping.is_set():
+            batch = self.take(self.flush_interval)
+            if batch:
+                self.write([event for _, event in batch])
+                self.held_since = None
+                for _ in batch:
+                    self.queue.task_done()
+
+    def drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self.write([event for _, event in batch])
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        # Write everything queued so far, including a batch the writer thread is holding
+        self.flushing.set()
+        try:
+            # With the writer running, let it drain so batches are still applied in order
+            if self.thread is not None:
+                self.queue.join()
+            else:
+                self.drain()
+        finally:
+            self.flushing.clear()
+
+    def stop(self, timeout=5):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        self.drain()
@@ -0,0 +1,46 @@
+# Counters bumped from many threads without a shared lock: each thread adds to its own shard
+# and readers sum the shards, so concurrent increments never lose updates.
+import threading
+
+
+class ShardedCounter:
+    # A shard is a list of `size` numbers, so several related counts (a histogram's buckets)
+    # can share one. Shards of finished threads are folded into `retired` whenever a new
+    # thread registers, so a thread-per-request server does not grow the shard list without bound
+
+    def __init__(self, size=1):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards = []
+        self.retired = [0] * size
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = [0] * len(self.retired)
+            with self.lock:
+                live = []
+                for thread, other in self.shards:
+                    if thread.is_alive():
+                        live.append((thread, other))
+                    else:
+                        for i, n in enumerate(other):
+                            self.retired[i] += n
+                live.append((threading.current_thread(), shard))
+                self.shards = live
+        return shard
+
+    def add(self, n=1, index=0):
+        self.shard()[index] += n
+
+    def values(self):
+        with self.lock:
+            totals = list(self.retired)
+            for _, shard in self.shards:
+                for i, n in enumerate(shard):
+                    totals[i] += n
+        return totals
+
+    @property
+    def value(self):
+        return self.values()[0]
@@ -0,0 +1,74 @@
+# Row formats for /api/export and /api/import. Rows are plain dicts; NDJSON and CSV are
+# produced and parsed one row at a time so neither side holds a whole dataset in memory.
+import csv
+import io
+import itertools
+import json
+
+LINK_FIELDS = ("alias", "url", "created", "clicks", "expiry_date", "password", "utm_tracking")
+CLICK_FIELDS = ("alias", "timestamp", "ip", "user_agent", "referrer")
+FIELDS = {"links": LINK_FIELDS, "clicks": CLICK_FIELDS}
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def link_row(alias, link):
+    row = link.to_dict()
+    del row["user_id"]
+    row["alias"] = alias
+    return row
+
+def click_row(alias, click):
+    return {"alias": alias, **{field: click.get(field) for field in CLICK_FIELDS[1:]}}
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, separators=(',', ':')) + "\n"
+
+def csv_lines(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        # Hand out whatever has accumulated every so often rather than per row
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def encode(rows, fmt, fields):
+    return csv_lines(rows, fields) if fmt == "csv" else ndjson_lines(rows)
+
+
+def read_rows(stream, fmt):
+    # stream: a binary file object. Yields (line number, row dict, or ValueError for a bad line)
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, ValueError("Invalid JSON")
+            continue
+        yield number, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
@@ -0,0 +1,48 @@
+# Production server: gunicorn -c gunicorn.conf.py
+#
+# The app is preloaded in the master, so the link map is loaded once and shared with the
+# workers copy-on-write; each worker then starts its own background threads after fork.
+# Every worker keeps its own copy of url_data from then on, so more than one worker needs
+# sqlite storage (the only one several processes can write) and ALIAS_INDEX_FILE, through
+# which redirects see the links created and deleted in other workers.
+#
+# Point other servers at app:create_app(), not app:app: importing app:app does not start the
+# compactor, expiry reaper or alias index publisher; only create_app() or start_worker() does.
+import gc
+import os
+
+wsgi_app = "app:create_app(start=False)"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+# Threads per worker; redirects mostly wait on I/O and the click queue, not the CPU
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_class = "gthread" if threads > 1 else "sync"
+if workers > 1 and (os.environ.get("STORAGE_MODE") != "sqlite" or not os.environ.get("ALIAS_INDEX_FILE")):
+    raise RuntimeError("More than one worker needs STORAGE_MODE=sqlite and ALIAS_INDEX_FILE")
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+# Within the pod's terminationGracePeriodSeconds, leaving time to flush queued clicks
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 20))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 0))
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-") or None
+# Heartbeat files; /tmp is the only writable path in the container
+worker_tmp_dir = os.environ.get("GUNICORN_WORKER_TMP_DIR", "/tmp")
+
+
+def pre_fork(server, worker):
+    # Moves the preloaded objects out of the collector's reach, so a collection in a worker
+    # does not write to (and so copy) every page of the shared link map
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+    app.start_worker()
+
+
+def worker_exit(server, worker):
+    # gunicorn replaces the app's SIGTERM handler in workers; write out queued clicks here
+    import app
+    app.click_writer.stop()
@@ -0,0 +1,342 @@
+# Secondary in-memory indexes over url_data["links"]. Callers hold data_lock while mutating.
+import heapq
+import itertools
+
+
+class UserLinkIndex:
+    # user_id -> aliases, in creation order
+
+    def __init__(self):
+        self.by_user = {}
+
+    def add(self, alias, link):
+        self.by_user.setdefault(link.user_id, {})[alias] = None
+
+    def remove(self, alias, link):
+        aliases = self.by_user.get(link.user_id)
+        if aliases is not None:
+            aliases.pop(alias, None)
+            if not aliases:
+                del self.by_user[link.user_id]
+
+    def aliases(self, user_id):
+        return list(self.by_user.get(user_id, ()))
+
+    def count(self, user_id):
+        return len(self.by_user.get(user_id, ()))
+
+    def rebuild(self, links):
+        self.by_user = {}
+        for alias, link in links.items():
+            self.add(alias, link)
+
+
+EXPIRING_SOON_WINDOW = 7 * 24 * 3600
+
+# Lifecycle stages of a link with an expiry date
+ACTIVE, EXPIRING_SOON, EXPIRED = 0, 1, 2
+
+
+def expiry_stage(expiry, now):
+    if expiry is None or now <= expiry - EXPIRING_SOON_WINDOW:
+        return ACTIVE
+    if now <= expiry:
+        return EXPIRING_SOON
+    return EXPIRED
+
+
+class UserStats:
+    # Dashboard counters per user, adjusted on shorten/delete/click. Expiry transitions are
+    # queued in a heap and applied lazily by advance(), so reading the counters is O(1) amortized.
+
+    def __init__(self):
+        self.by_user = {}
+        self.tracked = {}
+        self.transitions = []
+        self.seq = itertools.count()
+
+    def counters(self, user_id):
+        counters = self.by_user.get(user_id)
+        if counters is None:
+            counters = self.by_user[user_id] = {
+                "total_links": 0,
+                "total_clicks": 0,
+                "active_links": 0,
+                "expiring_soon": 0
+            }
+        return counters
+
+    def schedule(self, alias, entry):
+        expiry = entry[1]
+        if expiry is None:
+            return
+        if entry[2] == ACTIVE:
+            heapq.heappush(self.transitions, (expiry - EXPIRING_SOON_WINDOW, next(self.seq), alias, entry, EXPIRING_SOON))
+        if entry[2] != EXPIRED:
+            heapq.heappush(self.transitions, (expiry, next(self.seq), alias, entry, EXPIRED))
+
+    def add(self, alias, link, now):
+        self.advance(now)
+        entry = [link.user_id, link.expiry, expiry_stage(link.expiry, now)]
+        self.tracked[alias] = entry
+        counters = self.counters(entry[0])
+        counters["total_links"] += 1
+        counters["total_clicks"] += link.clicks
+        if entry[2] != EXPIRED:
+            counters["active_links"] += 1
+        if entry[2] == EXPIRING_SOON:
+            counters["expiring_soon"] += 1
+        self.schedule(alias, entry)
+
+    def remove(self, alias, link, now):
+        self.advance(now)
+        entry = self.tracked.pop(alias, None)
+        if entry is None:
+            return
+        counters = self.counters(entry[0])
+        counters["total_links"] -= 1
+        counters["total_clicks"] -= link.clicks
+        if entry[2] != EXPIRED:
+            counters["active_links"] -= 1
+        if entry[2] == EXPIRING_SOON:
+            counters["expiring_soon"] -= 1
+
+    def click(self, alias, count=1):
+        entry = self.tracked.get(alias)
+        if entry is not None:
+            self.counters(entry[0])["total_clicks"] += count
+
+    def advance(self, now):
+        while self.transitions and self.transitions[0][0] < now:
+            _, _, alias, entry, stage = heapq.heappop(self.transitions)
+            # Skip transitions for links that were deleted or re-created since they were queued
+            if self.tracked.get(alias) is not entry or stage <= entry[2]:
+                continue
+            counters = self.counters(entry[0])
+            if entry[2] == EXPIRING_SOON:
+                counters["expiring_soon"] -= 1
+            if stage == EXPIRING_SOON:
+                counters["expiring_soon"] += 1
+            else:
+                counters["active_links"] -= 1
+            entry[2] = stage
+
+    def get(self, user_id, now):
+        self.advance(now)
+        if user_id not in self.by_user:
+            return {"total_links": 0, "total_clicks": 0, "active_links": 0, "expiring_soon": 0}
+        return dict(self.by_user[user_id])
+
+    def rebuild(self, links, now):
+        self.by_user = {}
+        self.tracked = {}
+        self.transitions = []
+        for alias, link in links.items():
+            self.add(alias, link, now)
+
+
+class ExpiryIndex:
+    # alias -> parsed expiry epoch for hot links, with a min-heap so the reaper
+    # only touches links that are actually due
+
+    def __init__(self):
+        self.expiries = {}
+        self.heap = []
+
+    def add(self, alias, link):
+        if link.expiry is None:
+            self.expiries.pop(alias, None)
+            return
+        self.expiries[alias] = link.expiry
+        heapq.heappush(self.heap, (link.expiry, alias))
+
+    def remove(self, alias):
+        self.expiries.pop(alias, None)
+        # Removed entries stay in the heap until popped; rebuild once they dominate it
+        if len(self.heap) > 2 * len(self.expiries) + 64:
+            self.heap = [(expiry, a) for a, expiry in self.expiries.items()]
+            heapq.heapify(self.heap)
+
+    def get(self, alias):
+        return self.expiries.get(alias)
+
+    def is_expired(self, alias, now):
+        expiry = self.expiries.get(alias)
+        return expiry is not None and now > expiry
+
+    def pop_expired(self, now):
+        expired = []
+        while self.heap and self.heap[0][0] < now:
+            expiry, alias = heapq.heappop(self.heap)
+            if self.expiries.get(alias) == expiry:
+                del self.expiries[alias]
+                expired.append(alias)
+        return expired
+
+    def rebuild(self, links):
+        self.expiries = {}
+        self.heap = []
+        for alias, link in links.items():
+            self.add(alias, link)
+
+
+def search_text(url):
+    # Destination URLs are searched without the scheme and "www.", which nearly all share
+    text = url.lower()
+    for prefix in ("https://", "http://", "www."):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    return text
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def add_entry(trie, postings, texts, alias, link):
+    node = trie
+    for char in alias.lower():
+        node = node.setdefault(char, {})
+    node.setdefault(None, set()).add(alias)
+    text = search_text(link.url)
+    texts[alias] = text
+    for gram in trigrams(text):
+        postings.setdefault(gram, set()).add(alias)
+
+
+class LinkSearchIndex:
+    # Per-user search over links: a trie of lowercased aliases for prefix matches and a
+    # trigram -> aliases posting map for substring matches in the destination URL.
+    # Trie nodes are dicts of char -> child node; the None key holds the aliases ending there.
+    # A user's index is built on their first search, so startup does not pay for it. The
+    # build can run outside the caller's lock: begin() under the lock, build() without it,
+    # then install() under the lock again, which replays the changes made in between.
+
+    def __init__(self):
+        self.tries = {}
+        self.grams = {}
+        self.texts = {}
+        # user_id -> (alias, link, removed) changes made while that user's index is built
+        self.building = {}
+
+    def loaded(self, user_id):
+        return user_id in self.tries
+
+    def load(self, user_id, links):
+        self.begin(user_id)
+        self.install(user_id, self.build(links))
+
+    def begin(self, user_id):
+        self.building.setdefault(user_id, [])
+
+    def build(self, links):
+        # (trie, postings, texts) for links, without touching the index
+        trie, postings, texts = {}, {}, {}
+        for alias, link in links.items():
+            add_entry(trie, postings, texts, alias, link)
+        return trie, postings, texts
+
+    def install(self, user_id, built):
+        changes = self.building.pop(user_id, None)
+        if changes is None:
+            # Already installed by a concurrent build, or dropped by rebuild()
+            return
+        self.tries[user_id], self.grams[user_id], texts = built
+        self.texts.update(texts)
+        for alias, link, removed in changes:
+            if removed:
+                self.remove(alias, link)
+            else:
+                self.add(alias, link)
+
+    def defer(self, alias, link, removed):
+        # A change for a user who is not loaded; kept for install() if their index is being built
+        if link.user_id in self.building:
+            self.building[link.user_id].append((alias, link, removed))
+
+    def add(self, alias, link):
+        trie = self.tries.get(link.user_id)
+        if trie is None:
+            self.defer(alias, link, False)
+            return
+        add_entry(trie, self.grams[link.user_id], self.texts, alias, link)
+
+    def remove(self, alias, link):
+        trie = self.tries.get(link.user_id)
+        if trie is None:
+            self.defer(alias, link, True)
+            return
+        path = [trie]
+        for char in alias.lower():
+            path.append(path[-1].get(char))
+            if path[-1] is None:
+                break
+        else:
+            path[-1].get(None, set()).discard(alias)
+            # Prune the nodes that no longer lead to any alias
+            for parent, char, node in zip(reversed(path[:-1]), reversed(alias.lower()), reversed(path)):
+                if node.get(None) == set():
+                    del node[None]
+                if node:
+                    break
+                del parent[char]
+        text = self.texts.pop(alias, None)
+        postings = self.grams[link.user_id]
+        for gram in trigrams(text or ""):
+            aliases = postings.get(gram)
+            if aliases is not None:
+                aliases.discard(alias)
+                if not aliases:
+                    del postings[gram]
+
+    def alias_matches(self, user_id, query, limit):
+        # Depth-first in character order below the prefix node, stopping once limit aliases
+        # are found: an exact match comes first, then the rest alphabetically
+        node = self.tries.get(user_id, {})
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            found.extend(sorted(node.get(None, ())))
+            stack.extend(node[char] for char in sorted((c for c in node if c is not None), reverse=True))
+        return found[:limit]
+
+    def url_matches(self, user_id, query, limit):
+        # Needs at least one whole trigram; shorter queries only match aliases
+        query = search_text(query)
+        if len(query) < 3:
+            return []
+        postings = self.grams.get(user_id, {})
+        smallest = min((postings.get(gram, ()) for gram in trigrams(query)), key=len)
+        # The smallest posting set bounds the candidates; find() confirms the substring and
+        # gives the rank: earlier, then tighter matches first
+        texts = self.texts
+        matches = []
+        for alias in smallest:
+            text = texts[alias]
+            position = text.find(query)
+            if position >= 0:
+                matches.append((position, len(text), alias))
+        return [alias for _, _, alias in heapq.nsmallest(limit, matches)]
+
+    def search(self, user_id, query, limit=20):
+        # Ranked (alias, "alias" | "url") pairs: alias prefix matches first, then URL matches
+        query = query.strip().lower()
+        if not query:
+            return []
+        results = [(alias, "alias") for alias in self.alias_matches(user_id, query, limit)]
+        if len(results) < limit:
+            seen = {alias for alias, _ in results}
+            for alias in self.url_matches(user_id, query, limit + len(seen)):
+                if alias not in seen:
+                    results.append((alias, "url"))
+        return results[:limit]
+
+    def rebuild(self, links):
+        # Drop every loaded user; each is rebuilt from the current links on their next search
+        self.tries = {}
+        self.grams = {}
+        self.texts = {}
+        self.building = {}
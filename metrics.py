@@ -0,0 +1,122 @@
+# Metrics in the Prometheus text exposition format. Counters and histograms record into
+# per-thread shards (see counters.py), so an observation on the request path never waits on a
+# lock held by another request; the shards are only summed when /metrics is scraped.
+from bisect import bisect_left
+
+from counters import ShardedCounter
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; skewed low since redirects are expected to take well under a millisecond
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket, then the +Inf count, then the running sum
+        self.counts = ShardedCounter(len(self.buckets) + 2)
+
+    def observe(self, value):
+        shard = self.counts.shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def samples(self, name, labels):
+        totals = self.counts.values()
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), totals):
+            cumulative += count
+            yield f"{name}_bucket", labels + (("le", format_value(bound)),), cumulative
+        yield f"{name}_sum", labels, totals[-1]
+        yield f"{name}_count", labels, cumulative
+
+
+class Family:
+    # One metric name with a child per combination of label values, created on first use
+
+    def __init__(self, name, help, kind, labelnames=(), factory=ShardedCounter):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            # setdefault keeps the first child if two threads race to create it
+            child = self.children.setdefault(values, self.factory())
+        return child
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            if self.kind == "histogram":
+                yield from child.samples(self.name, labels)
+            else:
+                yield self.name, labels, child.value
+
+
+class Gauge:
+    # Read at scrape time: collect() returns a number, or {label values: number}
+
+    def __init__(self, name, help, collect, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        value = self.collect()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for values, number in value.items():
+            if number is not None:
+                yield self.name, tuple(zip(self.labelnames, values)), number
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Family(name, help, "counter", labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Family(name, help, "histogram", labelnames, lambda: Histogram(buckets)))
+
+    def gauge(self, name, help, collect, labelnames=(), kind="gauge"):
+        return self.register(Gauge(name, help, collect, labelnames, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
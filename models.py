@@ -0,0 +1,106 @@
+import sys
+from collections import deque
+from datetime import datetime
+
+CREATED_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Link.flags bits
+FLAG_PASSWORD = 1
+FLAG_UTM = 2
+
+
+def parse_expiry(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def parse_created(value):
+    try:
+        return int(datetime.strptime(value, CREATED_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        # Keep anything unexpected as-is so it round-trips unchanged
+        return value
+
+
+class Link:
+    # In-memory form of one url_data["links"] entry. to_dict()/from_dict() convert to and
+    # from the JSON schema; get()/[] read it by its JSON keys for code that still expects a dict.
+    __slots__ = ("url", "created_at", "clicks", "user_id", "expiry_date", "expiry", "password", "flags")
+
+    def __init__(self, url, created_at, clicks=0, user_id=None, expiry_date=None, password=None, utm_tracking=False):
+        self.url = url
+        self.created_at = created_at
+        self.clicks = clicks
+        self.user_id = sys.intern(user_id) if isinstance(user_id, str) else user_id
+        self.expiry_date = expiry_date
+        self.expiry = parse_expiry(expiry_date)
+        self.password = password or None
+        self.flags = (FLAG_PASSWORD if password else 0) | (FLAG_UTM if utm_tracking else 0)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["url"],
+            parse_created(data.get("created")),
+            data.get("clicks", 0),
+            data.get("user_id"),
+            data.get("expiry_date"),
+            data.get("password"),
+            data.get("utm_tracking", False)
+        )
+
+    @property
+    def created(self):
+        if isinstance(self.created_at, int):
+            return datetime.fromtimestamp(self.created_at).strftime(CREATED_FORMAT)
+        return self.created_at
+
+    @property
+    def utm_tracking(self):
+        return bool(self.flags & FLAG_UTM)
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "created": self.created,
+            "clicks": self.clicks,
+            "user_id": self.user_id,
+            "expiry_date": self.expiry_date,
+            "password": self.password,
+            "utm_tracking": self.utm_tracking
+        }
+
+    def keys(self):
+        return LINK_KEYS
+
+    def __getitem__(self, key):
+        if key not in LINK_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in LINK_KEYS else default
+
+    def __eq__(self, other):
+        return isinstance(other, Link) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Link({self.to_dict()!r})"
+
+
+LINK_KEYS = ("url", "created", "clicks", "user_id", "expiry_date", "password", "utm_tracking")
+
+
+def json_default(obj):
+    # For json.dump: Link records and raw click deques back to the plain JSON schema
+    if isinstance(obj, Link):
+        return obj.to_dict()
+    if isinstance(obj, deque):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def links_from_dicts(links):
+    return {alias: link if isinstance(link, Link) else Link.from_dict(link) for alias, link in links.items()}
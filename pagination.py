@@ -0,0 +1,60 @@
+# Keyset (cursor) pagination over a user's links. A cursor holds the sort key and alias of
+# the last link on the previous page, so pages stay stable while links are added or deleted
+# and a page costs one pass over the user's links instead of sorting all of them.
+import base64
+import heapq
+import json
+
+# sort name -> (key function of (alias, link), type of the key as stored in a cursor)
+SORT_KEYS = {
+    "created": (lambda alias, link: link.created_at if isinstance(link.created_at, int) else 0, int),
+    "clicks": (lambda alias, link: link.clicks, int),
+    "alias": (lambda alias, link: alias, str),
+    "url": (lambda alias, link: link.url, str),
+}
+ORDERS = ("asc", "desc")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(sort, order, key, alias):
+    raw = json.dumps([sort, order, key, alias], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, sort, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, key, alias = json.loads(raw)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError("Cursor was issued for a different sort order")
+    if not isinstance(key, SORT_KEYS[sort][1]) or not isinstance(alias, str):
+        raise ValueError("Invalid cursor")
+    return key, alias
+
+def page(items, sort="created", order="desc", cursor=None, limit=DEFAULT_LIMIT):
+    # items: (alias, link) pairs in any order. Returns (up to limit pairs, next cursor or None)
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort: {sort}")
+    if order not in ORDERS:
+        raise ValueError(f"Unknown order: {order}")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+
+    sort_key = SORT_KEYS[sort][0]
+    rows = (((sort_key(alias, link), alias), link) for alias, link in items)
+    if cursor:
+        after = decode_cursor(cursor, sort, order)
+        if order == "asc":
+            rows = (row for row in rows if row[0] > after)
+        else:
+            rows = (row for row in rows if row[0] < after)
+
+    pick = heapq.nsmallest if order == "asc" else heapq.nlargest
+    selected = pick(limit + 1, rows, key=lambda row: row[0])
+    next_cursor = None
+    if len(selected) > limit:
+        next_cursor = encode_cursor(sort, order, *selected[limit - 1][0])
+    return [(alias, link) for (_, alias), link in selected[:limit]], next_cursor
@@ -0,0 +1,87 @@
+# Wall-clock sampling profiler that is safe to switch on in production. A background thread
+# snapshots every other thread's stack at a fixed interval and counts identical stacks; the
+# app keeps running at full speed between samples. Output is the collapsed-stack format
+# ("root;caller;callee count" per line) that flamegraph.pl and speedscope read directly.
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Request threads are numbered ("Thread-12 (process_request_thread)"); folding the numbers
+# together gives one flame per kind of thread instead of one per request
+THREAD_NUMBER = re.compile(r"-\d+")
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.output = None
+
+    @property
+    def running(self):
+        thread = self.thread
+        return thread is not None and thread.is_alive()
+
+    def start(self, seconds, path):
+        # Samples for `seconds`, then writes the collapsed stacks to path. False if already running
+        with self.lock:
+            if self.running:
+                return False
+            self.stopping.clear()
+            self.output = path
+            self.thread = threading.Thread(target=self.run, args=(time.monotonic() + seconds, path),
+                                           name="sampling-profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self, timeout=5):
+        # Ends the window early; whatever was sampled so far is still written
+        self.stopping.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def run(self, deadline, path):
+        me = threading.get_ident()
+        stacks = Counter()
+        while not self.stopping.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                root = THREAD_NUMBER.sub("", names.get(ident, "thread"))
+                stacks[";".join([root] + collapse(frame))] += 1
+            # Holding on to the frames would keep their locals alive until the next sample
+            frames = frame = None
+            self.stopping.wait(self.interval)
+        write(path, stacks)
+
+
+def write(path, stacks):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    os.replace(tmp_file, path)
@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+
+
+class RedirectCache:
+    # alias -> (deadline, location, body) for links that redirect the same way every time.
+    # Entries expire after ttl seconds or at the link's own expiry, whichever comes first.
+    # generation changes on every invalidate/clear; a put made from a lookup that started
+    # before one is dropped, as the link may have been deleted or changed in between.
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+    def get(self, alias, now):
+        with self.lock:
+            entry = self.entries.get(alias)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self.entries[alias]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(alias)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, alias, location, body, now, expiry=None, generation=None):
+        if self.max_size <= 0:
+            return
+        deadline = now + self.ttl
+        if expiry is not None:
+            deadline = min(deadline, expiry)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[alias] = (deadline, location, body)
+            self.entries.move_to_end(alias)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, alias):
+        with self.lock:
+            self.entries.pop(alias, None)
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,60 @@
+# Click counts per time bucket, kept inside each alias's analytics as
+# {"minute": {"<bucket epoch>": count}, "hour": {...}, "day": {...}} so it stays plain JSON.
+from datetime import datetime
+
+# name -> (bucket size in seconds, how long buckets are kept; None keeps them all)
+RESOLUTIONS = {
+    "minute": (60, 2 * 86400),
+    "hour": (3600, 90 * 86400),
+    "day": (86400, None),
+}
+
+MAX_POINTS = 5000
+
+
+def new_rollups():
+    return {name: {} for name in RESOLUTIONS}
+
+def add_click(rollups, ts, count=1):
+    for name, (size, retention) in RESOLUTIONS.items():
+        buckets = rollups.setdefault(name, {})
+        key = str(int(ts // size) * size)
+        buckets[key] = buckets.get(key, 0) + count
+        # More buckets than the retention window can hold means some have aged out;
+        # the 10% slack keeps the scan from running on every new bucket
+        if retention and len(buckets) > retention // size * 11 // 10:
+            cutoff = ts - retention
+            for old in [k for k in buckets if int(k) < cutoff]:
+                del buckets[old]
+
+def backfill(analytics):
+    # Older data files only have the raw click list
+    if "rollups" in analytics:
+        return
+    analytics["rollups"] = new_rollups()
+    for click in analytics.get("clicks", []):
+        try:
+            add_click(analytics["rollups"], datetime.fromisoformat(click["timestamp"]).timestamp())
+        except (KeyError, TypeError, ValueError):
+            continue
+
+def pick_resolution(start, end):
+    span = end - start
+    if span <= 6 * 3600:
+        return "minute"
+    if span <= 14 * 86400:
+        return "hour"
+    return "day"
+
+def query(rollups, start, end, resolution=None):
+    resolution = resolution or pick_resolution(start, end)
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    if end < start:
+        raise ValueError("end is before start")
+    size = RESOLUTIONS[resolution][0]
+    first = int(start // size) * size
+    if (end - first) // size + 1 > MAX_POINTS:
+        raise ValueError("Time range too large for this resolution")
+    buckets = rollups.get(resolution, {})
+    return resolution, [(t, buckets.get(str(t), 0)) for t in range(first, int(end) + 1, size)]
@@ -0,0 +1,172 @@
+# Binary snapshot of url_data for fast startup. The file is memory-mapped: link records are
+# decoded up front (they are small and needed for every redirect), while each alias's
+# analytics stays an undecoded JSON blob in the mapping until something reads it.
+#
+# Layout: MAGIC, then one length-prefixed record per link:
+#   RECORD header (record length, created_at, clicks, utm_tracking, tier, 7 field lengths)
+#   alias, url, user_id, expiry_date, password, raw created, analytics JSON
+# A field length of NONE means the field is None. tier is 0 for live links, 1 for expired.
+import json
+import mmap
+import os
+import struct
+from collections import deque
+
+import rollups
+from models import Link, json_default
+
+MAGIC = b"LNKSNAP1"
+RECORD = struct.Struct("<IqQBB7I")
+NONE = 0xFFFFFFFF
+LIVE, EXPIRED = 0, 1
+
+
+def decode_analytics(blob):
+    analytics = json.loads(blob)
+    analytics["clicks"] = deque(analytics.get("clicks", []))
+    rollups.backfill(analytics)
+    return analytics
+
+
+class LazyAnalytics(dict):
+    # url_data["analytics"] backed by a snapshot: alias -> analytics, decoded from the
+    # mapping on first access. Iterating values/items decodes everything that is left.
+
+    def __init__(self, buffer, pending):
+        super().__init__()
+        self.buffer = buffer
+        self.pending = pending
+
+    def load(self, alias):
+        span = self.pending.pop(alias, None)
+        if span is None:
+            return dict.__getitem__(self, alias)
+        analytics = decode_analytics(self.buffer[span[0]:span[0] + span[1]])
+        dict.__setitem__(self, alias, analytics)
+        return analytics
+
+    def raw(self, alias):
+        # Still-encoded analytics, or None once decoded
+        span = self.pending.get(alias)
+        return None if span is None else self.buffer[span[0]:span[0] + span[1]]
+
+    def loaded_items(self):
+        return dict.items(self)
+
+    def __getitem__(self, alias):
+        if alias in self.pending:
+            return self.load(alias)
+        return dict.__getitem__(self, alias)
+
+    def get(self, alias, default=None):
+        if alias in self.pending:
+            return self.load(alias)
+        return dict.get(self, alias, default)
+
+    def setdefault(self, alias, default=None):
+        if alias in self.pending:
+            return self.load(alias)
+        return dict.setdefault(self, alias, default)
+
+    def pop(self, alias, *default):
+        if alias in self.pending:
+            self.load(alias)
+        return dict.pop(self, alias, *default)
+
+    def __setitem__(self, alias, analytics):
+        self.pending.pop(alias, None)
+        dict.__setitem__(self, alias, analytics)
+
+    def __delitem__(self, alias):
+        if self.pending.pop(alias, None) is None:
+            dict.__delitem__(self, alias)
+
+    def __contains__(self, alias):
+        return alias in self.pending or dict.__contains__(self, alias)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.pending)
+
+    def __iter__(self):
+        return iter(list(dict.keys(self)) + list(self.pending))
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+    def load_all(self):
+        for alias in list(self.pending):
+            self.load(alias)
+
+    def clear(self):
+        self.pending.clear()
+        dict.clear(self)
+
+
+def encode_field(value):
+    return None if value is None else str(value).encode()
+
+def write(path, data):
+    # Analytics that were never decoded are copied across as the original bytes
+    analytics = data["analytics"]
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        for tier, links in ((LIVE, data["links"]), (EXPIRED, data.get("expired", {}))):
+            for alias, link in links.items():
+                blob = analytics.raw(alias) if isinstance(analytics, LazyAnalytics) else None
+                if blob is None and alias in analytics:
+                    blob = json.dumps(analytics[alias], separators=(',', ':'), default=json_default).encode()
+                created = link.created_at if isinstance(link.created_at, int) else None
+                fields = [encode_field(alias), encode_field(link.url), encode_field(link.user_id),
+                          encode_field(link.expiry_date), encode_field(link.password),
+                          None if created is not None else encode_field(link.created_at), blob]
+                lengths = [NONE if field is None else len(field) for field in fields]
+                body = b"".join(field for field in fields if field is not None)
+                f.write(RECORD.pack(RECORD.size + len(body), created or 0, link.clicks, link.utm_tracking, tier, *lengths))
+                f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_file, path)
+    return size
+
+def read(path):
+    data = {"links": {}, "expired": {}, "analytics": {}}
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= len(MAGIC):
+            return data
+        # The mapping outlives the file object, and the file being replaced by a later write()
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a link snapshot")
+
+    pending = {}
+    tiers = (data["links"], data["expired"])
+    pos = len(MAGIC)
+    end = len(buffer)
+    while pos < end:
+        length, created, clicks, utm, tier, *lengths = RECORD.unpack_from(buffer, pos)
+        field_pos = pos + RECORD.size
+        fields = []
+        for size in lengths[:6]:
+            if size == NONE:
+                fields.append(None)
+            else:
+                fields.append(buffer[field_pos:field_pos + size].decode())
+                field_pos += size
+        alias, url, user_id, expiry_date, password, raw_created = fields
+        if lengths[6] != NONE:
+            pending[alias] = (field_pos, lengths[6])
+        tiers[tier][alias] = Link(url, raw_created if raw_created is not None else created, clicks,
+                                  user_id, expiry_date, password, bool(utm))
+        pos += length
+    data["analytics"] = LazyAnalytics(buffer, pending)
+    return data
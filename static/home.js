@@ -0,0 +1,132 @@
+// Custom date toggle
+document.getElementById('expiry').addEventListener('change', function() {
+    document.getElementById('customDateGroup').style.display =
+        this.value === 'custom' ? 'block' : 'none';
+});
+
+// Form submission
+document.getElementById('shortenForm').addEventListener('submit', async (e) => {
+    e.preventDefault();
+
+    const url = document.getElementById('url').value;
+    const alias = document.getElementById('alias').value;
+    const expiry = document.getElementById('expiry').value;
+    const customDate = document.getElementById('customDate').value;
+    const password = document.getElementById('password').value;
+    const utmTracking = document.getElementById('utm_tracking').checked;
+
+    const payload = {
+        url,
+        alias: alias || undefined,
+        expiry: expiry === 'custom' ? customDate : expiry,
+        password: password || undefined,
+        utm_tracking: utmTracking
+    };
+
+    try {
+        const response = await fetch('/api/shorten', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(payload)
+        });
+
+        if (response.ok) {
+            const result = await response.json();
+            document.getElementById('shortUrl').textContent =
+                window.location.origin + '/go/' + result.alias;
+            document.getElementById('result').style.display = 'block';
+            setTimeout(() => window.location.reload(), 2000);
+        } else {
+            const error = await response.json();
+            alert('Error: ' + error.error);
+        }
+    } catch (err) {
+        alert('Network error: ' + err.message);
+    }
+});
+
+// Search functionality: queries the server-side index, so it covers every page of links
+let searchTimer = null;
+document.getElementById('searchLinks').addEventListener('input', function(e) {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => searchLinks(e.target.value.trim()), 150);
+});
+
+async function searchLinks(query) {
+    const results = document.getElementById('searchResults');
+    const linkList = document.getElementById('linkList');
+    if (!query) {
+        results.style.display = 'none';
+        linkList.style.display = 'block';
+        return;
+    }
+
+    const response = await fetch('/api/links/search?q=' + encodeURIComponent(query));
+    if (!response.ok || document.getElementById('searchLinks').value.trim() !== query) {
+        return;
+    }
+    const body = await response.json();
+
+    results.replaceChildren(...body.results.map(link => {
+        const item = document.createElement('div');
+        item.className = 'link-item';
+        item.dataset.alias = link.alias;
+
+        const shortUrl = document.createElement('a');
+        shortUrl.className = 'short-url';
+        shortUrl.href = '/analytics/' + encodeURIComponent(link.alias);
+        shortUrl.target = '_blank';
+        shortUrl.textContent = window.location.origin + '/go/' + link.alias;
+
+        const original = document.createElement('div');
+        original.className = 'original-url';
+        original.textContent = link.url;
+
+        const meta = document.createElement('div');
+        meta.className = 'link-meta';
+        meta.textContent = `👆 ${link.clicks} clicks · 📅 Created: ${link.created}`;
+
+        item.append(shortUrl, original, meta);
+        return item;
+    }));
+    if (!body.results.length) {
+        results.textContent = 'No matching links';
+    }
+    results.style.display = 'block';
+    linkList.style.display = 'none';
+}
+
+// Helper functions
+function copyToClipboard() {
+    const text = document.getElementById('shortUrl').textContent;
+    navigator.clipboard.writeText(text);
+    alert('Copied to clipboard!');
+}
+
+function copyLink(alias) {
+    navigator.clipboard.writeText(window.location.origin + '/go/' + alias);
+    alert('Link copied!');
+}
+
+function toggleQR(alias) {
+    const qrDiv = document.getElementById('qr-' + alias);
+    qrDiv.style.display = qrDiv.style.display === 'none' ? 'flex' : 'none';
+}
+
+function downloadQR(alias) {
+    const link = document.createElement('a');
+    link.href = `https://api.qrserver.com/v1/create-qr-code/?size=300x300&data=${window.location.origin}/go/${alias}`;
+    link.download = `qr-${alias}.png`;
+    link.click();
+}
+
+function deleteLink(alias) {
+    if(confirm('Are you sure you want to delete this link?')) {
+        fetch(`/api/delete/${alias}`, { method: 'DELETE' })
+            .then(() => window.location.reload());
+    }
+}
+
+function showAnalytics(alias) {
+    window.open(`/analytics/${alias}`, '_blank');
+}
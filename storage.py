@@ -0,0 +1,573 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+
+import rollups
+import snapshot
+from counters import ShardedCounter
+from models import Link, json_default, links_from_dicts, parse_created
+
+
+class Conflict(Exception):
+    # A create found the key already taken by another process sharing the storage
+    pass
+
+
+def new_analytics():
+    return {
+        "clicks": deque(),
+        "referrers": {},
+        "countries": {},
+        "browsers": {},
+        "rollups": rollups.new_rollups()
+    }
+
+def click_epoch(click):
+    try:
+        return datetime.fromisoformat(click["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def fsync_directory(path):
+    # Makes a rename into the directory holding path durable
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def apply_click(data, alias, click, ts=None):
+    data["links"][alias].clicks += 1
+    if alias in data["analytics"]:
+        analytics = data["analytics"][alias]
+        analytics["clicks"].append(click)
+        ref = click.get("referrer") or "direct"
+        analytics["referrers"][ref] = analytics["referrers"].get(ref, 0) + 1
+        ts = ts if ts is not None else click_epoch(click)
+        if ts is not None:
+            rollups.add_click(analytics.setdefault("rollups", rollups.new_rollups()), ts)
+
+def apply_journal_entry(data, entry):
+    alias = entry["alias"]
+    if entry["op"] == "link":
+        data["links"][alias] = Link.from_dict(entry["link"])
+        data["analytics"].setdefault(alias, new_analytics())
+    elif entry["op"] == "delete":
+        data["links"].pop(alias, None)
+        data["expired"].pop(alias, None)
+        data["analytics"].pop(alias, None)
+    elif entry["op"] == "expire" and alias in data["links"]:
+        data["expired"][alias] = data["links"].pop(alias)
+    elif entry["op"] == "click" and alias in data["links"]:
+        apply_click(data, alias, entry["click"])
+
+
+# --- LEGACY JSON FILES ---
+class JsonStorage:
+    # Every change rewrites the whole data file
+    name = "json"
+    # Only the recent raw clicks are kept; older ones are in the click archive
+    keeps_click_history = False
+    # Every save writes this process's url_data over the files, so it cannot be shared
+    # with other worker processes
+    shared = False
+
+    def __init__(self, data_file, user_file):
+        self.data_file = data_file
+        self.user_file = user_file
+        self.bytes_written = ShardedCounter()
+
+    def load(self):
+        data = self.load_base()
+        self.replay(data)
+        return data
+
+    def load_base(self):
+        data = {"links": {}, "analytics": {}}
+        if os.path.exists(self.data_file):
+            with open(self.data_file, "r") as f:
+                data = json.load(f)
+        # Expired links are kept apart from the live ones (the cold tier)
+        data["links"] = links_from_dicts(data["links"])
+        data["expired"] = links_from_dicts(data.get("expired", {}))
+        return data
+
+    def replay(self, data):
+        # Only the journal modes keep changes outside the data file
+        pass
+
+    def load_users(self):
+        if os.path.exists(self.user_file):
+            with open(self.user_file, "r") as f:
+                return json.load(f)
+        return {}
+
+    def save_snapshot(self, data):
+        with open(self.data_file, "w") as f:
+            json.dump(data, f, indent=4, default=json_default)
+            self.bytes_written.add(f.tell())
+
+    def save_users(self, users):
+        with open(self.user_file, "w") as f:
+            json.dump(users, f, indent=4)
+            self.bytes_written.add(f.tell())
+
+    # put_user, put_link and put_links create new rows: shared storage raises Conflict (or,
+    # for put_links, returns the aliases it did not insert) when another process has them
+    def put_user(self, users, username):
+        self.save_users(users)
+
+    def put_link(self, data, alias):
+        self.save_snapshot(data)
+
+    def put_links(self, data, aliases):
+        self.save_snapshot(data)
+        return []
+
+    def delete_link(self, data, alias):
+        self.save_snapshot(data)
+
+    def add_clicks(self, data, events):
+        self.save_snapshot(data)
+
+    def expire_links(self, data, aliases):
+        self.save_snapshot(data)
+
+    def click_events(self, data, alias):
+        return data["analytics"].get(alias, {}).get("clicks", [])
+
+    def iter_click_events(self, data, alias):
+        return iter(list(self.click_events(data, alias)))
+
+    def get_link(self, alias):
+        # Only shared storage holds rows this process has not loaded
+        return None
+
+    def get_user(self, username):
+        return None
+
+    def files(self):
+        return [self.data_file, self.user_file]
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, data):
+        self.save_snapshot(data)
+
+    def close(self):
+        pass
+
+
+# --- APPEND-ONLY JOURNAL ---
+class JournalStorage(JsonStorage):
+    # Changes are appended to the journal; compact() folds them into the data file
+    name = "journal"
+
+    def __init__(self, data_file, user_file, journal_file, compact_bytes=4 * 1024 * 1024):
+        super().__init__(data_file, user_file)
+        self.journal_file = journal_file
+        self.compact_bytes = compact_bytes
+
+    def replay(self, data):
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append; everything before it is intact
+                        continue
+                    apply_journal_entry(data, entry)
+
+    def append(self, entries):
+        # json.dumps escapes non-ASCII, so the character count is the byte count
+        lines = "".join(json.dumps(e, separators=(',', ':'), default=json_default) + "\n" for e in entries)
+        with open(self.journal_file, "a") as f:
+            f.write(lines)
+        self.bytes_written.add(len(lines))
+
+    def put_link(self, data, alias):
+        self.append([{"op": "link", "alias": alias, "link": data["links"][alias]}])
+
+    def put_links(self, data, aliases):
+        self.append([{"op": "link", "alias": alias, "link": data["links"][alias]} for alias in aliases])
+        return []
+
+    def delete_link(self, data, alias):
+        self.append([{"op": "delete", "alias": alias}])
+
+    def add_clicks(self, data, events):
+        self.append([{"op": "click", "alias": alias, "click": click} for alias, click in events])
+
+    def expire_links(self, data, aliases):
+        self.append([{"op": "expire", "alias": alias} for alias in aliases])
+
+    def journal_size(self):
+        try:
+            return os.path.getsize(self.journal_file)
+        except OSError:
+            return 0
+
+    def needs_compaction(self):
+        return self.journal_size() >= self.compact_bytes
+
+    def compact(self, data):
+        # Caller must stop new appends while the snapshot is taken
+        # The snapshot must be on disk before the journal it replaces is truncated
+        tmp_file = self.data_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f, default=json_default)
+            f.flush()
+            os.fsync(f.fileno())
+            self.bytes_written.add(f.tell())
+        os.replace(tmp_file, self.data_file)
+        fsync_directory(self.data_file)
+        open(self.journal_file, "w").close()
+
+    def files(self):
+        return super().files() + [self.journal_file]
+
+
+# --- BINARY SNAPSHOT ---
+class SnapshotStorage(JournalStorage):
+    # Journal mode over a memory-mapped binary snapshot (see snapshot.py) instead of the
+    # JSON data file, so startup decodes only the link records and leaves analytics for later
+    name = "snapshot"
+
+    def __init__(self, data_file, user_file, journal_file, snapshot_file, compact_bytes=4 * 1024 * 1024):
+        super().__init__(data_file, user_file, journal_file, compact_bytes)
+        self.snapshot_file = snapshot_file
+
+    def load_base(self):
+        if not os.path.exists(self.snapshot_file):
+            # Switching over from json/journal mode: the first compaction writes the snapshot
+            return super().load_base()
+        return snapshot.read(self.snapshot_file)
+
+    def save_snapshot(self, data):
+        self.compact(data)
+
+    def compact(self, data):
+        # Caller must stop new appends while the snapshot is taken
+        self.bytes_written.add(snapshot.write(self.snapshot_file, data))
+        fsync_directory(self.snapshot_file)
+        open(self.journal_file, "w").close()
+
+    def files(self):
+        return super().files() + [self.snapshot_file]
+
+
+# --- SQLITE ---
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    alias TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    created TEXT,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    user_id TEXT,
+    expiry_date TEXT,
+    password TEXT,
+    utm_tracking INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS clicks (
+    id INTEGER PRIMARY KEY,
+    alias TEXT NOT NULL,
+    timestamp TEXT,
+    ip TEXT,
+    user_agent TEXT,
+    referrer TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_clicks_alias ON clicks(alias);
+
+CREATE TABLE IF NOT EXISTS referrers (
+    alias TEXT NOT NULL,
+    referrer TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (alias, referrer)
+);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    alias TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (alias, resolution, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_rollups_resolution_bucket ON rollups(resolution, bucket);
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    email TEXT,
+    password TEXT,
+    created_at TEXT
+);
+"""
+
+SQL_UPSERT_LINK = (
+    "INSERT OR REPLACE INTO links (alias, url, created, clicks, user_id, expiry_date, password, utm_tracking) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+# Creating a link or user must not replace a row another process wrote; only snapshots upsert
+SQL_INSERT_LINK = (
+    "INSERT INTO links (alias, url, created, clicks, user_id, expiry_date, password, utm_tracking) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_INSERT_LINK_IF_NEW = SQL_INSERT_LINK.replace("INSERT INTO", "INSERT OR IGNORE INTO")
+SQL_SELECT_LINKS = "SELECT alias, url, created, clicks, user_id, expiry_date, password, utm_tracking FROM links"
+SQL_DELETE_LINK = "DELETE FROM links WHERE alias = ?"
+SQL_DELETE_CLICKS = "DELETE FROM clicks WHERE alias = ?"
+SQL_DELETE_REFERRERS = "DELETE FROM referrers WHERE alias = ?"
+SQL_INSERT_CLICK = "INSERT INTO clicks (alias, timestamp, ip, user_agent, referrer) VALUES (?, ?, ?, ?, ?)"
+SQL_BUMP_CLICKS = "UPDATE links SET clicks = clicks + ? WHERE alias = ?"
+SQL_BUMP_REFERRER = (
+    "INSERT INTO referrers (alias, referrer, count) VALUES (?, ?, ?) "
+    "ON CONFLICT (alias, referrer) DO UPDATE SET count = count + excluded.count"
+)
+SQL_SELECT_CLICKS = "SELECT timestamp, ip, user_agent, referrer FROM clicks WHERE alias = ? ORDER BY id"
+SQL_SELECT_REFERRERS = "SELECT alias, referrer, count FROM referrers"
+SQL_DELETE_ROLLUPS = "DELETE FROM rollups WHERE alias = ?"
+SQL_BUMP_ROLLUP = (
+    "INSERT INTO rollups (alias, resolution, bucket, count) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (alias, resolution, bucket) DO UPDATE SET count = count + excluded.count"
+)
+SQL_SELECT_ROLLUPS = "SELECT alias, resolution, bucket, count FROM rollups"
+SQL_PRUNE_ROLLUPS = "DELETE FROM rollups WHERE resolution = ? AND bucket < ?"
+SQL_UPSERT_USER = "INSERT OR REPLACE INTO users (username, id, email, password, created_at) VALUES (?, ?, ?, ?, ?)"
+SQL_INSERT_USER = "INSERT INTO users (username, id, email, password, created_at) VALUES (?, ?, ?, ?, ?)"
+SQL_SELECT_USERS = "SELECT username, id, email, password, created_at FROM users"
+SQL_SELECT_LINK = SQL_SELECT_LINKS + " WHERE alias = ?"
+SQL_SELECT_USER = SQL_SELECT_USERS + " WHERE username = ?"
+
+
+def link_row(alias, link):
+    return (alias, link.url, link.created, link.clicks, link.user_id,
+            link.expiry_date, link.password, 1 if link.utm_tracking else 0)
+
+def row_link(row):
+    alias, url, created, clicks, user_id, expiry_date, password, utm_tracking = row
+    return alias, Link(url, parse_created(created), clicks, user_id, expiry_date, password, bool(utm_tracking))
+
+def user_row(username, user):
+    return (username, user["id"], user.get("email"), user.get("password"), user.get("created_at"))
+
+
+class SqliteStorage:
+    # Row-level writes; raw click history stays on disk and is read per alias
+    name = "sqlite"
+    keeps_click_history = True
+    # Row-level writes: several worker processes can share the database, and add_clicks
+    # records clicks on links another worker created
+    shared = True
+    # Page writes are up to SQLite; the file sizes are the closest measure
+    bytes_written = None
+    # Seconds of click time between prunes of rollup buckets past their retention
+    prune_interval = 600
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.local = threading.local()
+        self.pruned_at = 0
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def connection(self):
+        # sqlite3 connections are not shareable across threads, so each thread gets its own.
+        # Nor across fork: a preloaded gunicorn worker must not reuse the master's connection.
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def load(self):
+        return self.load_base()
+
+    def replay(self, data):
+        # Every change is already in the database
+        pass
+
+    def load_base(self):
+        conn = self.connection()
+        # Expired rows stay in the links table; the app moves them to the cold tier after loading
+        data = {"links": {}, "analytics": {}, "expired": {}}
+        for row in conn.execute(SQL_SELECT_LINKS):
+            alias, link = row_link(row)
+            data["links"][alias] = link
+            data["analytics"][alias] = new_analytics()
+        for alias, referrer, count in conn.execute(SQL_SELECT_REFERRERS):
+            if alias in data["analytics"]:
+                data["analytics"][alias]["referrers"][referrer] = count
+        for alias, resolution, bucket, count in conn.execute(SQL_SELECT_ROLLUPS):
+            if alias in data["analytics"]:
+                data["analytics"][alias]["rollups"].setdefault(resolution, {})[str(bucket)] = count
+        return data
+
+    def load_users(self):
+        users = {}
+        for username, user_id, email, password, created_at in self.connection().execute(SQL_SELECT_USERS):
+            users[username] = {'id': user_id, 'email': email, 'password': password, 'created_at': created_at}
+        return users
+
+    def get_link(self, alias):
+        # A link another worker process may have created since this one loaded
+        row = self.connection().execute(SQL_SELECT_LINK, (alias,)).fetchone()
+        return None if row is None else row_link(row)[1]
+
+    def get_user(self, username):
+        row = self.connection().execute(SQL_SELECT_USER, (username,)).fetchone()
+        if row is None:
+            return None
+        _, user_id, email, password, created_at = row
+        return {'id': user_id, 'email': email, 'password': password, 'created_at': created_at}
+
+    def save_snapshot(self, data):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM links")
+            conn.execute("DELETE FROM referrers")
+            conn.execute("DELETE FROM rollups")
+            conn.executemany(SQL_UPSERT_LINK, (link_row(a, l) for a, l in data["links"].items()))
+            conn.executemany(SQL_UPSERT_LINK, (link_row(a, l) for a, l in data.get("expired", {}).items()))
+            conn.executemany(SQL_BUMP_REFERRER, (
+                (alias, ref, count)
+                for alias, analytics in data["analytics"].items()
+                for ref, count in analytics.get("referrers", {}).items()
+            ))
+            conn.executemany(SQL_BUMP_ROLLUP, (
+                (alias, resolution, int(bucket), count)
+                for alias, analytics in data["analytics"].items()
+                for resolution, buckets in analytics.get("rollups", {}).items()
+                for bucket, count in buckets.items()
+            ))
+
+    def save_users(self, users):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany(SQL_UPSERT_USER, (user_row(u, d) for u, d in users.items()))
+
+    def put_user(self, users, username):
+        try:
+            with self.connection() as conn:
+                conn.execute(SQL_INSERT_USER, user_row(username, users[username]))
+        except sqlite3.IntegrityError:
+            raise Conflict(username)
+
+    def put_link(self, data, alias):
+        try:
+            with self.connection() as conn:
+                conn.execute(SQL_INSERT_LINK, link_row(alias, data["links"][alias]))
+        except sqlite3.IntegrityError:
+            raise Conflict(alias)
+
+    def put_links(self, data, aliases):
+        rejected = []
+        with self.connection() as conn:
+            for alias in aliases:
+                if conn.execute(SQL_INSERT_LINK_IF_NEW, link_row(alias, data["links"][alias])).rowcount == 0:
+                    rejected.append(alias)
+        return rejected
+
+    def delete_link(self, data, alias):
+        with self.connection() as conn:
+            conn.execute(SQL_DELETE_LINK, (alias,))
+            conn.execute(SQL_DELETE_CLICKS, (alias,))
+            conn.execute(SQL_DELETE_REFERRERS, (alias,))
+            conn.execute(SQL_DELETE_ROLLUPS, (alias,))
+
+    def add_clicks(self, data, events):
+        per_alias = {}
+        per_referrer = {}
+        per_bucket = {}
+        latest = 0
+        for alias, click in events:
+            per_alias[alias] = per_alias.get(alias, 0) + 1
+            key = (alias, click.get("referrer") or "direct")
+            per_referrer[key] = per_referrer.get(key, 0) + 1
+            ts = click_epoch(click)
+            if ts is not None:
+                latest = max(latest, ts)
+                for resolution, (size, _) in rollups.RESOLUTIONS.items():
+                    key = (alias, resolution, int(ts // size) * size)
+                    per_bucket[key] = per_bucket.get(key, 0) + 1
+        with self.connection() as conn:
+            conn.executemany(SQL_INSERT_CLICK, (
+                (alias, c.get("timestamp"), c.get("ip"), c.get("user_agent"), c.get("referrer"))
+                for alias, c in events
+            ))
+            conn.executemany(SQL_BUMP_CLICKS, ((n, alias) for alias, n in per_alias.items()))
+            conn.executemany(SQL_BUMP_REFERRER, ((a, r, n) for (a, r), n in per_referrer.items()))
+            conn.executemany(SQL_BUMP_ROLLUP, ((a, r, b, n) for (a, r, b), n in per_bucket.items()))
+            if latest - self.pruned_at >= self.prune_interval:
+                # The same retention rollups.add_click applies to the JSON analytics
+                conn.executemany(SQL_PRUNE_ROLLUPS, (
+                    (resolution, latest - retention)
+                    for resolution, (_, retention) in rollups.RESOLUTIONS.items() if retention
+                ))
+                self.pruned_at = latest
+
+    def expire_links(self, data, aliases):
+        pass
+
+    def click_events(self, data, alias):
+        return [
+            {"timestamp": ts, "ip": ip, "user_agent": ua, "referrer": ref}
+            for ts, ip, ua, ref in self.connection().execute(SQL_SELECT_CLICKS, (alias,))
+        ]
+
+    def iter_click_events(self, data, alias):
+        # Streams from the cursor instead of building the list
+        for ts, ip, ua, ref in self.connection().execute(SQL_SELECT_CLICKS, (alias,)):
+            yield {"timestamp": ts, "ip": ip, "user_agent": ua, "referrer": ref}
+
+    def files(self):
+        return [self.db_file, self.db_file + "-wal"]
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, data):
+        pass
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+def migrate_json_to_sqlite(data_file, user_file, db_file):
+    # One-shot copy of the legacy JSON files, raw click history included
+    source = JsonStorage(data_file, user_file)
+    data = source.load()
+    users = source.load_users()
+    # Older data files only have the raw clicks; without rollups their history would not chart
+    for analytics in data["analytics"].values():
+        rollups.backfill(analytics)
+    target = SqliteStorage(db_file)
+    target.save_snapshot(data)
+    target.save_users(users)
+    with target.connection() as conn:
+        for alias, analytics in data["analytics"].items():
+            conn.executemany(SQL_INSERT_CLICK, (
+                (alias, c.get("timestamp"), c.get("ip"), c.get("user_agent"), c.get("referrer"))
+                for c in analytics.get("clicks", [])
+            ))
+    target.close()
+    return len(data["links"]), len(users)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 5 or sys.argv[1] != "migrate":
+        print("usage: python storage.py migrate <urls.json> <users.json> <urls.db>")
+        sys.exit(2)
+    links, users = migrate_json_to_sqlite(sys.argv[2], sys.argv[3], sys.argv[4])
+    print(f"Migrated {links} links and {users} users to {sys.argv[4]}")
@@ -3,6 +3,7 @@ import os
 import json
 import tempfile
 from app import app, url_data, users, hash_password
+from models import Link
 
 class TestURLShortener(unittest.TestCase):
     def setUp(self):
@@ -19,6 +20,13 @@ class TestURLShortener(unittest.TestCase):
         import app as app_module
         app_module.DATA_FILE = self.data_file.name
         app_module.USER_FILE = self.user_file.name
+        self.original_storage = app_module.storage
+        app_module.storage = app_module.open_storage()
+        # Keep archived clicks and delete tombstones out of the working directory
+        from archive import ClickArchive
+        self.archive_dir = tempfile.mkdtemp()
+        self.original_click_archive = app_module.click_archive
+        app_module.click_archive = ClickArchive(self.archive_dir)
         
         self.client = app.test_client()
         
@@ -38,7 +46,7 @@ class TestURLShortener(unittest.TestCase):
         from app import save_users
         save_users()
         
-        url_data["links"]["ci"] = {
+        url_data["links"]["ci"] = Link.from_dict({
             "url": "https://github.com/NabilFahmi16/c270_T3/actions",
             "created": "2024-01-01 00:00:00",
             "clicks": 0,
@@ -46,8 +54,8 @@ class TestURLShortener(unittest.TestCase):
             "expiry_date": None,
             "password": None,
             "utm_tracking": False
-        }
-        url_data["links"]["repo"] = {
+        })
+        url_data["links"]["repo"] = Link.from_dict({
             "url": "https://github.com/NabilFahmi16/c270_T3",
             "created": "2024-01-01 00:00:00",
             "clicks": 0,
@@ -55,7 +63,7 @@ class TestURLShortener(unittest.TestCase):
             "expiry_date": None,
             "password": None,
             "utm_tracking": False
-        }
+        })
         
         url_data["analytics"]["ci"] = {
             "clicks": [],
@@ -72,11 +80,14 @@ class TestURLShortener(unittest.TestCase):
         
         from app import save_data
         save_data()
+        app_module.rebuild_indexes()
         with self.client.session_transaction() as sess:
             sess['user_id'] = self.test_user_id
             sess['username'] = "testuser"
     
     def tearDown(self):
+        import app as app_module
+        app_module.click_writer.flush()
         self.data_file.close()
         self.user_file.close()
         
@@ -89,6 +100,10 @@ class TestURLShortener(unittest.TestCase):
         import app as app_module
         app_module.DATA_FILE = self.original_data_file
         app_module.USER_FILE = self.original_user_file
+        app_module.storage = self.original_storage
+        app_module.click_archive = self.original_click_archive
+        import shutil
+        shutil.rmtree(self.archive_dir, ignore_errors=True)
     
     def test_health_endpoint(self):
         resp = self.client.get('/health')
@@ -102,6 +117,211 @@ class TestURLShortener(unittest.TestCase):
 
    
     
+    def test_liveness_and_readiness_probes(self):
+        import time
+        import app as app_module
+        from clicks import ClickWriter
+        self.assertEqual(self.client.get('/health/live').status_code, 200)
+        resp = self.client.get('/health/ready')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()["checks"], {
+            "loaded": True, "accepting_clicks": True, "click_backlog": True, "write_age": True
+        })
+
+        # A click queued on an idle instance, whose last write was long ago
+        from unittest import mock
+        original_writer = app_module.click_writer
+        original_backlog = app_module.READY_MAX_CLICK_BACKLOG
+        stalled = ClickWriter(app_module.write_clicks)
+        stalled.thread = "not started"
+        long_ago = time.time() - app_module.READY_MAX_WRITE_AGE - 1
+        stalled.last_write = long_ago
+        stalled.submit(("ci", time.time(), None, "", None))
+        app_module.click_writer = stalled
+        try:
+            resp = self.client.get('/health/ready')
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(resp.get_json()["oldest_pending_age_seconds"], 1)
+
+            # Clicks that have waited longer than the threshold
+            stalled.drain()
+            with mock.patch('clicks.time.time', return_value=long_ago):
+                for i in range(3):
+                    stalled.submit(("ci", time.time(), None, "", None))
+            resp = self.client.get('/health/ready')
+            self.assertEqual(resp.status_code, 503)
+            body = resp.get_json()
+            self.assertEqual(body["status"], "unavailable")
+            self.assertFalse(body["checks"]["write_age"])
+            self.assertTrue(body["checks"]["click_backlog"])
+            self.assertEqual(body["pending_clicks"], 3)
+
+            stalled.last_write = time.time()
+            app_module.READY_MAX_CLICK_BACKLOG = 2
+            self.assertFalse(self.client.get('/health/ready').get_json()["checks"]["click_backlog"])
+            self.assertEqual(self.client.get('/health/live').status_code, 200)
+        finally:
+            app_module.READY_MAX_CLICK_BACKLOG = original_backlog
+            app_module.click_writer = original_writer
+
+        app_module.startup_complete = False
+        try:
+            self.assertEqual(self.client.get('/health/ready').status_code, 503)
+        finally:
+            app_module.startup_complete = True
+
+    def test_slow_requests_are_logged_with_phase_breakdown(self):
+        import app as app_module
+        original = app_module.SLOW_REQUEST_MS
+        app_module.SLOW_REQUEST_MS = 0.000001
+        try:
+            with self.assertLogs("slow_requests", "WARNING") as logs:
+                self.client.get('/go/ci')
+                self.client.post('/api/shorten', json={"alias": "slow", "url": "https://rp.edu.sg"})
+        finally:
+            app_module.SLOW_REQUEST_MS = original
+        redirect, shorten = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual((redirect["route"], redirect["status"], redirect["path"]), ("go", 302, "/go/ci"))
+        self.assertEqual(set(redirect["phases_ms"]), {"dispatch", "lookup", "analytics", "render"})
+        self.assertGreater(redirect["response_bytes"], 0)
+        self.assertEqual(set(shorten["phases_ms"]), {"dispatch", "lookup", "persistence", "render"})
+        self.assertGreater(shorten["request_bytes"], 0)
+        self.assertAlmostEqual(sum(shorten["phases_ms"].values()), shorten["duration_ms"], delta=1)
+
+        with self.assertNoLogs("slow_requests", "WARNING"):
+            self.client.get('/go/ci')
+
+    def test_sampling_profiler_writes_collapsed_stacks(self):
+        import threading
+        import time
+        import app as app_module
+        from profiler import SamplingProfiler
+
+        def busy_loop(stop):
+            while not stop.is_set():
+                sum(range(1000))
+
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop,), name="Thread-7 (busy)")
+        worker.start()
+        path = os.path.join(tempfile.mkdtemp(), "out", "profile.collapsed")
+        profiler = SamplingProfiler(interval=0.001)
+        try:
+            self.assertTrue(profiler.start(5, path))
+            self.assertFalse(profiler.start(5, path))
+            time.sleep(0.1)
+            profiler.stop()
+        finally:
+            stop.set()
+            worker.join()
+        with open(path) as f:
+            lines = f.read().splitlines()
+        busy = [line for line in lines if line.startswith("Thread (busy);")]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(" ", 1)
+        self.assertIn("busy_loop (test_app.py:", stack)
+        self.assertGreater(int(count), 0)
+
+        # The admin endpoint only exists with a token configured
+        self.assertEqual(self.client.post('/admin/profile').status_code, 404)
+        app_module.ADMIN_TOKEN = "secret"
+        original_dir = app_module.PROFILE_DIR
+        app_module.PROFILE_DIR = os.path.dirname(path)
+        try:
+            self.assertEqual(self.client.post('/admin/profile', headers={"X-Admin-Token": "wrong"}).status_code, 403)
+            resp = self.client.post('/admin/profile?seconds=5', headers={"X-Admin-Token": "secret"})
+            self.assertEqual(resp.status_code, 202)
+            self.assertEqual(self.client.post('/admin/profile', headers={"X-Admin-Token": "secret"}).status_code, 409)
+            app_module.profiler.stop()
+            self.assertTrue(os.path.exists(resp.get_json()["file"]))
+        finally:
+            app_module.ADMIN_TOKEN = ""
+            app_module.PROFILE_DIR = original_dir
+
+    def test_app_factory_starts_worker_threads_once_per_process(self):
+        from unittest import mock
+        import app as app_module
+        original = (app_module.worker_pid, app_module.alias_allocator, app_module.user_id_allocator)
+        # The real threads and SIGTERM handler would outlive the test
+        starters = {}
+        for name in ('install_sigterm_flush', 'start_compactor', 'start_reaper', 'start_alias_index_publisher'):
+            patcher = mock.patch.object(app_module, name)
+            starters[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+        try:
+            app_module.worker_pid = None
+            self.assertIs(app_module.create_app(start=False), app)
+            self.assertIsNone(app_module.worker_pid)
+            starters['install_sigterm_flush'].assert_not_called()
+
+            self.assertIs(app_module.create_app(), app)
+            self.assertEqual(app_module.worker_pid, os.getpid())
+            self.assertTrue(app_module.click_writer.thread.is_alive())
+            app_module.create_app()
+            starters['install_sigterm_flush'].assert_called_once()
+            self.assertEqual(starters['start_reaper'].call_count, 1 if app_module.REAPER_INTERVAL > 0 else 0)
+
+            # gunicorn's hooks drive the same setup in each worker after fork
+            config = {}
+            with open(os.path.join(os.path.dirname(app_module.__file__), "gunicorn.conf.py")) as f:
+                exec(f.read(), config)
+            self.assertTrue(config["preload_app"])
+            self.assertEqual(config["wsgi_app"], "app:create_app(start=False)")
+            app_module.worker_pid = -1  # as inherited from the master
+            config["post_fork"](None, None)
+            self.assertEqual(app_module.worker_pid, os.getpid())
+            self.assertEqual(starters['install_sigterm_flush'].call_count, 2)
+        finally:
+            app_module.worker_pid, app_module.alias_allocator, app_module.user_id_allocator = original
+
+    def test_metrics_endpoint_reports_routes_storage_and_counts(self):
+        import app as app_module
+
+        def scrape():
+            resp = self.client.get('/metrics')
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith('text/plain; version=0.0.4'))
+            samples = {}
+            for line in resp.get_data(as_text=True).splitlines():
+                if line and not line.startswith('#'):
+                    name, value = line.rsplit(' ', 1)
+                    samples[name] = float(value)
+            return samples
+
+        before = scrape()
+        self.client.get('/go/ci')
+        self.client.get('/go/missing')
+        self.client.post('/api/shorten', json={"alias": "new", "url": "https://rp.edu.sg"})
+        app_module.click_writer.flush()
+        app_module.save_data()
+        after = scrape()
+
+        def delta(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        self.assertEqual(delta('shortener_http_requests_total{route="go",method="GET",status="302"}'), 1)
+        self.assertEqual(delta('shortener_http_requests_total{route="go",method="GET",status="404"}'), 1)
+        self.assertEqual(delta('shortener_http_requests_total{route="api_shorten",method="POST",status="201"}'), 1)
+        self.assertEqual(delta('shortener_http_request_duration_seconds_count{route="go"}'), 2)
+        self.assertEqual(delta('shortener_http_request_duration_seconds_bucket{route="go",le="+Inf"}'), 2)
+        self.assertEqual(delta('shortener_storage_write_seconds_count{op="save"}'), 1)
+        self.assertEqual(delta('shortener_storage_write_seconds_count{op="clicks"}'), 1)
+        self.assertEqual(delta('shortener_storage_write_seconds_count{op="put_link"}'), 1)
+        self.assertGreater(delta('shortener_storage_bytes_written_total'), 0)
+        data_file = os.path.basename(self.data_file.name)
+        self.assertEqual(after[f'shortener_storage_file_bytes{{file="{data_file}"}}'], os.path.getsize(self.data_file.name))
+        self.assertEqual(after['shortener_links{tier="live"}'], 3)
+        self.assertEqual(after['shortener_link_clicks'], 1)
+        self.assertEqual(after['shortener_users'], 1)
+        self.assertIn('shortener_startup_seconds{phase="load"}', after)
+
+        # Non-standard methods share one label value
+        self.client.open('/go/ci', method='BREW')
+        self.client.open('/go/ci', method='PROPFIND')
+        labels = [name for name in scrape() if name.startswith('shortener_http_requests_total')]
+        self.assertFalse(any('BREW' in name or 'PROPFIND' in name for name in labels))
+        self.assertIn('shortener_http_requests_total{route="unmatched",method="other",status="405"}', labels)
+
     def test_home_page_unauthenticated(self):
         with self.client.session_transaction() as sess:
             sess.clear()
@@ -185,6 +405,8 @@ class TestURLShortener(unittest.TestCase):
         self.assertEqual(resp.status_code, 302)
         self.assertIn('rp.edu.sg', resp.location)
         
+        import app as app_module
+        app_module.click_writer.flush()
         self.assertEqual(url_data["links"]["testredirect"]["clicks"], 1)
     
     def test_redirect_not_found(self):
@@ -235,5 +457,984 @@ class TestURLShortener(unittest.TestCase):
         alias2 = generate_random_alias(8)
         self.assertEqual(len(alias2), 8)
 
+    def use_storage(self, backend):
+        import app as app_module
+        app_module.storage = backend
+        self.addCleanup(backend.close)
+        return backend
+
+    def temp_path(self, suffix):
+        f = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        f.close()
+        self.addCleanup(lambda: [os.unlink(p) for p in (f.name, f.name + '-wal', f.name + '-shm') if os.path.exists(p)])
+        return f.name
+
+    def test_journal_mode_appends_and_replays(self):
+        from storage import JournalStorage
+        journal = self.temp_path('.journal')
+        backend = self.use_storage(JournalStorage(self.data_file.name, self.user_file.name, journal))
+        snapshot_size = os.path.getsize(self.data_file.name)
+        self.client.post('/api/shorten', json={"alias": "jrnl", "url": "https://rp.edu.sg"})
+        self.client.get('/go/jrnl', follow_redirects=False)
+        self.client.get('/go/jrnl', follow_redirects=False)
+        import app as app_module
+        app_module.click_writer.flush()
+        self.client.delete('/api/delete/repo')
+
+        # The snapshot is untouched; every change went to the journal
+        self.assertEqual(os.path.getsize(self.data_file.name), snapshot_size)
+        with open(journal) as f:
+            ops = [json.loads(line)["op"] for line in f]
+        self.assertEqual(ops, ["link", "click", "click", "delete"])
+
+        replayed = backend.load()
+        self.assertEqual(replayed["links"]["jrnl"]["clicks"], 2)
+        self.assertEqual(len(replayed["analytics"]["jrnl"]["clicks"]), 2)
+        self.assertNotIn("repo", replayed["links"])
+
+        import app as app_module
+        app_module.compact_storage()
+        self.assertEqual(os.path.getsize(journal), 0)
+        self.assertEqual(backend.load()["links"]["jrnl"]["clicks"], 2)
+
+    def test_snapshot_mode_loads_links_eagerly_and_analytics_lazily(self):
+        import app as app_module
+        from snapshot import LazyAnalytics
+        from storage import SnapshotStorage
+        journal = self.temp_path('.journal')
+        snap = self.temp_path('.snap')
+        os.unlink(snap)
+        backend = self.use_storage(SnapshotStorage(self.data_file.name, self.user_file.name, journal, snap))
+
+        # No snapshot yet: starts from the JSON data file, then compaction writes the snapshot
+        url_data.update(backend.load())
+        url_data["links"]["repo"].created_at = "sometime"
+        self.client.post('/api/shorten', json={"alias": "snap", "url": "https://rp.edu.sg", "password": "pw",
+                                               "expiry": "2099-01-01T00:00:00"})
+        self.client.get('/go/ci', headers={'Referer': 'https://ref.example'})
+        app_module.click_writer.flush()
+        app_module.compact_storage()
+        self.assertTrue(os.path.exists(snap))
+        self.assertEqual(os.path.getsize(journal), 0)
+
+        loaded = backend.load()
+        self.assertEqual(loaded["links"], url_data["links"])
+        self.assertEqual(loaded["links"]["repo"].created, "sometime")
+        analytics = loaded["analytics"]
+        self.assertIsInstance(analytics, LazyAnalytics)
+        self.assertEqual(len(analytics), 3)
+        self.assertEqual(dict.__len__(analytics), 0)
+        self.assertEqual(analytics["ci"]["referrers"], {"https://ref.example": 1})
+        self.assertEqual(list(analytics["ci"]["clicks"])[0]["referrer"], "https://ref.example")
+        self.assertEqual(dict.__len__(analytics), 1)
+
+        # Undecoded analytics are copied byte for byte by the next compaction
+        url_data.clear()
+        url_data.update(loaded)
+        self.client.post('/api/shorten', json={"alias": "after", "url": "https://rp.edu.sg/after"})
+        app_module.compact_storage()
+        self.assertEqual(sorted(analytics.pending), ["repo", "snap"])
+        reloaded = backend.load()
+        self.assertEqual(sorted(reloaded["links"]), ["after", "ci", "repo", "snap"])
+        self.assertEqual(reloaded["analytics"]["snap"]["rollups"], {"minute": {}, "hour": {}, "day": {}})
+        self.assertEqual(reloaded["analytics"]["ci"]["referrers"], {"https://ref.example": 1})
+
+    def test_journal_replay_skips_torn_line(self):
+        from storage import JournalStorage
+        journal = self.temp_path('.journal')
+        with open(journal, 'w') as f:
+            f.write(json.dumps({"op": "click", "alias": "ci", "click": {"referrer": None}}) + "\n")
+            f.write('{"op": "click", "ali')
+        backend = JournalStorage(self.data_file.name, self.user_file.name, journal)
+        self.assertEqual(backend.load()["links"]["ci"]["clicks"], 1)
+
+    def test_sqlite_storage_row_writes(self):
+        from storage import SqliteStorage
+        db = self.temp_path('.db')
+        self.use_storage(SqliteStorage(db))
+        self.client.post('/api/shorten', json={"alias": "sql", "url": "https://rp.edu.sg"})
+        self.client.get('/go/sql', follow_redirects=False, headers={'Referer': 'https://news.example'})
+        self.client.get('/go/sql', follow_redirects=False)
+        import app as app_module
+        app_module.click_writer.flush()
+        self.client.post('/api/shorten', json={"alias": "gone", "url": "https://example.com"})
+        self.client.delete('/api/delete/gone')
+
+        reloaded = SqliteStorage(db)
+        self.addCleanup(reloaded.close)
+        data = reloaded.load()
+        self.assertEqual(set(data["links"]), {"sql"})
+        self.assertEqual(data["links"]["sql"]["clicks"], 2)
+        self.assertEqual(data["analytics"]["sql"]["referrers"], {"https://news.example": 1, "direct": 1})
+        self.assertEqual(len(reloaded.click_events(data, "sql")), 2)
+
+        resp = self.client.get('/analytics/sql')
+        self.assertIn(b'Total Clicks: 2', resp.data)
+
+    def test_sqlite_records_clicks_on_links_from_other_workers(self):
+        import app as app_module
+        from alias_index import SharedAliasIndex, publish
+        from storage import SqliteStorage
+        db = self.temp_path('.db')
+        self.use_storage(SqliteStorage(db))
+        self.client.post('/api/shorten', json={"alias": "remote", "url": "https://rp.edu.sg"})
+        # As seen from a worker that forked before the link was created
+        del url_data["links"]["remote"]
+        path = self.temp_path('.idx')
+        self.addCleanup(lambda: [os.unlink(p) for p in (path + '.lock', path + '.delta') if os.path.exists(p)])
+        os.unlink(path)
+        publish(path, {}, {"remote": ("https://rp.edu.sg", 0, None)})
+        self.addCleanup(setattr, app_module, 'shared_index', app_module.shared_index)
+        app_module.shared_index = SharedAliasIndex(path, 0, app_module.invalidate_redirects)
+
+        batch = [("remote", 1700000000, "1.2.3.4", "ua", ""), ("nowhere", 1700000000, "1.2.3.4", "ua", "")]
+        self.assertEqual(app_module.write_clicks(batch), 1)
+        reloaded = SqliteStorage(db)
+        self.addCleanup(reloaded.close)
+        self.assertEqual(reloaded.load()["links"]["remote"]["clicks"], 1)
+
+    def test_links_and_users_from_other_workers_are_not_taken_over(self):
+        import app as app_module
+        from alias_index import SharedAliasIndex, publish
+        from models import FLAG_PASSWORD
+        from storage import SqliteStorage
+        db = self.temp_path('.db')
+        self.use_storage(SqliteStorage(db))
+        path = self.temp_path('.idx')
+        self.addCleanup(lambda: [os.unlink(p) for p in (path + '.lock', path + '.delta') if os.path.exists(p)])
+        os.unlink(path)
+        for name, value in (('shared_index', SharedAliasIndex(path, 0)), ('unpublished_aliases', {})):
+            self.addCleanup(setattr, app_module, name, getattr(app_module, name))
+            setattr(app_module, name, value)
+
+        # Written by another worker process after this one loaded
+        other = SqliteStorage(db)
+        self.addCleanup(other.close)
+        secret = Link("https://alice.example", 0, user_id="alice", password="pw")
+        other.put_link({"links": {"secret": secret}}, "secret")
+        other.put_user({"alice": {"id": "alice", "password": hash_password("alicepw")}}, "alice")
+        publish(path, {}, {"secret": ("https://alice.example", FLAG_PASSWORD, None)})
+
+        resp = self.client.post('/api/shorten', json={"alias": "secret", "url": "https://bob.example"})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(self.client.get('/go/secret?password=pw').status_code, 302)
+        self.assertEqual(self.client.get('/go/secret?password=wrong').status_code, 403)
+
+        resp = self.client.post('/register', data={"username": "alice", "email": "b@example.com", "password": "x"})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post('/login', data={"username": "alice", "password": "alicepw"})
+        self.assertEqual(resp.status_code, 302)
+
+    def test_sqlite_rejects_links_and_users_created_by_other_workers(self):
+        import app as app_module
+        from storage import Conflict, SqliteStorage
+        db = self.temp_path('.db')
+        backend = self.use_storage(SqliteStorage(db))
+        # Created by another worker process and not yet published to any alias index
+        other = SqliteStorage(db)
+        self.addCleanup(other.close)
+        other.put_link({"links": {"taken": Link("https://alice.example", 0, user_id="alice")}}, "taken")
+
+        resp = self.client.post('/api/shorten', json={"alias": "taken", "url": "https://bob.example"})
+        self.assertEqual(resp.status_code, 409)
+        self.assertNotIn("taken", url_data["links"])
+        self.assertNotIn("taken", app_module.user_link_index.aliases(self.test_user_id))
+        self.assertEqual(other.get_link("taken").url, "https://alice.example")
+
+        items = [{"alias": "taken", "url": "https://bob.example"}, {"alias": "free", "url": "https://bob.example"}]
+        resp = self.client.post('/api/shorten/bulk', json=items)
+        self.assertEqual(resp.status_code, 207)
+        statuses = [json.loads(line)["status"] for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(statuses, [409, 201])
+        self.assertEqual(other.get_link("taken").user_id, "alice")
+        self.assertEqual(other.get_link("free").user_id, self.test_user_id)
+
+        other.put_user({"carol": {"id": "carol"}}, "carol")
+        with self.assertRaises(Conflict):
+            backend.put_user({"carol": {"id": "mallory"}}, "carol")
+        self.assertEqual(other.get_user("carol")["id"], "carol")
+
+    def test_click_writer_batches_and_drops_on_overflow(self):
+        from clicks import ClickWriter
+        batches = []
+        writer = ClickWriter(batches.append, max_queue=3, batch_size=2, policy='drop')
+        writer.thread = "not started"  # keep everything queued for the assertions below
+        accepted = [writer.submit(("ci", i, None, "", None)) for i in range(5)]
+        self.assertEqual(accepted, [True, True, True, False, False])
+        self.assertEqual(writer.dropped, 2)
+
+        writer.thread = None
+        writer.drain()
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.assertEqual(writer.written, 3)
+
+        sync_writer = ClickWriter(batches.append, max_queue=1, policy='sync')
+        sync_writer.thread = "not started"
+        sync_writer.submit(("ci", 0, None, "", None))
+        self.assertTrue(sync_writer.submit(("ci", 1, None, "", None)))
+        self.assertEqual(batches[-1], [("ci", 1, None, "", None)])
+
+    def test_concurrent_redirects_count_every_click(self):
+        import threading
+        import app as app_module
+        threads, per_thread = 16, 40
+        errors = []
+
+        def hammer(n):
+            client = app.test_client()
+            for i in range(per_thread):
+                alias = ("ci", "repo")[(n + i) % 2]
+                resp = client.get(f'/go/{alias}', headers={'Referer': f'https://ref{n % 4}.example'})
+                if resp.status_code != 302:
+                    errors.append(resp.status_code)
+                if i % 10 == 0:
+                    app_module.save_data()
+
+        workers = [threading.Thread(target=hammer, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        app_module.click_writer.flush()
+
+        self.assertEqual(errors, [])
+        total = threads * per_thread
+        self.assertEqual(url_data["links"]["ci"].clicks + url_data["links"]["repo"].clicks, total)
+        self.assertEqual(url_data["links"]["ci"].clicks, total // 2)
+        for alias in ("ci", "repo"):
+            analytics = url_data["analytics"][alias]
+            self.assertEqual(sum(analytics["referrers"].values()), total // 2)
+            self.assertEqual(sum(analytics["rollups"]["day"].values()), total // 2)
+        self.assertEqual(self.client.get('/api/stats').get_json()["total_clicks"], total)
+        self.assertEqual(app_module.click_writer.dropped, 0)
+
+        app_module.save_data()
+        reloaded = app_module.open_storage().load()
+        self.assertEqual(reloaded["links"]["ci"].clicks, total // 2)
+
+    def test_sharded_counter_sums_across_threads(self):
+        import threading
+        from counters import ShardedCounter
+        counter = ShardedCounter()
+        workers = [threading.Thread(target=lambda: [counter.add() for _ in range(1000)]) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        counter.add(5)
+        self.assertEqual(counter.value, 8005)
+        self.assertEqual(len(counter.shards), 1)
+
+    def test_user_link_index_tracks_shorten_and_delete(self):
+        import app as app_module
+        url_data["links"]["other"] = Link.from_dict(dict(url_data["links"]["ci"].to_dict(), user_id="someoneelse"))
+        app_module.rebuild_indexes()
+        self.assertEqual(app_module.user_link_index.aliases(self.test_user_id), ["ci", "repo"])
+
+        self.client.post('/api/shorten', json={"alias": "mine", "url": "https://rp.edu.sg"})
+        self.client.delete('/api/delete/repo')
+        self.assertEqual(list(app_module.links_for_user(self.test_user_id)), ["ci", "mine"])
+        self.assertEqual(list(app_module.links_for_user("someoneelse")), ["other"])
+
+        resp = self.client.get('/')
+        self.assertIn(b'Your Links (2)', resp.data)
+        self.assertNotIn(b'data-alias="other"', resp.data)
+
+    def test_api_stats_tracks_shorten_click_delete(self):
+        import app as app_module
+        self.client.post('/api/shorten', json={"alias": "soon", "url": "https://rp.edu.sg", "expiry": "1day"})
+        self.client.get('/go/soon', follow_redirects=False)
+        self.client.get('/go/ci', follow_redirects=False)
+        app_module.click_writer.flush()
+
+        resp = self.client.get('/api/stats')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json(), {
+            "total_links": 3, "total_clicks": 2, "active_links": 3, "expiring_soon": 1
+        })
+
+        self.client.delete('/api/delete/soon')
+        self.assertEqual(self.client.get('/api/stats').get_json(), {
+            "total_links": 2, "total_clicks": 1, "active_links": 2, "expiring_soon": 0
+        })
+
+    def test_api_links_cursor_pagination_sort_and_filter(self):
+        for i in range(5):
+            self.client.post('/api/shorten', json={"alias": f"p{i}", "url": f"https://rp.edu.sg/{i}",
+                                                   "password": "pw" if i % 2 else None})
+            url_data["links"][f"p{i}"].clicks = i
+
+        seen, cursor = [], None
+        while True:
+            args = {"sort": "clicks", "order": "desc", "limit": 2, **({"cursor": cursor} if cursor else {})}
+            body = self.client.get('/api/links', query_string=args).get_json()
+            self.assertLessEqual(len(body["links"]), 2)
+            seen += [link["alias"] for link in body["links"]]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        # Ties on the sort key are broken by alias
+        self.assertEqual(seen, ["p4", "p3", "p2", "p1", "repo", "p0", "ci"])
+
+        protected = self.client.get('/api/links?password=true&sort=alias&order=asc').get_json()
+        self.assertEqual([link["alias"] for link in protected["links"]], ["p1", "p3"])
+        self.assertTrue(protected["links"][0]["password_protected"])
+        self.assertNotIn("password", protected["links"][0])
+
+        self.assertEqual(self.client.get('/api/links?sort=bogus').status_code, 400)
+        alias_cursor = self.client.get('/api/links?sort=alias&limit=1').get_json()["next_cursor"]
+        self.assertEqual(self.client.get('/api/links', query_string={"cursor": alias_cursor}).status_code, 400)
+        self.assertEqual(self.client.get('/api/links?cursor=garbage').status_code, 400)
+
+    def test_dashboard_is_paginated_and_streamed(self):
+        for i in range(3):
+            self.client.post('/api/shorten', json={"alias": f"p{i}", "url": f"https://rp.edu.sg/{i}"})
+            url_data["links"][f"p{i}"].created_at = 1800000000 + i
+
+        response = self.client.get('/?limit=2&sort=created')
+        self.assertTrue(response.is_streamed)
+        page = response.get_data(as_text=True)
+        self.assertIn('Your Links (5)', page)
+        self.assertEqual(page.count('class="link-item"'), 2)
+        self.assertIn('data-alias="p2"', page)
+        self.assertIn('data-alias="p1"', page)
+        self.assertNotIn('data-alias="p0"', page)
+        self.assertIn('Next page', page)
+        self.assertNotIn('First page', page)
+
+    def test_link_search_by_alias_prefix_and_url(self):
+        url_data["links"]["other"] = Link("https://github.com/elsewhere", 0, user_id="someoneelse")
+        # First search loads the index; later shortens/deletes must keep it current
+        self.client.get('/api/links/search?q=x')
+        self.client.post('/api/shorten', json={"alias": "gh-pages", "url": "https://pages.example.com/site"})
+        self.client.post('/api/shorten', json={"alias": "Git", "url": "https://www.rp.edu.sg/git"})
+
+        def search(query):
+            body = self.client.get('/api/links/search', query_string={"q": query}).get_json()
+            return [(r["alias"], r["match"]) for r in body["results"]]
+
+        # Alias prefix matches rank above URL matches; the other user's link never shows up
+        self.assertEqual(search("git"), [("Git", "alias"), ("repo", "url"), ("ci", "url")])
+        self.assertEqual(search("GH"), [("gh-pages", "alias")])
+        self.assertEqual(search("c270_t3/act"), [("ci", "url")])
+        self.assertEqual(search("gi"), [("Git", "alias")])
+        self.assertEqual(search("nothing"), [])
+
+        self.client.delete('/api/delete/Git')
+        self.assertEqual(search("git"), [("repo", "url"), ("ci", "url")])
+        self.assertEqual(self.client.get('/api/links/search?q=a&limit=0').status_code, 400)
+
+    def test_bulk_shorten_persists_once_and_reports_each_item(self):
+        import app as app_module
+        from unittest import mock
+        items = [
+            {"url": "https://rp.edu.sg/a", "alias": "bulk-a"},
+            {"url": "not-a-url"},
+            {"url": "https://rp.edu.sg/ci", "alias": "ci"},
+            {"url": "https://rp.edu.sg/dup", "alias": "bulk-a"},
+            {"url": "https://rp.edu.sg/auto", "expiry": "7days"},
+        ]
+        with mock.patch.object(app_module.storage, 'put_link') as put_link, \
+                mock.patch.object(app_module.storage, 'put_links', wraps=app_module.storage.put_links) as put_links:
+            resp = self.client.post('/api/shorten/bulk', json=items)
+        put_link.assert_not_called()
+        put_links.assert_called_once()
+
+        self.assertEqual(resp.status_code, 207)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        results = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([r["status"] for r in results], [201, 400, 409, 409, 201])
+        self.assertEqual(results[1]["error"], "Invalid URL")
+        auto = results[4]["alias"]
+        self.assertIsNotNone(results[4]["expires_at"])
+
+        with open(self.data_file.name) as f:
+            saved = json.load(f)["links"]
+        self.assertEqual(saved["bulk-a"]["url"], "https://rp.edu.sg/a")
+        self.assertEqual(saved[auto]["url"], "https://rp.edu.sg/auto")
+        self.assertEqual(saved["ci"]["url"], "https://github.com/NabilFahmi16/c270_T3/actions")
+        self.assertEqual(self.client.get('/api/stats').get_json()["total_links"], 4)
+
+    def test_bulk_shorten_accepts_ndjson(self):
+        body = '{"url": "https://rp.edu.sg/1", "alias": "nd1"}\n\n{"url": "https://rp.edu.sg/2", "alias": "nd2"}\n'
+        resp = self.client.post('/api/shorten/bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual([json.loads(line)["alias"] for line in resp.get_data(as_text=True).splitlines()], ["nd1", "nd2"])
+        self.assertEqual(self.client.get('/go/nd2').status_code, 302)
+
+        bad = self.client.post('/api/shorten/bulk', data='{"url": ', content_type='application/x-ndjson')
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(self.client.post('/api/shorten/bulk', json={"url": "https://rp.edu.sg"}).status_code, 400)
+
+    def test_bulk_shorten_rejects_oversized_requests_before_parsing(self):
+        import app as app_module
+        from unittest import mock
+        for name, value in (('BULK_MAX_ITEMS', 2), ('BULK_MAX_BYTES', 200)):
+            self.addCleanup(setattr, app_module, name, getattr(app_module, name))
+            setattr(app_module, name, value)
+        with mock.patch.object(app_module, 'read_bulk_items') as read:
+            resp = self.client.post('/api/shorten/bulk', json=[{"url": "https://rp.edu.sg/" + "x" * 200}])
+        self.assertEqual(resp.status_code, 413)
+        read.assert_not_called()
+
+        body = "".join('{"url": "https://rp.edu.sg/%d"}\n' % i for i in range(3))
+        resp = self.client.post('/api/shorten/bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(resp.status_code, 413)
+        self.assertEqual(len(url_data["links"]), 2)
+
+    def test_link_search_index_prunes_removed_aliases(self):
+        from indexes import LinkSearchIndex
+        index = LinkSearchIndex()
+        ab = Link("https://example.com/ab", 0, user_id="u")
+        abc = Link("https://example.com/abc", 0, user_id="u")
+        index.load("u", {"ab": ab, "abc": abc})
+        self.assertEqual(index.search("u", "ab"), [("ab", "alias"), ("abc", "alias")])
+
+        index.remove("abc", abc)
+        self.assertEqual(index.search("u", "ab"), [("ab", "alias")])
+        self.assertNotIn("c", index.tries["u"]["a"]["b"])
+        index.remove("ab", ab)
+        self.assertEqual(index.tries["u"], {})
+        self.assertEqual(index.grams["u"], {})
+        self.assertEqual(index.texts, {})
+
+    def test_link_search_index_build_replays_concurrent_changes(self):
+        from indexes import LinkSearchIndex
+        index = LinkSearchIndex()
+        old = Link("https://example.com/old", 0, user_id="u")
+        index.begin("u")
+        built = index.build({"old": old})
+        # Made while the index was being built outside the lock
+        index.add("new", Link("https://example.com/new", 0, user_id="u"))
+        index.remove("old", old)
+        self.assertFalse(index.loaded("u"))
+        index.install("u", built)
+        self.assertEqual(index.search("u", "example"), [("new", "url")])
+        self.assertEqual(index.building, {})
+
+    def test_user_stats_applies_expiry_transitions(self):
+        from datetime import datetime, timedelta
+        from indexes import UserStats
+        now = datetime(2024, 1, 1)
+        stats = UserStats()
+        expiring = Link("https://a.example", 0, 4, "u", (now + timedelta(days=10)).isoformat())
+        stats.add("a", expiring, now.timestamp())
+        stats.add("b", Link("https://b.example", 0, 1, "u"), now.timestamp())
+
+        def at(days):
+            return stats.get("u", (now + timedelta(days=days)).timestamp())
+
+        self.assertEqual(at(0), {"total_links": 2, "total_clicks": 5, "active_links": 2, "expiring_soon": 0})
+        self.assertEqual(at(5)["expiring_soon"], 1)
+        self.assertEqual(at(11), {"total_links": 2, "total_clicks": 5, "active_links": 1, "expiring_soon": 0})
+        stats.remove("a", expiring, (now + timedelta(days=12)).timestamp())
+        self.assertEqual(at(12), {"total_links": 1, "total_clicks": 1, "active_links": 1, "expiring_soon": 0})
+
+    def test_click_series_api_reads_rollups(self):
+        import time
+        import app as app_module
+        for _ in range(3):
+            self.client.get('/go/ci', follow_redirects=False)
+        app_module.click_writer.flush()
+
+        now = time.time()
+        resp = self.client.get(f'/api/analytics/ci/clicks?start={now - 3600}&end={now}&resolution=minute')
+        self.assertEqual(resp.status_code, 200)
+        data = resp.get_json()
+        self.assertEqual(data["resolution"], "minute")
+        self.assertEqual(sum(b["clicks"] for b in data["buckets"]), 3)
+        self.assertEqual(len(data["buckets"]), 61)
+
+        resp = self.client.get(f'/api/analytics/ci/clicks?start=0&end={now}&resolution=minute')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/nope/clicks').status_code, 404)
+
+    def test_rollups_prune_minute_buckets_outside_retention(self):
+        import rollups
+        buckets = rollups.new_rollups()
+        day = 86400
+        for minute in range(0, 3 * day, 60):
+            rollups.add_click(buckets, minute)
+        self.assertLessEqual(len(buckets["minute"]), 2 * day // 60 * 11 // 10)
+        self.assertEqual(len(buckets["hour"]), 72)
+        self.assertEqual(sorted(buckets["day"].values()), [1440, 1440, 1440])
+        resolution, series = rollups.query(buckets, 0, 3 * day - 1, "day")
+        self.assertEqual([count for _, count in series], [1440, 1440, 1440])
+
+    def test_raw_clicks_are_bounded_and_archived(self):
+        import shutil
+        import app as app_module
+        from archive import ClickArchive, RawClickRetention
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        original = (app_module.raw_retention, app_module.click_archive)
+        self.addCleanup(setattr, app_module, 'raw_retention', original[0])
+        self.addCleanup(setattr, app_module, 'click_archive', original[1])
+        app_module.raw_retention = RawClickRetention(per_alias=2)
+        app_module.click_archive = ClickArchive(archive_dir)
+
+        for i in range(5):
+            self.client.get('/go/ci', follow_redirects=False, headers={'Referer': f'https://ref{i}.example'})
+        app_module.click_writer.flush()
+
+        buffered = url_data["analytics"]["ci"]["clicks"]
+        self.assertEqual([c["referrer"] for c in buffered], ['https://ref3.example', 'https://ref4.example'])
+        self.assertEqual(url_data["links"]["ci"]["clicks"], 5)
+        archived = list(app_module.click_archive.iter_events(alias="ci"))
+        self.assertEqual([e["referrer"] for e in archived], [f'https://ref{i}.example' for i in range(3)])
+        self.assertEqual(list(app_module.click_archive.iter_events(alias="repo")), [])
+
+        # A restart replaying the journal does not archive the evicted clicks again
+        from storage import JournalStorage
+        journal = self.temp_path('.journal')
+        backend = self.use_storage(JournalStorage(self.data_file.name, self.user_file.name, journal))
+        backend.save_snapshot(url_data)
+        backend.add_clicks(url_data, [("ci", {"referrer": f"https://replay{i}.example"}) for i in range(3)])
+        self.assertEqual(len(app_module.load_data()["analytics"]["ci"]["clicks"]), 2)
+        self.assertEqual(len(list(app_module.click_archive.iter_events(alias="ci"))), 3)
+
+    def test_raw_click_budget_is_shared_between_aliases(self):
+        from archive import RawClickRetention
+        retention = RawClickRetention(per_alias=100, budget=300, min_per_alias=5)
+        self.assertEqual(retention.capacity(), 100)
+        # Shared between the aliases that hold clicks
+        buffers = {f"a{i}": list(range(40)) for i in range(10)}
+        evicted = [len(retention.trim(alias, buffer)) for alias, buffer in buffers.items()]
+        # Once the budget is spent, the alias being trimmed gives up its oldest clicks
+        self.assertEqual(evicted, [0, 0, 0, 0, 0, 0, 0, 20, 40, 40])
+        self.assertEqual(retention.held, 300)
+        self.assertEqual(buffers["a7"], list(range(20, 40)))
+        self.assertNotIn("a9", retention.sizes)
+        self.assertEqual(retention.capacity(), 37)
+
+        # Clicks on the other aliases bring them down to their share
+        for alias in ("a0", "a1"):
+            buffers[alias].append(40)
+            self.assertEqual(len(retention.trim(alias, buffers[alias])), 4)
+        self.assertEqual(retention.held, 294)
+
+        retention.forget("a0")
+        self.assertEqual(retention.held, 257)
+        self.assertNotIn("a0", retention.sizes)
+
+        # The min_per_alias floor does not let the total exceed the budget
+        retention = RawClickRetention(per_alias=100, budget=300, min_per_alias=5)
+        for i in range(100):
+            retention.trim(f"b{i}", [0] * 5)
+        self.assertEqual(retention.capacity(), 5)
+        self.assertEqual(retention.held, 300)
+        self.assertEqual(len(retention.sizes), 60)
+
+    def test_export_streams_links_and_archived_clicks(self):
+        import csv
+        import io
+        import shutil
+        import app as app_module
+        from archive import ClickArchive, RawClickRetention
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        original = (app_module.raw_retention, app_module.click_archive)
+        self.addCleanup(setattr, app_module, 'raw_retention', original[0])
+        self.addCleanup(setattr, app_module, 'click_archive', original[1])
+        app_module.raw_retention = RawClickRetention(per_alias=1)
+        app_module.click_archive = ClickArchive(archive_dir)
+        url_data["links"]["other"] = Link("https://rp.edu.sg/other", 0, user_id="someoneelse")
+        app_module.rebuild_indexes()
+
+        for i in range(3):
+            self.client.get('/go/ci', headers={'Referer': f'https://ref{i}.example'})
+        self.client.get('/go/other')
+        app_module.click_writer.flush()
+
+        resp = self.client.get('/api/export?kind=links')
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        links = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([link["alias"] for link in links], ["ci", "repo"])
+        self.assertEqual(links[0]["clicks"], 3)
+        self.assertNotIn("user_id", links[0])
+
+        # Two clicks come from the archive, the latest from the in-memory buffer
+        resp = self.client.get('/api/export?kind=clicks&format=csv&alias=ci')
+        self.assertEqual(resp.mimetype, 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual([row["referrer"] for row in rows], [f'https://ref{i}.example' for i in range(3)])
+        self.assertEqual({row["alias"] for row in rows}, {"ci"})
+
+        self.assertEqual(self.client.get('/api/export?kind=clicks&alias=other').status_code, 404)
+        self.assertEqual(self.client.get('/api/export?format=xml').status_code, 400)
+
+        # A re-created alias does not inherit the deleted link's archived clicks
+        self.client.delete('/api/delete/ci')
+        self.client.post('/api/shorten', json={"alias": "ci", "url": "https://rp.edu.sg/new"})
+        resp = self.client.get('/api/export?kind=clicks&alias=ci')
+        self.assertEqual(resp.get_data(as_text=True), "")
+        self.assertIn("ci", app_module.click_archive.deletions())
+
+    def test_load_archives_clicks_trimmed_from_the_data_file_once(self):
+        import shutil
+        import app as app_module
+        from archive import ClickArchive, RawClickRetention
+        from storage import JournalStorage
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        original = (app_module.raw_retention, app_module.click_archive)
+        self.addCleanup(setattr, app_module, 'raw_retention', original[0])
+        self.addCleanup(setattr, app_module, 'click_archive', original[1])
+        app_module.click_archive = ClickArchive(archive_dir)
+        journal = self.temp_path('.journal')
+        backend = self.use_storage(JournalStorage(self.data_file.name, self.user_file.name, journal))
+
+        # A legacy data file holding every click, plus two more clicks in the journal
+        clicks = [{"timestamp": f"2024-01-0{i + 1}T10:00:00", "referrer": f"https://ref{i}.example"} for i in range(7)]
+        with open(self.data_file.name, 'w') as f:
+            json.dump({"links": {"old": {"url": "https://rp.edu.sg", "created": "2024-01-01 00:00:00", "clicks": 5}},
+                       "analytics": {"old": {"clicks": clicks[:5], "referrers": {}}}}, f)
+        with open(journal, 'w') as f:
+            for click in clicks[5:]:
+                f.write(json.dumps({"op": "click", "alias": "old", "click": click}) + "\n")
+
+        # Only the data file's overflow is archived; the journal's was archived at runtime
+        app_module.raw_retention = RawClickRetention(per_alias=3)
+        data = app_module.load_data()
+        self.assertEqual([c["referrer"] for c in data["analytics"]["old"]["clicks"]], [f'https://ref{i}.example' for i in (4, 5, 6)])
+        archived = list(app_module.click_archive.iter_events("old"))
+        self.assertEqual([e["referrer"] for e in archived], ["https://ref0.example", "https://ref1.example"])
+
+        # The trimmed state was written back, so a restart archives nothing more
+        self.assertEqual(os.path.getsize(journal), 0)
+        app_module.raw_retention = RawClickRetention(per_alias=3)
+        data = backend.load()
+        self.assertEqual(data["links"]["old"].clicks, 7)
+        app_module.load_data()
+        self.assertEqual(len(list(app_module.click_archive.iter_events("old"))), 2)
+
+    def test_import_loads_rows_in_batches(self):
+        import app as app_module
+        from unittest import mock
+        exported = self.client.get('/api/export?kind=links&format=csv').get_data()
+        self.client.delete('/api/delete/ci')
+        self.client.delete('/api/delete/repo')
+
+        extra = (b'new,https://rp.edu.sg/new,2024-02-01 00:00:00,4,,,true\nbad,ftp://nope,,,,,\n'
+                 b'neg,https://rp.edu.sg/neg,,-5,,,\nhuge,https://rp.edu.sg/huge,,18446744073709551616,,,\n')
+        with mock.patch.object(app_module, 'IMPORT_BATCH_SIZE', 2), \
+                mock.patch.object(app_module.storage, 'put_links', wraps=app_module.storage.put_links) as put_links:
+            resp = self.client.post('/api/import?kind=links', data=exported + extra, content_type='text/csv')
+        self.assertEqual(resp.get_json(), {"imported": 3, "failed": 3, "errors": [
+            {"line": 5, "error": "Invalid URL"}, {"line": 6, "error": "Invalid clicks"}, {"line": 7, "error": "Invalid clicks"}]})
+        self.assertEqual(put_links.call_count, 2)
+        self.assertEqual(url_data["links"]["ci"].url, "https://github.com/NabilFahmi16/c270_T3/actions")
+        self.assertEqual(url_data["links"]["ci"].created, "2024-01-01 00:00:00")
+        self.assertEqual(url_data["links"]["new"].clicks, 4)
+        self.assertTrue(url_data["links"]["new"].utm_tracking)
+
+        clicks = (b'{"alias": "new", "timestamp": "2024-02-02T10:00:00", "referrer": "https://a.example"}\n'
+                  b'{"alias": "nope", "timestamp": "2024-02-02T10:00:00"}\n'
+                  b'not json\n')
+        resp = self.client.post('/api/import?kind=clicks', data=clicks, content_type='application/x-ndjson')
+        self.assertEqual(resp.get_json()["imported"], 1)
+        self.assertEqual([e["error"] for e in resp.get_json()["errors"]], ["Unknown or expired alias", "Invalid JSON"])
+        self.assertEqual(url_data["links"]["new"].clicks, 5)
+        self.assertEqual(url_data["analytics"]["new"]["referrers"], {"https://a.example": 1})
+
+    def test_expired_links_move_to_cold_tier(self):
+        import time
+        from datetime import datetime, timedelta
+        import app as app_module
+        past = (datetime.now() - timedelta(minutes=1)).isoformat()
+        resp = self.client.post('/api/shorten', json={"alias": "old", "url": "https://rp.edu.sg", "expiry": past})
+        self.assertEqual(resp.status_code, 201)
+
+        # Still in the hot map until the reaper runs, but the index already answers 410
+        self.assertIn("old", url_data["links"])
+        self.assertEqual(self.client.get('/go/old').status_code, 410)
+
+        self.assertEqual(app_module.reap_expired(time.time()), ["old"])
+        self.assertNotIn("old", url_data["links"])
+        self.assertIn("old", url_data["expired"])
+        self.assertEqual(self.client.get('/go/old').status_code, 410)
+        self.assertEqual(self.client.post('/api/shorten', json={"alias": "old", "url": "https://x.example"}).status_code, 409)
+        self.assertIn(b'data-alias="old"', self.client.get('/').data)
+        self.assertEqual(self.client.get('/analytics/old').status_code, 200)
+
+        self.assertEqual(self.client.delete('/api/delete/old').status_code, 200)
+        self.assertNotIn("old", url_data["expired"])
+        self.assertEqual(self.client.get('/go/old').status_code, 404)
+
+    def test_expiry_index_pops_only_due_links(self):
+        from indexes import ExpiryIndex
+        index = ExpiryIndex()
+        index.rebuild({
+            "a": Link("https://a.example", 0, expiry_date="2024-01-01T00:00:00"),
+            "b": Link("https://b.example", 0, expiry_date="2024-03-01T00:00:00"),
+            "c": Link("https://c.example", 0),
+        })
+        index.remove("a")
+        from datetime import datetime
+        self.assertEqual(index.pop_expired(datetime(2024, 2, 1).timestamp()), [])
+        self.assertEqual(index.pop_expired(datetime(2024, 4, 1).timestamp()), ["b"])
+        self.assertIsNone(index.get("c"))
+
+    def test_link_round_trips_json_schema(self):
+        import app as app_module
+        record = {
+            "url": "https://rp.edu.sg",
+            "created": "2024-01-01 00:00:00",
+            "clicks": 7,
+            "user_id": self.test_user_id,
+            "expiry_date": "2030-01-01T12:30:00.250000",
+            "password": "secret",
+            "utm_tracking": True
+        }
+        link = Link.from_dict(record)
+        self.assertEqual(link.to_dict(), record)
+        self.assertIsInstance(link.created_at, int)
+        self.assertIs(link.user_id, Link.from_dict(dict(record)).user_id)
+        self.assertEqual(link["clicks"], 7)
+        self.assertFalse(hasattr(link, "__dict__"))
+
+        url_data["links"]["rt"] = link
+        app_module.save_data()
+        with open(self.data_file.name) as f:
+            self.assertEqual(json.load(f)["links"]["rt"], record)
+        self.assertEqual(app_module.load_data()["links"]["rt"], link)
+
+    def test_alias_allocator_leases_disjoint_blocks(self):
+        from aliases import AliasAllocator, FileLeaseStore, FeistelPermutation, SqliteLeaseStore
+        for store in (FileLeaseStore(self.temp_path('.json')), SqliteLeaseStore(self.temp_path('.db'))):
+            first = AliasAllocator(store, block_size=10, shuffle_key="k")
+            second = AliasAllocator(store, block_size=10, shuffle_key="k")
+            issued = [first.next_alias() for _ in range(15)] + [second.next_alias() for _ in range(15)]
+            self.assertEqual(len(set(issued)), 30)
+            self.assertTrue(all(len(a) == 6 and a.isalnum() for a in issued))
+            self.assertEqual(second.next_value, 35)
+
+        permute = FeistelPermutation(1000, "k")
+        self.assertEqual(sorted(permute(n) for n in range(1000)), list(range(1000)))
+
+    def test_counter_alias_mode_in_shorten_and_register(self):
+        import app as app_module
+        from aliases import AliasAllocator, FileLeaseStore
+        store = FileLeaseStore(self.temp_path('.json'))
+        self.addCleanup(setattr, app_module, 'alias_allocator', app_module.alias_allocator)
+        self.addCleanup(setattr, app_module, 'user_id_allocator', app_module.user_id_allocator)
+        app_module.alias_allocator = AliasAllocator(store, "links", 6, 100)
+        app_module.user_id_allocator = AliasAllocator(store, "users", 8, 100)
+
+        # A custom alias that already holds the first counter value is skipped
+        self.client.post('/api/shorten', json={"alias": "aaaaaa", "url": "https://rp.edu.sg"})
+        resp = self.client.post('/api/shorten', json={"url": "https://rp.edu.sg"})
+        self.assertEqual(resp.get_json()["alias"], "aaaaab")
+        self.client.post('/register', data={"username": "n", "email": "n@x.example", "password": "p"})
+        self.assertEqual(users["n"]["id"], "aaaaaaaa")
+
+    def test_redirect_cache_hits_and_invalidation(self):
+        import app as app_module
+        cache = app_module.redirect_cache
+        before = cache.stats()
+        first = self.client.get('/go/ci', follow_redirects=False)
+        second = self.client.get('/go/ci', follow_redirects=False)
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second.location, first.location)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(cache.stats()["hits"] - before["hits"], 1)
+        self.assertEqual(cache.stats()["misses"] - before["misses"], 1)
+        app_module.click_writer.flush()
+        self.assertEqual(url_data["links"]["ci"]["clicks"], 2)
+
+        self.client.delete('/api/delete/ci')
+        self.assertEqual(self.client.get('/go/ci').status_code, 404)
+
+        # Password and UTM links depend on the request, so they are never cached
+        self.client.post('/api/shorten', json={"alias": "utm", "url": "https://rp.edu.sg", "utm_tracking": True})
+        self.client.get('/go/utm', follow_redirects=False)
+        self.assertIsNone(cache.get("utm", 0))
+
+    def test_shared_alias_index_publish_merge_and_reload(self):
+        from alias_index import EXPIRED_BIT, SharedAliasIndex, publish, read_entries
+        path = self.temp_path('.idx')
+        os.unlink(path)
+        self.addCleanup(lambda: [os.unlink(p) for p in (path + '.lock', path + '.delta') if os.path.exists(p)])
+        reader = SharedAliasIndex(path, check_interval=3600)
+        self.assertIsNone(reader.get("a"))
+
+        base = {f"a{i}": (f"https://example.com/{i}", 0, None) for i in range(50)}
+        self.assertEqual(publish(path, {}, base), 1)
+        reader.reload()
+        self.assertEqual(reader.get("a7"), ("https://example.com/7", 0, None))
+        self.assertIsNone(reader.get("missing"))
+
+        # Another process merges its changes into the published generation: appended to the
+        # delta, the base table is left alone
+        base_inode = os.stat(path).st_ino
+        publish(path, {"a7": None, "new": ("https://new.example", EXPIRED_BIT | 2, 1700000000.5)})
+        self.assertEqual(os.stat(path).st_ino, base_inode)
+        self.assertEqual(reader.get("a7"), ("https://example.com/7", 0, None))
+        self.assertTrue(reader.reload())
+        self.assertEqual(reader.generation, 2)
+        self.assertIsNone(reader.get("a7"))
+        self.assertEqual(reader.get("new"), ("https://new.example", EXPIRED_BIT | 2, 1700000000.5))
+        self.assertEqual(len(read_entries(path)[1]), 50)
+
+        # A delta larger than the base is folded into a new base
+        import alias_index
+        self.addCleanup(setattr, alias_index, 'COMPACT_MIN_BYTES', alias_index.COMPACT_MIN_BYTES)
+        alias_index.COMPACT_MIN_BYTES = 0
+        publish(path, {f"b{i}": ("https://b.example", 0, None) for i in range(100)})
+        self.assertNotEqual(os.stat(path).st_ino, base_inode)
+        self.assertTrue(reader.reload())
+        self.assertEqual(reader.overlay, {})
+        self.assertEqual(reader.get("b99"), ("https://b.example", 0, None))
+        self.assertIsNone(reader.get("a7"))
+        self.assertEqual(len(read_entries(path)[1]), 150)
+
+    def test_go_resolves_through_shared_alias_index(self):
+        import app as app_module
+        from alias_index import SharedAliasIndex, publish
+        path = self.temp_path('.idx')
+        self.addCleanup(lambda: [os.unlink(p) for p in (path + '.lock', path + '.delta') if os.path.exists(p)])
+        os.unlink(path)
+        import time
+        index = SharedAliasIndex(path, 0, app_module.invalidate_redirects)
+        for name, value in (('ALIAS_INDEX_FILE', path), ('shared_index', index),
+                            ('unpublished_aliases', {})):
+            self.addCleanup(setattr, app_module, name, getattr(app_module, name))
+            setattr(app_module, name, value)
+        app_module.publish_alias_index(full=True)
+
+        # Published by another worker: this process has never seen it in url_data
+        publish(path, {"remote": ("https://remote.example/landing", 0, None)})
+        resp = self.client.get('/go/remote')
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, "https://remote.example/landing")
+
+        # Deleted by another worker: the index is authoritative over this process's url_data,
+        # and the redirect this worker cached is dropped
+        self.assertEqual(self.client.get('/go/repo').status_code, 302)
+        self.assertIsNotNone(app_module.redirect_cache.get("repo", time.time()))
+        publish(path, {"repo": None})
+        self.assertIn("repo", url_data["links"])
+        self.assertEqual(self.client.get('/go/repo').status_code, 404)
+
+        # JSON storage cannot record clicks on links this process does not hold
+        writer = app_module.click_writer
+        skipped = writer.skipped
+        self.assertEqual(app_module.write_clicks([("remote", 1700000000, "1.2.3.4", "ua", "")]), 0)
+        writer.write([("remote", 1700000000, "1.2.3.4", "ua", "")])
+        self.assertEqual(writer.skipped, skipped + 1)
+
+        # Local changes are served from url_data until they are published
+        self.client.post('/api/shorten', json={"alias": "fresh", "url": "https://rp.edu.sg/fresh"})
+        self.client.delete('/api/delete/ci')
+        self.assertEqual(set(app_module.unpublished_aliases), {"fresh", "ci"})
+        self.assertEqual(self.client.get('/go/fresh').status_code, 302)
+        self.assertEqual(self.client.get('/go/ci').status_code, 404)
+
+        app_module.publish_alias_index()
+        self.assertEqual(app_module.unpublished_aliases, {})
+        self.assertEqual(app_module.shared_index.get("fresh")[0], "https://rp.edu.sg/fresh")
+        self.assertIsNone(app_module.shared_index.get("ci"))
+        self.assertIsNotNone(app_module.shared_index.get("remote"))
+
+    def test_redirect_cache_ttl_and_lru_bounds(self):
+        from redirect_cache import RedirectCache
+        cache = RedirectCache(max_size=2, ttl=60)
+        cache.put("a", "https://a.example", b"", now=0, expiry=10)
+        cache.put("b", "https://b.example", b"", now=0)
+        self.assertIsNotNone(cache.get("a", 5))
+        self.assertIsNone(cache.get("a", 11))
+        cache.put("c", "https://c.example", b"", now=0)
+        cache.put("d", "https://d.example", b"", now=0)
+        self.assertIsNone(cache.get("b", 1))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_redirect_cache_skips_put_after_concurrent_delete(self):
+        import time
+        import app as app_module
+        from unittest import mock
+        resolve_alias = app_module.resolve_alias
+
+        def delete_after_lookup(alias):
+            # The link is deleted between the lookup and the cache put
+            entry = resolve_alias(alias)
+            with app.test_client() as other:
+                with other.session_transaction() as sess:
+                    sess['user_id'] = self.test_user_id
+                self.assertEqual(other.delete(f'/api/delete/{alias}').status_code, 200)
+            return entry
+
+        with mock.patch.object(app_module, 'resolve_alias', side_effect=delete_after_lookup):
+            self.assertEqual(self.client.get('/go/ci').status_code, 302)
+        self.assertIsNone(app_module.redirect_cache.get("ci", time.time()))
+        self.assertEqual(self.client.get('/go/ci').status_code, 404)
+
+    def test_templates_are_compiled_once(self):
+        import app as app_module
+        from unittest import mock
+        with mock.patch.object(app_module.app.jinja_env, 'from_string') as from_string:
+            self.assertEqual(self.client.get('/').status_code, 200)
+            self.assertEqual(self.client.get('/analytics/ci').status_code, 200)
+            self.assertEqual(self.client.get('/login').data, app_module.LOGIN_PAGE)
+        from_string.assert_not_called()
+
+        page = self.client.get('/analytics/ci').data
+        self.assertIn(b'<h2>Analytics for ci</h2>', page)
+        self.assertIn(b"label: 'Clicks per day'", page)
+
+    def test_static_assets_are_hashed_and_cacheable(self):
+        import gzip
+        import app as app_module
+        url = app_module.assets.url('home.css')
+        self.assertRegex(url, r'^/assets/home\.[0-9a-f]{12}\.css$')
+        self.assertIn(url.encode(), self.client.get('/').data)
+        self.assertNotIn(b'<style>', app_module.LOGIN_PAGE)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertNotIn('Content-Encoding', response.headers)
+        with open(os.path.join(app_module.app.root_path, 'static', 'home.css'), 'rb') as f:
+            self.assertEqual(response.data, f.read())
+
+        compressed = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.data), response.data)
+
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.client.get('/assets/home.000000000000.css').status_code, 404)
+
+    def test_migrate_json_to_sqlite(self):
+        from storage import SqliteStorage, migrate_json_to_sqlite
+        url_data["analytics"]["ci"]["clicks"].append({"timestamp": "2024-01-02T00:00:00", "referrer": None})
+        # Like a data file from before rollups were kept, the analytics only have raw clicks
+        self.assertNotIn("rollups", url_data["analytics"]["ci"])
+        import app as app_module
+        app_module.save_data()
+        db = self.temp_path('.db')
+        self.assertEqual(migrate_json_to_sqlite(self.data_file.name, self.user_file.name, db), (2, 1))
+
+        migrated = SqliteStorage(db)
+        self.addCleanup(migrated.close)
+        self.assertEqual(set(migrated.load()["links"]), {"ci", "repo"})
+        self.assertEqual(migrated.load_users()["testuser"]["id"], self.test_user_id)
+        self.assertEqual(len(migrated.click_events(None, "ci")), 1)
+        from datetime import datetime
+        day = int(datetime.fromisoformat("2024-01-02T00:00:00").timestamp()) // 86400 * 86400
+        self.assertEqual(migrated.load()["analytics"]["ci"]["rollups"]["day"], {str(day): 1})
+
+    def test_sqlite_prunes_rollups_past_retention(self):
+        from storage import SqliteStorage
+        backend = SqliteStorage(self.temp_path('.db'))
+        self.addCleanup(backend.close)
+        backend.save_snapshot(url_data)
+        backend.add_clicks(url_data, [("ci", {"timestamp": "2024-01-01T00:00:00"})])
+        backend.add_clicks(url_data, [("ci", {"timestamp": "2024-01-05T00:00:00"})])
+        buckets = backend.load()["analytics"]["ci"]["rollups"]
+        self.assertEqual(len(buckets["minute"]), 1)
+        self.assertEqual(len(buckets["hour"]), 2)
+        self.assertEqual(len(buckets["day"]), 2)
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)